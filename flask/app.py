@@ -1,15 +1,29 @@
-from flask import Flask, jsonify, render_template, request, redirect, url_for, session, flash
+from flask import Flask, Response, jsonify, render_template, request, redirect, url_for, session, flash, g, has_app_context
 import sqlite3
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 import random
 import os
+import numpy as np
+from PIL import Image, ImageOps, features
 import time
 import json
+import base64
+import hashlib
+import queue
 import secrets
+import tempfile
+import threading
+import asyncio
+import contextvars
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FuturesTimeout
+from datetime import datetime, timezone
+from functools import wraps
 import urllib.parse
-import urllib.request
-import urllib.error
+
+import http_client
 
 
 def load_local_env():
@@ -33,18 +47,205 @@ def load_local_env():
 
 load_local_env()
 
-app = Flask(__name__)
+
+class AsyncViewLoop:
+    """The event loop ``async def`` views run on: one per process, on a daemon thread.
+
+    Every async view in the process shares it, and with it http_client's
+    async connection pool, so their upstream awaits overlap instead of
+    each getting a throwaway loop.  Coroutines run in the calling thread's
+    context, so ``request``, ``session`` and ``g`` work as usual.  Blocking
+    work (SQLite included) goes through ``asyncio.to_thread``.
+
+    Flask is a WSGI app, so the server thread that called the view still
+    waits, idle, until the coroutine finishes: an in-flight upstream call
+    costs one thread (see asgi.py for what that means for sizing).
+    """
+
+    def __init__(self):
+        self._loop = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _running_loop(self):
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="async-views", daemon=True).start()
+            return self._loop
+
+    def run(self, coro):
+        """Run ``coro`` on the loop and block the calling thread until it finishes."""
+        loop = self._running_loop()
+        done = Future()
+
+        def settle(task):
+            if task.cancelled():
+                done.cancel()
+            elif task.exception() is not None:
+                done.set_exception(task.exception())
+            else:
+                done.set_result(task.result())
+
+        def start():
+            # create_task copies the current context, which is the caller's here.
+            loop.create_task(coro).add_done_callback(settle)
+
+        loop.call_soon_threadsafe(start, context=contextvars.copy_context())
+        return done.result()
+
+
+async_view_loop = AsyncViewLoop()
+
+
+class SocialSyncApp(Flask):
+    def async_to_sync(self, func):
+        """Run async views on the shared loop rather than a new one per call."""
+        @wraps(func)
+        def run(*args, **kwargs):
+            return async_view_loop.run(func(*args, **kwargs))
+        return run
+
+
+app = SocialSyncApp(__name__)
 app.secret_key = (os.environ.get("SECRET_KEY") or "Qwe123!@#").strip()  # Use env in production
 
 UPLOAD_FOLDER = os.path.join(app.root_path, "static", "uploads")
 app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
 os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
 # --- Database Setup ---
+DATABASE_PATH = (os.environ.get("DATABASE_PATH") or "users.db").strip()
+DB_POOL_SIZE = 8
+DB_BUSY_TIMEOUT_MS = 5000
+DB_CACHE_SIZE_KB = 16384
+DB_MMAP_SIZE = 64 * 1024 * 1024
+DB_STATEMENT_CACHE_SIZE = 256
+
+
+class PooledConnection(sqlite3.Connection):
+    """SQLite connection that goes back to the pool instead of being closed.
+
+    Handlers keep calling ``conn.close()`` as before; inside a request that
+    only discards uncommitted work, and the connection is returned to the
+    pool when the app context tears down.
+    """
+
+    def close(self):
+        if self.in_transaction:
+            self.rollback()
+        if getattr(self, "_release_on_close", False):
+            self._release_on_close = False
+            db_pool.release(self)
+
+    def remove_on_rollback(self, path):
+        """Delete ``path`` if the open transaction is rolled back instead of committed."""
+        self._rollback_files = getattr(self, "_rollback_files", []) + [path]
+
+    def commit(self):
+        sqlite3.Connection.commit(self)
+        self._rollback_files = []
+
+    def rollback(self):
+        # Removed while the write lock is still held, so no other writer
+        # can see the file and skip placing its own copy.
+        for path in getattr(self, "_rollback_files", ()):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self._rollback_files = []
+        sqlite3.Connection.rollback(self)
+
+    def close_for_real(self):
+        sqlite3.Connection.close(self)
+
+
+class ConnectionPool:
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self._idle = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            factory=PooledConnection,
+            timeout=DB_BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+            cached_statements=DB_STATEMENT_CACHE_SIZE
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+        conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    def acquire(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked worker: never share the parent's SQLite handles.
+                self._idle = []
+                self._pid = os.getpid()
+            if self._idle:
+                return self._idle.pop()
+        return self._connect()
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            if self._pid == os.getpid() and len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        conn.close_for_real()
+
+
+db_pool = ConnectionPool(DATABASE_PATH, DB_POOL_SIZE)
+
+
 def get_db():
-    return sqlite3.connect("users.db")
-def init_db():
-    conn = get_db()
-    cursor = conn.cursor()
+    """Return this request's pooled connection (tuned once, reused across requests).
+
+    Repeated SQL strings hit the connection's prepared-statement cache
+    (``cached_statements``), which survives across requests because the
+    connection itself does.  Outside an app context the caller owns the
+    connection until it calls ``close()``.
+    """
+    if not has_app_context():
+        conn = db_pool.acquire()
+        conn._release_on_close = True
+        return conn
+    if "db" not in g:
+        g.db = db_pool.acquire()
+    return g.db
+
+
+def release_request_db():
+    """Give this request's connection back to the pool before it is done.
+
+    Async views call this before awaiting an upstream service so a slow
+    remote doesn't pin one SQLite connection per in-flight request; a later
+    ``get_db()`` picks up a fresh one.
+    """
+    conn = g.pop("db", None)
+    if conn is not None:
+        db_pool.release(conn)
+
+
+@app.teardown_appcontext
+def release_db(exc):
+    release_request_db()
+
+
+NOTIFICATIONS_PER_USER = 50
+
+
+def _migration_base_schema(cursor):
     cursor.execute('''CREATE TABLE IF NOT EXISTS users (
                         id INTEGER PRIMARY KEY AUTOINCREMENT,
                         username TEXT NOT NULL,
@@ -173,14 +374,479 @@ def init_db():
             FOREIGN KEY(user_id) REFERENCES users(id)
         )
         ''')
-    conn.commit()
+
+
+def _migration_hot_path_indexes(cursor):
+    # Each index mirrors a WHERE/ORDER BY used by the handlers below.
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_messages_receiver_sender_read "
+        "ON messages(receiver_id, sender_id, is_read)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_messages_sender_receiver_created "
+        "ON messages(sender_id, receiver_id, created_at, id)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_messages_receiver_created "
+        "ON messages(receiver_id, created_at, id)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_posts_user_status_created "
+        "ON posts(user_id, status, created_at)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_posts_status_created "
+        "ON posts(status, created_at, id)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_blocked_users_blocked_user "
+        "ON blocked_users(blocked_user_id, user_id)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_live_sessions_user_ended "
+        "ON live_sessions(user_id, ended_at)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_live_sessions_active "
+        "ON live_sessions(started_at) WHERE ended_at IS NULL"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_tasks_user "
+        "ON tasks(user_id)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_campaigns_user_created "
+        "ON campaigns(user_id, created_at)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_password_resets_user "
+        "ON password_resets(user_id)"
+    )
+
+
+def _migration_conversation_summaries(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS conversations (
+            user_id INTEGER NOT NULL,
+            peer_id INTEGER NOT NULL,
+            last_message_id INTEGER NOT NULL,
+            last_text TEXT,
+            last_time TIMESTAMP,
+            unread_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY(user_id, peer_id),
+            FOREIGN KEY(user_id) REFERENCES users(id),
+            FOREIGN KEY(peer_id) REFERENCES users(id)
+        ) WITHOUT ROWID
+        ''')
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_conversations_user_recent "
+        "ON conversations(user_id, last_time DESC, last_message_id DESC)"
+    )
+    cursor.execute(
+        """
+        WITH sides AS (
+            SELECT id, sender_id AS user_id, receiver_id AS peer_id,
+                   body, created_at, 0 AS unread
+            FROM messages
+            UNION ALL
+            SELECT id, receiver_id, sender_id,
+                   body, created_at, CASE WHEN is_read = 0 THEN 1 ELSE 0 END
+            FROM messages
+        ),
+        ranked AS (
+            SELECT
+                user_id, peer_id, id, body, created_at,
+                ROW_NUMBER() OVER (
+                    PARTITION BY user_id, peer_id
+                    ORDER BY created_at DESC, id DESC
+                ) AS rn,
+                SUM(unread) OVER (PARTITION BY user_id, peer_id) AS unread_count
+            FROM sides
+            WHERE user_id != peer_id
+        )
+        INSERT OR REPLACE INTO conversations
+            (user_id, peer_id, last_message_id, last_text, last_time, unread_count)
+        SELECT user_id, peer_id, id, body, created_at, unread_count
+        FROM ranked
+        WHERE rn = 1
+        """
+    )
+
+
+def _migration_notifications(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS notifications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,  -- message / post
+            actor_id INTEGER NOT NULL,
+            ref_id INTEGER NOT NULL,
+            preview TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(user_id) REFERENCES users(id),
+            FOREIGN KEY(actor_id) REFERENCES users(id)
+        )
+        ''')
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_notifications_user_recent "
+        "ON notifications(user_id, created_at DESC, id DESC)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_notifications_kind_ref "
+        "ON notifications(kind, ref_id)"
+    )
+    cursor.execute(
+        """
+        INSERT INTO notifications (user_id, kind, actor_id, ref_id, preview, created_at)
+        SELECT m.receiver_id, 'message', m.sender_id, m.id, m.body, m.created_at
+        FROM messages m
+        WHERE NOT EXISTS (
+            SELECT 1 FROM blocked_users b
+            WHERE (b.user_id = m.receiver_id AND b.blocked_user_id = m.sender_id)
+               OR (b.user_id = m.sender_id AND b.blocked_user_id = m.receiver_id)
+        )
+        """
+    )
+    cursor.execute(
+        """
+        INSERT INTO notifications (user_id, kind, actor_id, ref_id, preview, created_at)
+        SELECT u.id, 'post', p.user_id, p.id, p.caption, p.created_at
+        FROM (
+            SELECT id, user_id, caption, created_at
+            FROM posts
+            WHERE status = 'published'
+            ORDER BY created_at DESC, id DESC
+            LIMIT ?
+        ) p
+        JOIN users u ON u.id != p.user_id
+        WHERE NOT EXISTS (
+            SELECT 1 FROM blocked_users b
+            WHERE (b.user_id = u.id AND b.blocked_user_id = p.user_id)
+               OR (b.user_id = p.user_id AND b.blocked_user_id = u.id)
+        )
+        """,
+        (NOTIFICATIONS_PER_USER * 4,)
+    )
+    cursor.execute(
+        """
+        DELETE FROM notifications
+        WHERE id IN (
+            SELECT id FROM (
+                SELECT id, ROW_NUMBER() OVER (
+                    PARTITION BY user_id ORDER BY created_at DESC, id DESC
+                ) AS rn
+                FROM notifications
+            )
+            WHERE rn > ?
+        )
+        """,
+        (NOTIFICATIONS_PER_USER,)
+    )
+
+
+def _migration_username_search_index(cursor):
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_users_username_nocase "
+        "ON users(username COLLATE NOCASE, id)"
+    )
+
+
+def _migration_user_counters(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_counters (
+            user_id INTEGER PRIMARY KEY,
+            unread_messages INTEGER NOT NULL DEFAULT 0,
+            seen_notification_id INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )
+        ''')
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_notifications_user_id "
+        "ON notifications(user_id, id)"
+    )
+    cursor.execute(
+        """
+        INSERT OR REPLACE INTO user_counters (user_id, unread_messages, seen_notification_id)
+        SELECT
+            u.id,
+            COALESCE((SELECT SUM(unread_count) FROM conversations WHERE user_id = u.id), 0),
+            COALESCE((SELECT MAX(id) FROM notifications WHERE user_id = u.id), 0)
+        FROM users u
+        """
+    )
+
+
+def _migration_live_totals(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS live_totals (
+            user_id INTEGER PRIMARY KEY,
+            streamed_seconds REAL NOT NULL DEFAULT 0,
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )
+        ''')
+    cursor.execute(
+        """
+        INSERT OR REPLACE INTO live_totals (user_id, streamed_seconds)
+        SELECT user_id, SUM((julianday(ended_at) - julianday(started_at)) * 86400)
+        FROM live_sessions
+        WHERE ended_at IS NOT NULL
+        GROUP BY user_id
+        """
+    )
+
+
+def _migration_metrics_store(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS metric_samples (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            platform TEXT NOT NULL,
+            metric TEXT NOT NULL,
+            ts INTEGER NOT NULL,  -- unix seconds
+            value REAL NOT NULL,
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )
+        ''')
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_metric_samples_series "
+        "ON metric_samples(user_id, platform, metric, ts)"
+    )
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS metric_rollups (
+            user_id INTEGER NOT NULL,
+            platform TEXT NOT NULL,
+            metric TEXT NOT NULL,
+            bucket TEXT NOT NULL,  -- hour / day / week
+            bucket_start INTEGER NOT NULL,
+            sample_count INTEGER NOT NULL,
+            value_sum REAL NOT NULL,
+            value_min REAL NOT NULL,
+            value_max REAL NOT NULL,
+            last_ts INTEGER NOT NULL,
+            last_value REAL NOT NULL,
+            PRIMARY KEY(user_id, platform, bucket, metric, bucket_start)
+        ) WITHOUT ROWID
+        ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS metric_rollup_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            last_sample_id INTEGER NOT NULL DEFAULT 0
+        )
+        ''')
+    cursor.execute("INSERT OR IGNORE INTO metric_rollup_state (id, last_sample_id) VALUES (1, 0)")
+
+
+def _migration_trends_cache(cursor):
+    # Shared by every worker: the trending list plus a refresh lease, and
+    # the validators needed to revalidate GitHub responses with a 304.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS trends_cache (
+            key TEXT PRIMARY KEY,
+            payload TEXT,
+            fetched_at REAL NOT NULL DEFAULT 0,
+            failed_at REAL NOT NULL DEFAULT 0,
+            lease_until REAL NOT NULL DEFAULT 0
+        )
+        ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS github_http_cache (
+            url TEXT PRIMARY KEY,
+            etag TEXT NOT NULL,
+            body TEXT NOT NULL,
+            fetched_at REAL NOT NULL
+        )
+        ''')
+
+
+def _migration_ai_admission(cursor):
+    # Outbound AI calls in flight across all workers (rows expire if a worker
+    # dies holding one) and each user's token bucket.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ai_inflight (
+            token TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            expires_at REAL NOT NULL
+        )
+        ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ai_rate_buckets (
+            user_id INTEGER PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+        ''')
+
+
+def _migration_ai_conversations(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ai_conversations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            summary TEXT NOT NULL DEFAULT '',
+            summarized_through INTEGER NOT NULL DEFAULT 0,  -- last ai_messages.id folded into summary
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )
+        ''')
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_ai_conversations_user ON ai_conversations(user_id)"
+    )
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ai_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            conversation_id INTEGER NOT NULL,
+            role TEXT NOT NULL,  -- user / assistant
+            content TEXT NOT NULL,
+            tokens INTEGER NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(conversation_id) REFERENCES ai_conversations(id)
+        )
+        ''')
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_ai_messages_conversation ON ai_messages(conversation_id, id)"
+    )
+
+
+# (table, column) pairs that can hold a static/uploads path.
+UPLOAD_REFERENCES = (("posts", "image_path"), ("campaigns", "image_path"), ("users", "profile_image"))
+
+
+def _migration_upload_blobs(cursor):
+    # One row per stored file; refcount is kept by triggers on every column
+    # in UPLOAD_REFERENCES.  Files saved before this migration have no
+    # digest but are counted all the same.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS upload_blobs (
+            path TEXT PRIMARY KEY,
+            digest TEXT,  -- sha256 hex
+            size INTEGER,
+            refcount INTEGER NOT NULL DEFAULT 0,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+    cursor.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_upload_blobs_digest "
+        "ON upload_blobs(digest) WHERE digest IS NOT NULL"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_upload_blobs_unreferenced "
+        "ON upload_blobs(path) WHERE refcount <= 0"
+    )
+    for table, column in UPLOAD_REFERENCES:
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_upload_insert AFTER INSERT ON {table}
+            BEGIN
+                UPDATE upload_blobs SET refcount = refcount + 1 WHERE path = NEW.{column};
+            END
+            """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_upload_delete AFTER DELETE ON {table}
+            BEGIN
+                UPDATE upload_blobs SET refcount = refcount - 1 WHERE path = OLD.{column};
+            END
+            """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_upload_update AFTER UPDATE OF {column} ON {table}
+            WHEN OLD.{column} IS NOT NEW.{column}
+            BEGIN
+                UPDATE upload_blobs SET refcount = refcount - 1 WHERE path = OLD.{column};
+                UPDATE upload_blobs SET refcount = refcount + 1 WHERE path = NEW.{column};
+            END
+            """)
+    references = " UNION ALL ".join(
+        f"SELECT {column} AS path FROM {table}" for table, column in UPLOAD_REFERENCES
+    )
+    cursor.execute(f"""
+        INSERT OR IGNORE INTO upload_blobs (path, refcount)
+        SELECT path, COUNT(*) FROM ({references})
+        WHERE path LIKE 'static/uploads/%'
+        GROUP BY path
+        """)
+
+
+def _migration_upload_variants(cursor):
+    # variants is the image pipeline's JSON map {width: {format: path}}.
+    # NULL means not processed yet and '{}' means there is nothing to
+    # offer (not an image, or it failed to decode).  variants_claimed_at
+    # leases a row to one worker at a time.
+    cursor.execute("ALTER TABLE upload_blobs ADD COLUMN variants TEXT")
+    cursor.execute("ALTER TABLE upload_blobs ADD COLUMN variants_claimed_at REAL")
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_upload_blobs_pending_variants "
+        "ON upload_blobs(created_at) WHERE variants IS NULL"
+    )
+
+
+def _migration_drop_ai_admission(cursor):
+    # AI admission slots and token buckets moved to their own database
+    # (AI_ADMISSION_DB_PATH).
+    cursor.execute("DROP TABLE IF EXISTS ai_inflight")
+    cursor.execute("DROP TABLE IF EXISTS ai_rate_buckets")
+
+
+# Append-only: the position in this list is the schema version stored in
+# PRAGMA user_version, so never reorder or edit a shipped migration.
+MIGRATIONS = [
+    _migration_base_schema,
+    _migration_hot_path_indexes,
+    _migration_conversation_summaries,
+    _migration_notifications,
+    _migration_username_search_index,
+    _migration_user_counters,
+    _migration_live_totals,
+    _migration_metrics_store,
+    _migration_trends_cache,
+    _migration_ai_admission,
+    _migration_ai_conversations,
+    _migration_upload_blobs,
+    _migration_upload_variants,
+    _migration_drop_ai_admission,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def get_schema_version(conn):
+    return int(conn.execute("PRAGMA user_version").fetchone()[0])
+
+
+def init_db():
+    """Apply pending migrations; a no-op read of user_version when current."""
+    conn = get_db()
+    try:
+        if get_schema_version(conn) >= SCHEMA_VERSION:
+            return
+        # Take the write lock first so concurrent workers apply each step once.
+        conn.execute("BEGIN IMMEDIATE")
+        version = get_schema_version(conn)
+        cursor = conn.cursor()
+        for index in range(version, SCHEMA_VERSION):
+            MIGRATIONS[index](cursor)
+            cursor.execute(f"PRAGMA user_version={index + 1}")
+        conn.commit()
+        cursor.execute("ANALYZE")
+    finally:
+        conn.close()
+
+
+@app.cli.command("migrate")
+def migrate_command():
+    """Run database migrations (flask --app app migrate)."""
+    init_db()
+    conn = get_db()
+    print(f"Schema version {get_schema_version(conn)}")
     conn.close()
 
-init_db()
+
+if (os.environ.get("AUTO_MIGRATE") or "1").strip() != "0":
+    init_db()
 
 TREND_CACHE_SECONDS = 900
-trend_cache_data = None
-trend_cache_time = 0
+# Refresh in the background once the data is this old, ahead of expiry.
+TREND_REFRESH_AHEAD_SECONDS = 720
+TREND_RETRY_SECONDS = 60
+TREND_REFRESH_LEASE_SECONDS = 60
+TREND_COLD_WAIT_SECONDS = 10
 
 
 def get_fallback_creators():
@@ -218,190 +884,1611 @@ def get_fallback_creators():
     ]
 
 
-def _safe_github_json(url):
-    req = urllib.request.Request(
-        url,
-        headers={
-            "User-Agent": "SocialSync-App",
-            "Accept": "application/vnd.github+json"
-        }
-    )
-    with urllib.request.urlopen(req, timeout=8) as response:
-        return json.loads(response.read().decode("utf-8"))
+def _github_request_headers(url):
+    """Headers for a GitHub GET plus the stored (etag, body) row, if any."""
+    headers = {
+        "User-Agent": "SocialSync-App",
+        "Accept": "application/vnd.github+json"
+    }
+    conn = get_db()
+    try:
+        cached = conn.execute(
+            "SELECT etag, body FROM github_http_cache WHERE url=?", (url,)
+        ).fetchone()
+    finally:
+        conn.close()
+    if cached:
+        headers["If-None-Match"] = cached[0]
+    return headers, cached
+
+
+async def _safe_github_json(urls):
+    """GET GitHub API URLs concurrently, revalidating stored copies with If-None-Match.
+
+    GitHub answers an unchanged resource with 304, which doesn't count
+    against the rate limit, and the stored body is returned instead.
+    Returns one parsed body or exception per URL.  The cache is read
+    before and written after the fetches, each in one trip off the loop.
+    """
+    prepared = await asyncio.to_thread(lambda: [_github_request_headers(url) for url in urls])
+    responses = await asyncio.gather(
+        *(http_client.arequest("GET", url, headers=headers, timeout=8)
+          for url, (headers, _) in zip(urls, prepared)),
+        return_exceptions=True
+    )
+
+    def store():
+        results = []
+        for url, (_, cached), response in zip(urls, prepared, responses):
+            if isinstance(response, Exception):
+                results.append(response)
+                continue
+            try:
+                results.append(_github_response_json(url, response, cached))
+            except Exception as err:
+                results.append(err)
+        return results
+
+    return await asyncio.to_thread(store)
+
+
+def _github_response_json(url, response, cached):
+    if response.status == 304 and cached:
+        return json.loads(cached[1])
+    body = response.text
+    etag = response.headers.get("ETag")
+
+    payload = json.loads(body)
+    if etag:
+        conn = get_db()
+        try:
+            conn.execute(
+                """
+                INSERT INTO github_http_cache (url, etag, body, fetched_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(url) DO UPDATE SET
+                    etag=excluded.etag, body=excluded.body, fetched_at=excluded.fetched_at
+                """,
+                (url, etag, body, time.time())
+            )
+            conn.commit()
+        finally:
+            conn.close()
+    return payload
+
+
+TRENDING_SEARCH_URL = (
+    "https://api.github.com/search/users"
+    f"?q={urllib.parse.quote('followers:>1000')}&sort=followers&order=desc&per_page=8"
+)
+
+
+async def fetch_trending_creators():
+    search, = await _safe_github_json([TRENDING_SEARCH_URL])
+    if isinstance(search, Exception):
+        raise search
+    items = search.get("items", [])
+    results = await _safe_github_json([item.get("url") for item in items])
+    # One slow or failing profile shouldn't sink the whole list.
+    all_details = [{} if isinstance(details, Exception) else details for details in results]
+    return _trending_creators(items, all_details)
+
+
+def _trending_creators(items, all_details):
+    creators = []
+    for item, details in zip(items, all_details):
+        followers = int(details.get("followers") or 0)
+        creators.append({
+            "username": details.get("login") or item.get("login") or "unknown",
+            "name": details.get("name") or details.get("login") or "Unknown Creator",
+            "avatar_url": details.get("avatar_url") or item.get("avatar_url"),
+            "platform": "GitHub",
+            "score": min(99, 60 + int(followers / 5000)),
+            "followers": followers,
+            "bio": details.get("bio") or "Creator profile trending this week",
+            "profile_url": details.get("html_url") or item.get("html_url")
+        })
+
+    if not creators:
+        return get_fallback_creators()
+    return creators
+
+
+class TrendsCache:
+    """Stale-while-revalidate trending creators list, shared through SQLite.
+
+    Every worker reads the same ``trends_cache`` row, so a fetch by one of
+    them serves all.  Only a cold cache makes a caller wait.  Past
+    ``refresh_after`` (before ``ttl``) the current list is still served
+    while whichever worker wins the row's lease refreshes it in the
+    background; a failed refresh keeps the old list, reported as "stale"
+    once past ``ttl``, and is retried after ``retry_after``.
+    """
+
+    KEY = "creators"
+
+    def __init__(self, fetch, ttl, refresh_after, retry_after, lease, cold_wait):
+        self.fetch = fetch  # coroutine function
+        self.ttl = ttl
+        self.refresh_after = refresh_after
+        self.retry_after = retry_after
+        self.lease = lease
+        self.cold_wait = cold_wait
+        self._parsed = (None, None)  # (fetched_at, creators) of the last row decoded
+        self._tasks = set()          # background refreshes started by get()
+
+    def _load(self):
+        conn = get_db()
+        try:
+            row = conn.execute(
+                "SELECT payload, fetched_at, failed_at FROM trends_cache WHERE key=?",
+                (self.KEY,)
+            ).fetchone()
+        finally:
+            conn.close()
+        if row is None or row[0] is None:
+            return None, 0.0, 0.0
+        payload, fetched_at, failed_at = row
+        parsed_at, creators = self._parsed
+        if parsed_at != fetched_at:
+            creators = json.loads(payload)
+            self._parsed = (fetched_at, creators)
+        return creators, fetched_at, failed_at
+
+    def _claim(self, now):
+        """Take the refresh lease; False while another worker holds it."""
+        conn = get_db()
+        try:
+            cursor = conn.execute(
+                """
+                INSERT INTO trends_cache (key, lease_until) VALUES (?, ?)
+                ON CONFLICT(key) DO UPDATE SET lease_until=excluded.lease_until
+                WHERE trends_cache.lease_until < ?
+                """,
+                (self.KEY, now + self.lease, now)
+            )
+            conn.commit()
+            return cursor.rowcount == 1
+        finally:
+            conn.close()
+
+    def _store(self, creators=None):
+        now = time.time()
+        conn = get_db()
+        try:
+            if creators is None:
+                conn.execute(
+                    "UPDATE trends_cache SET failed_at=?, lease_until=0 WHERE key=?",
+                    (now, self.KEY)
+                )
+            else:
+                conn.execute(
+                    "UPDATE trends_cache SET payload=?, fetched_at=?, lease_until=0 WHERE key=?",
+                    (json.dumps(creators), now, self.KEY)
+                )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _lookup(self):
+        """Returns (source, creators, claimed); source is None on a cold cache.
+
+        ``claimed`` means this caller won the lease and must fetch: in the
+        background when there is a list to serve, inline when there isn't.
+        """
+        creators, fetched_at, failed_at = self._load()
+        now = time.time()
+        if creators is not None:
+            age = now - fetched_at
+            due = age >= self.refresh_after and now - failed_at >= self.retry_after
+            return ("stale" if age >= self.ttl else "cache"), creators, due and self._claim(now)
+        return None, None, self._claim(now)
+
+    async def get(self):
+        """Return (source, creators); the SQLite work runs off the event loop."""
+        source, creators, claimed = await asyncio.to_thread(self._lookup)
+        if source is not None:
+            if claimed:
+                task = asyncio.ensure_future(self._refresh())
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            return source, creators
+
+        if claimed:
+            try:
+                creators, source = await self.fetch(), "github"
+            except Exception:
+                creators, source = get_fallback_creators(), "fallback"
+            await asyncio.to_thread(self._store, creators)
+            return source, creators
+
+        # Another worker is fetching the first list; wait briefly for it.
+        deadline = time.time() + self.cold_wait
+        while time.time() < deadline:
+            await asyncio.sleep(0.25)
+            creators = (await asyncio.to_thread(self._load))[0]
+            if creators is not None:
+                return "cache", creators
+        return "fallback", get_fallback_creators()
+
+    async def _refresh(self):
+        # The task inherited the request's context; don't touch its finished g.
+        with app.app_context():
+            try:
+                creators = await self.fetch()
+            except Exception:
+                app.logger.warning("Trending creators refresh failed; serving the previous list")
+                creators = None
+            await asyncio.to_thread(self._store, creators)
+
+
+trend_cache = TrendsCache(
+    lambda: fetch_trending_creators(),
+    TREND_CACHE_SECONDS,
+    TREND_REFRESH_AHEAD_SECONDS,
+    TREND_RETRY_SECONDS,
+    TREND_REFRESH_LEASE_SECONDS,
+    TREND_COLD_WAIT_SECONDS
+)
+
+
+def create_password_reset_token(user_id):
+    token = secrets.token_urlsafe(32)
+    expires_at = int(time.time()) + (30 * 60)
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute(
+        "DELETE FROM password_resets WHERE user_id=? OR expires_at < ?",
+        (user_id, int(time.time()))
+    )
+    cursor.execute(
+        """
+        INSERT INTO password_resets (user_id, token, expires_at)
+        VALUES (?, ?, ?)
+        """,
+        (user_id, token, expires_at)
+    )
+    conn.commit()
+    conn.close()
+    return token
+
+
+def get_password_reset_record(token):
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        SELECT id, user_id, expires_at, used_at
+        FROM password_resets
+        WHERE token=?
+        LIMIT 1
+        """,
+        (token,)
+    )
+    row = cursor.fetchone()
+    conn.close()
+    return row
+
+
+async def _oauth_post_form(url, payload, timeout=20):
+    return (await http_client.arequest(
+        "POST",
+        url,
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
+        body=urllib.parse.urlencode(payload),
+        timeout=timeout
+    )).json()
+
+
+async def _oauth_get_json(url, timeout=20):
+    return (await http_client.arequest("GET", url, timeout=timeout)).json()
+
+
+def _finalize_user_session(user_id, username, email):
+    session.clear()
+    session["user_id"] = user_id
+    session["username"] = username
+    session["handle"] = (email or username).split("@")[0]
+
+
+def _oauth_login_or_create_user(provider, provider_user_id, email, display_name, avatar_url=""):
+    provider = (provider or "").strip().lower()
+    provider_user_id = str(provider_user_id or "").strip()
+    email = (email or "").strip().lower()
+    display_name = (display_name or "").strip()
+
+    if not provider or not provider_user_id:
+        return None, "Invalid OAuth identity"
+
+    conn = get_db()
+    cursor = conn.cursor()
+
+    cursor.execute(
+        """
+        SELECT u.id, u.username, u.email, u.is_active
+        FROM oauth_accounts oa
+        JOIN users u ON u.id = oa.user_id
+        WHERE oa.provider=? AND oa.provider_user_id=?
+        LIMIT 1
+        """,
+        (provider, provider_user_id)
+    )
+    linked = cursor.fetchone()
+    if linked:
+        conn.close()
+        if int(linked[3]) == 0:
+            return None, "This account is deactivated. Contact support to reactivate."
+        return {"id": linked[0], "username": linked[1], "email": linked[2]}, None
+
+    user = None
+    if email:
+        cursor.execute(
+            "SELECT id, username, email, is_active FROM users WHERE email=? LIMIT 1",
+            (email,)
+        )
+        user = cursor.fetchone()
+
+    if user and int(user[3]) == 0:
+        conn.close()
+        return None, "This account is deactivated. Contact support to reactivate."
+
+    if user:
+        user_id = user[0]
+    else:
+        base_username = display_name or (email.split("@")[0] if email else f"{provider}_{provider_user_id[:8]}")
+        base_username = "".join(ch for ch in base_username if ch.isalnum() or ch in ("_", "-")).strip() or f"{provider}_user"
+        username = base_username[:28]
+        if not email:
+            email = f"{provider}_{provider_user_id}@socialsync.local"
+
+        cursor.execute(
+            "INSERT INTO users (username, email, password, profile_image) VALUES (?, ?, ?, ?)",
+            (username, email, generate_password_hash(secrets.token_urlsafe(32)), avatar_url or "")
+        )
+        user_id = cursor.lastrowid
+
+    try:
+        cursor.execute(
+            """
+            INSERT INTO oauth_accounts (user_id, provider, provider_user_id)
+            VALUES (?, ?, ?)
+            """,
+            (user_id, provider, provider_user_id)
+        )
+    except sqlite3.IntegrityError:
+        pass
+
+    cursor.execute(
+        "SELECT id, username, email, is_active FROM users WHERE id=? LIMIT 1",
+        (user_id,)
+    )
+    final_user = cursor.fetchone()
+    conn.commit()
+    conn.close()
+
+    if not final_user:
+        return None, "Unable to complete OAuth sign-in."
+    if int(final_user[3]) == 0:
+        return None, "This account is deactivated. Contact support to reactivate."
+    return {"id": final_user[0], "username": final_user[1], "email": final_user[2]}, None
+
+BLOCKLIST_CACHE_USERS = 10000
+BLOCKLIST_CACHE_TTL_SECONDS = 30
+
+
+class BlocklistCache:
+    """Bounded LRU of each user's "blocked or blocked-by" user ids.
+
+    block/unblock/delete invalidate the affected users immediately in this
+    process; the TTL bounds how long another worker can serve a stale set.
+    """
+
+    def __init__(self, max_users, ttl):
+        self.max_users = max_users
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+
+    def hidden_ids(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and now - entry[0] < self.ttl:
+                self._entries.move_to_end(user_id)
+                return entry[1]
+            generation = self._generation
+
+        conn = get_db()
+        rows = conn.execute(
+            """
+            SELECT blocked_user_id FROM blocked_users WHERE user_id = ?
+            UNION
+            SELECT user_id FROM blocked_users WHERE blocked_user_id = ?
+            """,
+            (user_id, user_id)
+        ).fetchall()
+        hidden = frozenset(row[0] for row in rows)
+
+        with self._lock:
+            # Skip the store if an invalidation raced with this load.
+            if generation == self._generation:
+                self._entries[user_id] = (now, hidden)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self.max_users:
+                    self._entries.popitem(last=False)
+        return hidden
+
+    def is_blocked(self, user_id, other_user_id):
+        return other_user_id in self.hidden_ids(user_id)
+
+    def invalidate(self, *user_ids):
+        with self._lock:
+            self._generation += 1
+            for user_id in user_ids:
+                self._entries.pop(user_id, None)
+
+
+blocklist = BlocklistCache(BLOCKLIST_CACHE_USERS, BLOCKLIST_CACHE_TTL_SECONDS)
+
+
+def _exclude_ids(column, ids):
+    """SQL fragment and params for ``column NOT IN (...)``; empty when nothing to hide."""
+    if not ids:
+        return "", ()
+    placeholders = ", ".join("?" for _ in ids)
+    return f"AND {column} NOT IN ({placeholders})", tuple(ids)
+
+
+LIVE_PRESENCE_REFRESH_SECONDS = 5
+
+
+def _parse_db_timestamp(value):
+    """CURRENT_TIMESTAMP strings are UTC 'YYYY-MM-DD HH:MM:SS'."""
+    return datetime.strptime(value, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
+
+
+class LivePresence:
+    """Who is live right now, held in memory.
+
+    toggle_live updates this process immediately; other workers pick the
+    change up on their next refresh, which only reads open sessions through
+    the partial ``ended_at IS NULL`` index.
+    """
+
+    def __init__(self, refresh_seconds):
+        self.refresh_seconds = refresh_seconds
+        self._sessions = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        self._generation = 0
+
+    def _refresh(self):
+        with self._lock:
+            generation = self._generation
+        conn = get_db()
+        rows = conn.execute(
+            "SELECT user_id, MAX(started_at) FROM live_sessions WHERE ended_at IS NULL GROUP BY user_id"
+        ).fetchall()
+        with self._lock:
+            if generation == self._generation:
+                self._sessions = {user_id: started_at for user_id, started_at in rows}
+                self._loaded_at = time.monotonic()
+
+    def snapshot(self):
+        """Return {user_id: started_at} for everyone currently live."""
+        loaded_at = self._loaded_at
+        if loaded_at is None or time.monotonic() - loaded_at >= self.refresh_seconds:
+            self._refresh()
+        with self._lock:
+            return dict(self._sessions)
+
+    def started_at(self, user_id):
+        return self.snapshot().get(user_id)
+
+    def start(self, user_id, started_at):
+        with self._lock:
+            self._generation += 1
+            self._sessions[user_id] = started_at
+
+    def stop(self, user_id):
+        with self._lock:
+            self._generation += 1
+            self._sessions.pop(user_id, None)
+
+
+live_presence = LivePresence(LIVE_PRESENCE_REFRESH_SECONDS)
+
+
+USER_DIRECTORY_PAGE_SIZE = 50
+USER_DIRECTORY_PAGE_MAX = 200
+CHAT_PAGE_SIZE = 50
+CHAT_PAGE_MAX = 200
+
+
+def _record_conversation_message(cursor, sender_id, receiver_id, message_id, body, created_at):
+    """Keep both sides' rows in ``conversations`` in step with a new message."""
+    cursor.execute(
+        """
+        INSERT INTO conversations
+            (user_id, peer_id, last_message_id, last_text, last_time, unread_count)
+        VALUES (?, ?, ?, ?, ?, 0)
+        ON CONFLICT(user_id, peer_id) DO UPDATE SET
+            last_message_id=excluded.last_message_id,
+            last_text=excluded.last_text,
+            last_time=excluded.last_time
+        """,
+        (sender_id, receiver_id, message_id, body, created_at)
+    )
+    cursor.execute(
+        """
+        INSERT INTO conversations
+            (user_id, peer_id, last_message_id, last_text, last_time, unread_count)
+        VALUES (?, ?, ?, ?, ?, 1)
+        ON CONFLICT(user_id, peer_id) DO UPDATE SET
+            last_message_id=excluded.last_message_id,
+            last_text=excluded.last_text,
+            last_time=excluded.last_time,
+            unread_count=conversations.unread_count + 1
+        """,
+        (receiver_id, sender_id, message_id, body, created_at)
+    )
+
+
+def _adjust_unread_messages(cursor, user_id, delta):
+    if delta > 0:
+        cursor.execute(
+            """
+            INSERT INTO user_counters (user_id, unread_messages)
+            VALUES (?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET
+                unread_messages=user_counters.unread_messages + excluded.unread_messages
+            """,
+            (user_id, delta)
+        )
+    elif delta < 0:
+        cursor.execute(
+            "UPDATE user_counters SET unread_messages=MAX(0, unread_messages + ?) WHERE user_id=?",
+            (delta, user_id)
+        )
+
+
+def _delete_conversation(cursor, user_id, peer_id):
+    cursor.execute(
+        "SELECT user_id, unread_count FROM conversations "
+        "WHERE ((user_id=? AND peer_id=?) OR (user_id=? AND peer_id=?)) AND unread_count > 0",
+        (user_id, peer_id, peer_id, user_id)
+    )
+    for owner_id, unread_count in cursor.fetchall():
+        _adjust_unread_messages(cursor, owner_id, -unread_count)
+    cursor.execute(
+        """
+        DELETE FROM conversations
+        WHERE (user_id=? AND peer_id=?) OR (user_id=? AND peer_id=?)
+        """,
+        (user_id, peer_id, peer_id, user_id)
+    )
+
+
+def _prune_notifications(cursor, *user_ids):
+    cursor.executemany(
+        """
+        DELETE FROM notifications
+        WHERE user_id = ?
+        AND id IN (
+            SELECT id FROM notifications
+            WHERE user_id = ?
+            ORDER BY created_at DESC, id DESC
+            LIMIT -1 OFFSET ?
+        )
+        """,
+        [(user_id, user_id, NOTIFICATIONS_PER_USER) for user_id in user_ids]
+    )
+
+
+def _notify_message(cursor, receiver_id, sender_id, message_id, body, created_at):
+    cursor.execute(
+        """
+        INSERT INTO notifications (user_id, kind, actor_id, ref_id, preview, created_at)
+        VALUES (?, 'message', ?, ?, ?, ?)
+        """,
+        (receiver_id, sender_id, message_id, body, created_at)
+    )
+    _prune_notifications(cursor, receiver_id)
+
+
+def _fan_out_post_notification(cursor, author_id, post_id):
+    """Write a post notification into every eligible user's feed."""
+    hidden_filter, hidden_params = _exclude_ids("u.id", blocklist.hidden_ids(author_id))
+    cursor.execute(
+        f"SELECT u.id FROM users u WHERE u.id != ? {hidden_filter}",
+        (author_id,) + hidden_params
+    )
+    recipients = [row[0] for row in cursor.fetchall()]
+    cursor.execute(
+        f"""
+        INSERT INTO notifications (user_id, kind, actor_id, ref_id, preview, created_at)
+        SELECT u.id, 'post', p.user_id, p.id, p.caption, p.created_at
+        FROM posts p
+        JOIN users u ON u.id != p.user_id
+        WHERE p.id = ?
+        {hidden_filter}
+        """,
+        (post_id,) + hidden_params
+    )
+    # Only the feeds that just grew can be past the cap.
+    _prune_notifications(cursor, *recipients)
+
+
+def _delete_pair_notifications(cursor, user_id, other_user_id, kind=None):
+    kind_filter = "AND kind = ?" if kind else ""
+    cursor.execute(
+        f"""
+        DELETE FROM notifications
+        WHERE (
+            (user_id=? AND actor_id=?)
+            OR
+            (user_id=? AND actor_id=?)
+        )
+        {kind_filter}
+        """,
+        (user_id, other_user_id, other_user_id, user_id) + ((kind,) if kind else ())
+    )
+
+
+# Metric names per platform, with the demo random-walk used to seed an empty
+# store: (starting value, smallest daily step, largest daily step).
+PLATFORM_METRICS = {
+    "instagram": {
+        "followers": (2500, -50, 150),
+        "impressions": (2000, -50, 150),
+        "likes": (800, -50, 150)
+    },
+    "youtube": {
+        "subscribers": (2800, -20, 200),
+        "views": (5000, -20, 200),
+        "likes": (800, -20, 200),
+        "engagement_rate": (35, -5, 10)
+    },
+    "twitter": {
+        "followers": (1800, 5, 120),
+        "impressions": (9000, 5, 120),
+        "likes": (1500, -50, 120),
+        "engagement_rate": (25, -5, 12)
+    },
+    "facebook": {
+        "followers": (3200, 10, 200),
+        "reach": (7000, 10, 200),
+        "likes": (2500, -100, 200),
+        "engagement_rate": (40, -10, 15)
+    }
+}
+# (bucket name, width in seconds, alignment offset); weeks start on Monday.
+METRIC_BUCKETS = (
+    ("hour", 3600, 0),
+    ("day", 86400, 0),
+    ("week", 7 * 86400, 3 * 86400)
+)
+METRIC_INGEST_MAX_BATCH = 5000
+# Demo history is written in small transactions with a pause between them
+# so request writers are not kept waiting on the write lock.
+METRIC_BACKFILL_BATCH = 1000
+METRIC_BACKFILL_PAUSE_SECONDS = 0.05
+METRICS_ROLLUP_INTERVAL_SECONDS = int((os.environ.get("METRICS_ROLLUP_INTERVAL_SECONDS") or "60").strip())
+METRICS_DEMO_SEED = (os.environ.get("METRICS_DEMO_SEED") or "1").strip() != "0"
+METRICS_DEMO_SEED_DAYS = 365
+ANALYTICS_RANGES = {"7d": 7, "30d": 30, "90d": 90, "365d": 365}
+ANALYTICS_DEFAULT_POINTS = 300
+ANALYTICS_MAX_POINTS = 2000
+
+
+def ingest_metric_samples(cursor, user_id, samples):
+    """Append (platform, metric, ts, value) tuples in a single executemany."""
+    cursor.executemany(
+        "INSERT INTO metric_samples (user_id, platform, metric, ts, value) VALUES (?, ?, ?, ?, ?)",
+        [(user_id, platform, metric, ts, value) for platform, metric, ts, value in samples]
+    )
+
+
+def rollup_metrics():
+    """Fold samples added since the last run into hourly/daily/weekly rollups.
+
+    Runs in one IMMEDIATE transaction, so concurrent workers serialize and
+    every sample is counted exactly once.
+    """
+    conn = get_db()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        last_id = conn.execute(
+            "SELECT last_sample_id FROM metric_rollup_state WHERE id=1"
+        ).fetchone()[0]
+        max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM metric_samples").fetchone()[0]
+        if max_id <= last_id:
+            conn.rollback()
+            return 0
+
+        for bucket, width, offset in METRIC_BUCKETS:
+            conn.execute(
+                """
+                WITH batch AS (
+                    SELECT
+                        id, user_id, platform, metric, ts, value,
+                        ((ts + ?) / ?) * ? - ? AS bucket_start
+                    FROM metric_samples
+                    WHERE id > ? AND id <= ?
+                ),
+                ranked AS (
+                    SELECT *, ROW_NUMBER() OVER (
+                        PARTITION BY user_id, platform, metric, bucket_start
+                        ORDER BY ts DESC, id DESC
+                    ) AS rn
+                    FROM batch
+                )
+                INSERT INTO metric_rollups (
+                    user_id, platform, metric, bucket, bucket_start,
+                    sample_count, value_sum, value_min, value_max, last_ts, last_value
+                )
+                SELECT
+                    user_id, platform, metric, ?, bucket_start,
+                    COUNT(*), SUM(value), MIN(value), MAX(value),
+                    MAX(ts), MAX(CASE WHEN rn = 1 THEN value END)
+                FROM ranked
+                WHERE true
+                GROUP BY user_id, platform, metric, bucket_start
+                ON CONFLICT(user_id, platform, bucket, metric, bucket_start) DO UPDATE SET
+                    sample_count=metric_rollups.sample_count + excluded.sample_count,
+                    value_sum=metric_rollups.value_sum + excluded.value_sum,
+                    value_min=MIN(metric_rollups.value_min, excluded.value_min),
+                    value_max=MAX(metric_rollups.value_max, excluded.value_max),
+                    last_value=CASE
+                        WHEN excluded.last_ts >= metric_rollups.last_ts THEN excluded.last_value
+                        ELSE metric_rollups.last_value
+                    END,
+                    last_ts=MAX(metric_rollups.last_ts, excluded.last_ts)
+                """,
+                (offset, width, width, offset, last_id, max_id, bucket)
+            )
+
+        user_ids = [
+            row[0] for row in conn.execute(
+                "SELECT DISTINCT user_id FROM metric_samples WHERE id > ? AND id <= ?",
+                (last_id, max_id)
+            )
+        ]
+        conn.execute(
+            "UPDATE metric_rollup_state SET last_sample_id=? WHERE id=1",
+            (max_id,)
+        )
+        conn.commit()
+        analytics_cache.invalidate_users(user_ids)
+        return max_id - last_id
+    finally:
+        conn.close()
+
+
+class MetricsRollupWorker:
+    """Background thread that runs rollup_metrics() on an interval.
+
+    Started lazily from request handlers so that forked workers each get
+    their own thread; the rollup transaction makes duplicates harmless.
+    It also writes demo history queued by ``backfill()``.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._backfill = deque()
+
+    def ensure_running(self):
+        if self.interval <= 0:
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="metrics-rollup", daemon=True)
+            self._thread.start()
+
+    def poke(self):
+        """Ask for a rollup soon instead of waiting for the interval."""
+        self._wake.set()
+
+    def backfill(self, user_id, samples):
+        """Queue samples for the worker to write and roll up in small batches, starting now."""
+        with self._lock:
+            self._backfill.append((user_id, samples))
+        self.ensure_running()
+        self.poke()
+
+    def _write_backfill(self):
+        while True:
+            with self._lock:
+                if not self._backfill:
+                    return
+                user_id, samples = self._backfill.popleft()
+            for start in range(0, len(samples), METRIC_BACKFILL_BATCH):
+                conn = get_db()
+                try:
+                    ingest_metric_samples(conn.cursor(), user_id, samples[start:start + METRIC_BACKFILL_BATCH])
+                    conn.commit()
+                finally:
+                    conn.close()
+                rollup_metrics()
+                time.sleep(METRIC_BACKFILL_PAUSE_SECONDS)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                with app.app_context():
+                    self._write_backfill()
+                    rollup_metrics()
+            except Exception:
+                # Keep the thread alive; the next run picks up where this one stopped.
+                app.logger.exception("Metrics rollup failed")
+
+
+metrics_rollup = MetricsRollupWorker(METRICS_ROLLUP_INTERVAL_SECONDS)
+
+
+def _seed_demo_metrics(user_id, platform, since):
+    """Give an empty dashboard a year of hourly demo samples (written once).
+
+    Only samples from ``since`` on (the window being drawn) are written
+    here; the rollup worker writes the older history afterwards, so the
+    request that found the dashboard empty stays fast.  With the worker
+    disabled only the window is seeded.
+    """
+    now = int(time.time()) // 3600 * 3600
+    hours = METRICS_DEMO_SEED_DAYS * 24
+    timestamps = now - np.arange(hours, -1, -1, dtype=np.int64) * 3600
+    rng = np.random.default_rng()
+    samples = []
+    for metric, (start, low, high) in PLATFORM_METRICS[platform].items():
+        steps = rng.uniform(low, high, size=hours) / 24
+        if metric == "engagement_rate":
+            # A rate should wander, not trend for a year.
+            steps -= (low + high) / 48
+        values = start + np.concatenate(([0.0], np.cumsum(steps)))
+        if metric == "engagement_rate":
+            values = np.clip(values, 1.0, 99.0)
+        values = np.round(values, 2)
+        samples.extend(
+            (platform, metric, ts, value)
+            for ts, value in zip(timestamps.tolist(), values.tolist())
+        )
+
+    recent = [sample for sample in samples if sample[2] >= since]
+    older = [sample for sample in samples if sample[2] < since]
+
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    cursor.execute(
+        "SELECT 1 FROM metric_samples WHERE user_id=? AND platform=? LIMIT 1",
+        (user_id, platform)
+    )
+    seeded = cursor.fetchone() is None
+    if seeded:
+        ingest_metric_samples(cursor, user_id, recent)
+    conn.commit()
+    conn.close()
+    rollup_metrics()
+    if seeded and older and metrics_rollup.interval > 0:
+        metrics_rollup.backfill(user_id, older)
+
+
+def lttb_indices(x, y, threshold):
+    """Largest-Triangle-Three-Buckets over one or more aligned series.
+
+    ``x`` has shape (n,), ``y`` shape (n, k).  Every series is normalised so
+    a shared set of indices keeps the visual peaks of all of them; with
+    k == 1 this is plain LTTB.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    def normalise(values):
+        low = values.min(axis=0)
+        span = values.max(axis=0) - low
+        return (values - low) / np.where(span == 0, 1, span)
+
+    x = normalise(x.astype(float))
+    y = normalise(y.astype(float))
+    every = (n - 2) / (threshold - 2)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean(axis=0)
+        area = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end])[:, None] * (avg_y - y[a])
+        ).sum(axis=1)
+        a = start + int(area.argmax())
+        selected[i + 1] = a
+    selected[-1] = n - 1
+    return selected
+
+
+def _read_rollups(user_id, platform, bucket, since):
+    metrics = list(PLATFORM_METRICS[platform])
+    conn = get_db()
+    rows = conn.execute(
+        f"""
+        SELECT metric, bucket_start, last_value
+        FROM metric_rollups
+        WHERE user_id=? AND platform=? AND bucket=?
+        AND metric IN ({", ".join("?" for _ in metrics)})
+        AND bucket_start >= ?
+        ORDER BY bucket_start
+        """,
+        (user_id, platform, bucket, *metrics, since)
+    ).fetchall()
+    conn.close()
+    return rows
+
+
+def read_metric_range(user_id, platform, days, points):
+    """Chart series for the last ``days`` days, downsampled to ~``points``.
+
+    Reads the coarsest rollup that still has at least ``points`` buckets
+    in the window, aligns all metrics on one time grid, and runs LTTB over
+    them together so every graph shares the same labels.
+    """
+    metrics = list(PLATFORM_METRICS[platform])
+    since = int(time.time()) - days * 86400
+    bucket, width = "hour", 3600
+    for name, seconds, _ in reversed(METRIC_BUCKETS):
+        if days * 86400 // seconds >= points:
+            bucket, width = name, seconds
+            break
+
+    metrics_rollup.ensure_running()
+    rows = _read_rollups(user_id, platform, bucket, since)
+    if not rows:
+        return [], {metric: [] for metric in metrics}
+
+    grid = np.unique(np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows)))
+    column = {metric: index for index, metric in enumerate(metrics)}
+    matrix = np.full((len(grid), len(metrics)), np.nan)
+    positions = np.searchsorted(grid, [row[1] for row in rows])
+    matrix[positions, [column[row[0]] for row in rows]] = [row[2] for row in rows]
+
+    # Forward-fill gaps, then back-fill anything before a metric's first point.
+    filled = np.where(~np.isnan(matrix), np.arange(len(grid))[:, None], 0)
+    np.maximum.accumulate(filled, axis=0, out=filled)
+    matrix = matrix[filled, np.arange(len(metrics))]
+    for index in range(len(metrics)):
+        col = matrix[:, index]
+        valid = ~np.isnan(col)
+        col[~valid] = col[valid][0] if valid.any() else 0
+
+    keep = lttb_indices(grid, matrix, points)
+    label_format = "%b %d %H:00" if width < 86400 else "%b %d"
+    labels = [
+        datetime.fromtimestamp(int(ts), timezone.utc).strftime(label_format)
+        for ts in grid[keep]
+    ]
+    series = {}
+    for metric, index in column.items():
+        values = matrix[keep, index]
+        if metric == "engagement_rate":
+            series[metric] = np.round(values, 2).tolist()
+        else:
+            series[metric] = np.rint(values).astype(np.int64).tolist()
+    return labels, series
+
+
+def read_metric_window(user_id, platform, days=7):
+    """Daily closing values for the last ``days`` days, read from rollups.
+
+    Returns (labels, {metric: [values]}); days without data carry the
+    previous value forward.
+    """
+    metrics = list(PLATFORM_METRICS[platform])
+    today = int(time.time()) // 86400 * 86400
+    first_day = today - (days - 1) * 86400
+
+    metrics_rollup.ensure_running()
+    rows = _read_rollups(user_id, platform, "day", first_day)
+    if not rows and METRICS_DEMO_SEED:
+        _seed_demo_metrics(user_id, platform, first_day)
+        rows = _read_rollups(user_id, platform, "day", first_day)
+
+    by_metric = {metric: {} for metric in metrics}
+    for metric, bucket_start, value in rows:
+        by_metric[metric][bucket_start] = value
+
+    day_starts = [first_day + i * 86400 for i in range(days)]
+    labels = [
+        datetime.fromtimestamp(day, timezone.utc).strftime("%a")
+        for day in day_starts
+    ]
+    series = {}
+    for metric, points in by_metric.items():
+        known = [points[day] for day in day_starts if day in points]
+        previous = known[0] if known else 0
+        values = []
+        for day in day_starts:
+            previous = points.get(day, previous)
+            values.append(round(previous, 2) if metric == "engagement_rate" else int(round(previous)))
+        series[metric] = values
+    return labels, series
+
+
+def platform_analytics(user_id, platform):
+    """KPI series plus chart labels/series for the request's range/points.
+
+    Without ``range`` the charts are the seven daily closes (Mon-Sun);
+    KPIs and their day-over-day changes always come from those.
+    Returns (kpis, labels, graphs) or raises ValueError for bad parameters.
+    """
+    labels, kpis = read_metric_window(user_id, platform)
+    range_key = (request.args.get("range") or "").strip().lower()
+    if not range_key:
+        return kpis, labels, kpis
+    if range_key not in ANALYTICS_RANGES:
+        raise ValueError("range must be one of " + ", ".join(ANALYTICS_RANGES))
+    try:
+        points = int(request.args.get("points") or ANALYTICS_DEFAULT_POINTS)
+    except ValueError:
+        raise ValueError("points must be an integer")
+    points = max(10, min(points, ANALYTICS_MAX_POINTS))
+    labels, graphs = read_metric_range(user_id, platform, ANALYTICS_RANGES[range_key], points)
+    return kpis, labels, graphs
+
+
+def _metric_change(values):
+    if len(values) < 2:
+        return 0
+    change = values[-1] - values[-2]
+    return round(change, 2) if isinstance(change, float) else change
+
+
+ANALYTICS_SOURCE_TIMEOUT_SECONDS = 2.0
+ANALYTICS_POOL_SIZE = 8
+
+
+class AnalyticsSource(ABC):
+    """One backend behind /api/analytics/overview.
+
+    ``fetch(user_id)`` returns {"kpis": {...}, "labels": [...], "series": {...}}
+    with KPIs under the shared names followers / impressions / likes /
+    engagement_rate (each with a ``*_change``).  It runs on the analytics
+    pool inside an app context and is abandoned after ``timeout`` seconds;
+    a pool thread can't be taken back from a run that hangs, so the source
+    is skipped (reported missing as "stalled") until that run returns.
+    """
+
+    name = ""
+    timeout = ANALYTICS_SOURCE_TIMEOUT_SECONDS
+
+    @abstractmethod
+    def fetch(self, user_id):
+        ...
+
+
+class MetricStoreSource(AnalyticsSource):
+    KPI_ALIASES = {"subscribers": "followers", "views": "impressions", "reach": "impressions"}
+
+    def __init__(self, platform):
+        self.name = platform
+        self.platform = platform
+
+    def fetch(self, user_id):
+        labels, series = read_metric_window(user_id, self.platform)
+        kpis = {}
+        for metric, values in series.items():
+            key = self.KPI_ALIASES.get(metric, metric)
+            kpis[key] = values[-1]
+            kpis[f"{key}_change"] = _metric_change(values)
+        if "engagement_rate" not in kpis and kpis.get("impressions"):
+            kpis["engagement_rate"] = round(kpis["likes"] / kpis["impressions"] * 100, 2)
+            kpis["engagement_rate_change"] = 0
+        return {"kpis": kpis, "labels": labels, "series": series}
+
+
+analytics_sources = [MetricStoreSource(platform) for platform in PLATFORM_METRICS]
 
 
-def fetch_trending_creators():
-    query = urllib.parse.quote("followers:>1000")
-    search_url = (
-        "https://api.github.com/search/users"
-        f"?q={query}&sort=followers&order=desc&per_page=8"
-    )
-    users_payload = _safe_github_json(search_url)
-    items = users_payload.get("items", [])
+def register_analytics_source(source):
+    analytics_sources.append(source)
 
-    creators = []
-    for item in items:
-        details = _safe_github_json(item.get("url"))
-        followers = int(details.get("followers") or 0)
-        creators.append({
-            "username": details.get("login") or item.get("login") or "unknown",
-            "name": details.get("name") or details.get("login") or "Unknown Creator",
-            "avatar_url": details.get("avatar_url") or item.get("avatar_url"),
-            "platform": "GitHub",
-            "score": min(99, 60 + int(followers / 5000)),
-            "followers": followers,
-            "bio": details.get("bio") or "Creator profile trending this week",
-            "profile_url": details.get("html_url") or item.get("html_url")
-        })
 
-    if not creators:
-        return get_fallback_creators()
-    return creators
+_analytics_pool = None
+_analytics_pool_pid = None
+_analytics_pool_lock = threading.Lock()
+# Source name -> runs that timed out but still hold a pool thread.
+_analytics_stalled = {}
 
 
-def create_password_reset_token(user_id):
-    token = secrets.token_urlsafe(32)
-    expires_at = int(time.time()) + (30 * 60)
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute(
-        "DELETE FROM password_resets WHERE user_id=? OR expires_at < ?",
-        (user_id, int(time.time()))
-    )
-    cursor.execute(
-        """
-        INSERT INTO password_resets (user_id, token, expires_at)
-        VALUES (?, ?, ?)
-        """,
-        (user_id, token, expires_at)
-    )
-    conn.commit()
-    conn.close()
-    return token
+def _get_analytics_pool():
+    global _analytics_pool, _analytics_pool_pid
+    with _analytics_pool_lock:
+        if _analytics_pool is None or _analytics_pool_pid != os.getpid():
+            _analytics_pool = ThreadPoolExecutor(
+                max_workers=ANALYTICS_POOL_SIZE, thread_name_prefix="analytics"
+            )
+            _analytics_pool_pid = os.getpid()
+            _analytics_stalled.clear()
+        return _analytics_pool
+
+
+def _abandon_analytics_run(name, future):
+    def finished(done):
+        with _analytics_pool_lock:
+            runs = _analytics_stalled.get(name)
+            if runs is not None:
+                runs.discard(done)
+                if not runs:
+                    del _analytics_stalled[name]
+
+    with _analytics_pool_lock:
+        _analytics_stalled.setdefault(name, set()).add(future)
+    future.add_done_callback(finished)
+
+
+def gather_analytics(user_id, sources=None):
+    """Fetch every source concurrently; returns (results by name, missing)."""
+    sources = list(analytics_sources if sources is None else sources)
+
+    def run(source):
+        with app.app_context():
+            return source.fetch(user_id)
+
+    pool = _get_analytics_pool()
+    with _analytics_pool_lock:
+        stalled = set(_analytics_stalled)
+    results = {}
+    missing = []
+    started = time.monotonic()
+    futures = []
+    for source in sources:
+        if source.name in stalled:
+            # Don't pile more runs behind one that is hung.
+            missing.append({"source": source.name, "reason": "stalled"})
+        else:
+            futures.append((source, pool.submit(run, source)))
 
+    for source, future in futures:
+        remaining = source.timeout - (time.monotonic() - started)
+        try:
+            results[source.name] = future.result(timeout=max(0.0, remaining))
+        except FuturesTimeout:
+            if not future.cancel():
+                _abandon_analytics_run(source.name, future)
+            missing.append({"source": source.name, "reason": "timeout"})
+        except Exception:
+            app.logger.exception("Analytics source %s failed", source.name)
+            missing.append({"source": source.name, "reason": "error"})
+    return results, missing
+
+
+def merge_analytics_kpis(results):
+    merged = {}
+    for key in ("followers", "impressions", "likes"):
+        merged[key] = sum(r["kpis"].get(key, 0) for r in results.values())
+        merged[f"{key}_change"] = sum(r["kpis"].get(f"{key}_change", 0) for r in results.values())
+    rates = [r["kpis"]["engagement_rate"] for r in results.values() if "engagement_rate" in r["kpis"]]
+    rate_changes = [
+        r["kpis"].get("engagement_rate_change", 0)
+        for r in results.values() if "engagement_rate" in r["kpis"]
+    ]
+    merged["engagement_rate"] = round(sum(rates) / len(rates), 2) if rates else 0
+    merged["engagement_change"] = round(sum(rate_changes) / len(rate_changes), 2) if rate_changes else 0
+    return merged
 
-def get_password_reset_record(token):
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        SELECT id, user_id, expires_at, used_at
-        FROM password_resets
-        WHERE token=?
-        LIMIT 1
-        """,
-        (token,)
-    )
-    row = cursor.fetchone()
-    conn.close()
-    return row
 
+ANALYTICS_CACHE_TTL_SECONDS = 10
+ANALYTICS_CACHE_MAX_ENTRIES = 4096
 
-def _oauth_post_form(url, payload, timeout=20):
-    data = urllib.parse.urlencode(payload).encode("utf-8")
-    req = urllib.request.Request(
-        url,
-        data=data,
-        headers={"Content-Type": "application/x-www-form-urlencoded"},
-        method="POST"
-    )
-    with urllib.request.urlopen(req, timeout=timeout) as response:
-        return json.loads(response.read().decode("utf-8"))
 
+class AnalyticsResponseCache:
+    """Serialized analytics responses keyed by (user, platform, range, points).
 
-def _oauth_get_json(url, timeout=20):
-    req = urllib.request.Request(url, method="GET")
-    with urllib.request.urlopen(req, timeout=timeout) as response:
-        return json.loads(response.read().decode("utf-8"))
+    One request per key computes the body per TTL while concurrent pollers
+    wait for it.  The ETag is a digest of the body, so a recompute that
+    produces the same numbers keeps its ETag and Last-Modified.
+    """
 
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._loading = {}
+        self._lock = threading.Lock()
 
-def _finalize_user_session(user_id, username, email):
-    session.clear()
-    session["user_id"] = user_id
-    session["username"] = username
-    session["handle"] = (email or username).split("@")[0]
+    def _fresh(self, key, now):
+        entry = self._entries.get(key)
+        if entry is not None and now - entry["stored"] < self.ttl:
+            self._entries.move_to_end(key)
+            return entry
+        return None
 
+    def _done_loading(self, key, key_lock):
+        # Called with self._lock held; a later loader may own the key by now.
+        if self._loading.get(key) is key_lock:
+            del self._loading[key]
 
-def _oauth_login_or_create_user(provider, provider_user_id, email, display_name, avatar_url=""):
-    provider = (provider or "").strip().lower()
-    provider_user_id = str(provider_user_id or "").strip()
-    email = (email or "").strip().lower()
-    display_name = (display_name or "").strip()
+    def get_or_build(self, key, build):
+        """Return the cached entry, or call ``build()`` for a response.
 
-    if not provider or not provider_user_id:
-        return None, "Invalid OAuth identity"
+        Non-200 responses and those marked ``no_store`` are passed through
+        uncached as (None, response).
+        """
+        with self._lock:
+            entry = self._fresh(key, time.monotonic())
+            if entry is not None:
+                return entry, None
+            key_lock = self._loading.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                entry = self._fresh(key, time.monotonic())
+                if entry is not None:
+                    return entry, None
+                previous = self._entries.get(key)
 
-    conn = get_db()
-    cursor = conn.cursor()
+            try:
+                response = build()
+                if response.status_code != 200 or response.cache_control.no_store:
+                    return None, response
+
+                body = response.get_data()
+                etag = hashlib.sha1(body).hexdigest()
+                if previous is not None and previous["etag"] == etag:
+                    last_modified = previous["last_modified"]
+                else:
+                    last_modified = datetime.now(timezone.utc).replace(microsecond=0)
+                entry = {
+                    "stored": time.monotonic(),
+                    "body": body,
+                    "etag": etag,
+                    "last_modified": last_modified
+                }
+                # Stored before the loading marker goes, so a request that
+                # misses the marker always finds the entry.
+                with self._lock:
+                    self._entries[key] = entry
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+                    self._done_loading(key, key_lock)
+                return entry, None
+            finally:
+                with self._lock:
+                    self._done_loading(key, key_lock)
+
+    def invalidate_users(self, user_ids):
+        user_ids = set(user_ids)
+        with self._lock:
+            for key in [key for key in self._entries if key[0] in user_ids]:
+                del self._entries[key]
+
+
+analytics_cache = AnalyticsResponseCache(ANALYTICS_CACHE_MAX_ENTRIES, ANALYTICS_CACHE_TTL_SECONDS)
+
+
+def analytics_cached(platform):
+    """Serve an analytics view from analytics_cache with ETag/Last-Modified.
+
+    Unchanged bodies answer 304 to If-None-Match / If-Modified-Since, so a
+    steady poll costs neither a recompute nor any body bytes.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if "user_id" not in session:
+                return jsonify({"error": "Unauthorized"}), 401
+
+            key = (
+                session["user_id"],
+                platform,
+                (request.args.get("range") or "").strip().lower(),
+                (request.args.get("points") or "").strip()
+            )
+            entry, response = analytics_cache.get_or_build(
+                key, lambda: app.make_response(view(*args, **kwargs))
+            )
+            if entry is None:
+                return response
+
+            response = Response(entry["body"], mimetype="application/json")
+            response.set_etag(entry["etag"])
+            response.last_modified = entry["last_modified"]
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response.make_conditional(request)
+        return wrapper
+    return decorator
+
+
+INBOX_STREAM_HEARTBEAT_SECONDS = 15
+INBOX_STREAM_MAX_SECONDS = 300
+INBOX_STREAM_BACKLOG = 50
+INBOX_STREAM_QUEUE_SIZE = 100
+# Every open stream holds a server thread (gunicorn.conf.py's gthread pool,
+# or a2wsgi's ASGI_WSGI_THREADS under asgi.py) until it is recycled, so
+# streams get at most this many per process; the rest are refused with a
+# 503 and inbox.html polls instead.  Keep it well under the thread count.
+INBOX_STREAM_MAX_SUBSCRIBERS = int((os.environ.get("INBOX_STREAM_MAX_SUBSCRIBERS") or "16").strip())
+INBOX_STREAM_BUSY_RETRY_SECONDS = 60
+
+
+class EventHub:
+    """In-process publish/subscribe for per-user inbox events.
+
+    Each user keeps a short backlog so a reconnecting EventSource can resume
+    from its Last-Event-ID.  Events only reach subscribers in the same
+    process, so run the app with a single multi-threaded worker per host
+    (gunicorn.conf.py) or the stream will only see that worker's writes.
+    At most ``max_subscribers`` streams are open at once.
+    """
+
+    def __init__(self, backlog_size, queue_size, max_subscribers):
+        self.backlog_size = backlog_size
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self._lock = threading.Lock()
+        self._next_id = 1
+        self._subscribers = {}
+        self._backlogs = {}
+        self._evicted = {}
+
+    def publish(self, user_id, event, data):
+        with self._lock:
+            event_id = self._next_id
+            self._next_id += 1
+            item = (event_id, event, data)
+            backlog = self._backlogs.get(user_id)
+            if backlog is None:
+                backlog = self._backlogs[user_id] = deque(maxlen=self.backlog_size)
+            if len(backlog) == self.backlog_size:
+                self._evicted[user_id] = backlog[0][0]
+            backlog.append(item)
+            subscribers = list(self._subscribers.get(user_id, ()))
+
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(item)
+            except queue.Full:
+                # Slow consumer: end its stream and let it resume by event id.
+                self.unsubscribe(user_id, subscriber)
+                subscriber.closed = True
+        return event_id
 
-    cursor.execute(
+    def subscribe(self, user_id, last_event_id=None):
+        """Register a subscriber; returns (queue, replay events, resync flag).
+
+        The queue is None when ``max_subscribers`` streams are already open.
         """
-        SELECT u.id, u.username, u.email, u.is_active
-        FROM oauth_accounts oa
-        JOIN users u ON u.id = oa.user_id
-        WHERE oa.provider=? AND oa.provider_user_id=?
-        LIMIT 1
-        """,
-        (provider, provider_user_id)
-    )
-    linked = cursor.fetchone()
-    if linked:
-        conn.close()
-        if int(linked[3]) == 0:
-            return None, "This account is deactivated. Contact support to reactivate."
-        return {"id": linked[0], "username": linked[1], "email": linked[2]}, None
+        subscriber = queue.Queue(maxsize=self.queue_size)
+        subscriber.closed = False
+        with self._lock:
+            if sum(len(s) for s in self._subscribers.values()) >= self.max_subscribers:
+                return None, [], False
+            self._subscribers.setdefault(user_id, set()).add(subscriber)
+            backlog = list(self._backlogs.get(user_id, ()))
+            evicted = self._evicted.get(user_id, 0)
+            next_id = self._next_id
+
+        replay = []
+        resync = False
+        if last_event_id is not None:
+            replay = [item for item in backlog if item[0] > last_event_id]
+            # Missed events fell out of the backlog, or the id comes from
+            # another process (restart/other worker): the client must reload.
+            resync = evicted > last_event_id or last_event_id >= next_id
+        return subscriber, replay, resync
+
+    def unsubscribe(self, user_id, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(user_id)
+            if subscribers is None:
+                return
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._subscribers[user_id]
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(s) for s in self._subscribers.values())
+
+
+inbox_events = EventHub(INBOX_STREAM_BACKLOG, INBOX_STREAM_QUEUE_SIZE, INBOX_STREAM_MAX_SUBSCRIBERS)
+
+
+def _format_sse(event_id, event, data):
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+GOOGLE_AI_BASE_URL = (
+    os.environ.get("GOOGLE_AI_BASE_URL") or "https://generativelanguage.googleapis.com/v1beta"
+).strip().rstrip("/")
+AI_MODEL_LIST_TTL_SECONDS = 3600
+AI_MODEL_LIST_RETRY_SECONDS = 60
+AI_MODEL_NOT_FOUND_SECONDS = 3600
+AI_MODEL_QUOTA_SECONDS = 60
+AI_MODEL_ERROR_THRESHOLD = 3
+AI_MODEL_ERROR_SECONDS = 30
+# Upper bound on generateContent calls per chat message across all models.
+AI_MAX_MODEL_ATTEMPTS = 3
+
+
+def _parse_retry_delay(value):
+    """Seconds from a google.rpc.RetryInfo retryDelay such as "37s" or "1.5s"."""
+    try:
+        return max(0.0, float(str(value).strip().rstrip("s")))
+    except (TypeError, ValueError):
+        return None
 
-    user = None
-    if email:
-        cursor.execute(
-            "SELECT id, username, email, is_active FROM users WHERE email=? LIMIT 1",
-            (email,)
-        )
-        user = cursor.fetchone()
 
-    if user and int(user[3]) == 0:
-        conn.close()
-        return None, "This account is deactivated. Contact support to reactivate."
+def _list_gemini_models(api_key):
+    return _generate_content_models(http_client.request(
+        "GET",
+        f"{GOOGLE_AI_BASE_URL}/models?key={urllib.parse.quote(api_key)}",
+        headers={"Content-Type": "application/json"},
+        timeout=20
+    ).json())
 
-    if user:
-        user_id = user[0]
-    else:
-        base_username = display_name or (email.split("@")[0] if email else f"{provider}_{provider_user_id[:8]}")
-        base_username = "".join(ch for ch in base_username if ch.isalnum() or ch in ("_", "-")).strip() or f"{provider}_user"
-        username = base_username[:28]
-        if not email:
-            email = f"{provider}_{provider_user_id}@socialsync.local"
 
-        cursor.execute(
-            "INSERT INTO users (username, email, password, profile_image) VALUES (?, ?, ?, ?)",
-            (username, email, generate_password_hash(secrets.token_urlsafe(32)), avatar_url or "")
-        )
-        user_id = cursor.lastrowid
+async def _list_gemini_models_async(api_key):
+    return _generate_content_models((await http_client.arequest(
+        "GET",
+        f"{GOOGLE_AI_BASE_URL}/models?key={urllib.parse.quote(api_key)}",
+        headers={"Content-Type": "application/json"},
+        timeout=20
+    )).json())
 
-    try:
-        cursor.execute(
-            """
-            INSERT INTO oauth_accounts (user_id, provider, provider_user_id)
-            VALUES (?, ?, ?)
-            """,
-            (user_id, provider, provider_user_id)
-        )
-    except sqlite3.IntegrityError:
-        pass
 
-    cursor.execute(
-        "SELECT id, username, email, is_active FROM users WHERE id=? LIMIT 1",
-        (user_id,)
-    )
-    final_user = cursor.fetchone()
-    conn.commit()
-    conn.close()
+def _generate_content_models(payload):
+    return [
+        (m.get("name") or "").split("/", 1)[-1]
+        for m in payload.get("models") or []
+        if "generateContent" in (m.get("supportedGenerationMethods") or [])
+    ]
+
+
+class ModelRegistry:
+    """Process-wide view of which Gemini models are worth calling.
+
+    Caches the generateContent model list, remembers the last model that
+    answered, and keeps a breaker per model: a 404 parks it for an hour, a
+    429 for its RetryInfo delay, and repeated 5xx/transport failures for a
+    short cool-down.  Parked models are skipped instead of re-tried.
+    """
+
+    def __init__(self, list_models, list_models_async=None):
+        self.list_models = list_models
+        self.list_models_async = list_models_async
+        self.last_good = None
+        self._models = None
+        self._models_expire = 0.0
+        self._open = {}      # model -> (reopens_at, reason)
+        self._errors = {}    # model -> consecutive failures
+        self._lock = threading.Lock()
+
+    def _cached_models(self):
+        with self._lock:
+            if self._models is not None and time.monotonic() < self._models_expire:
+                return self._models
+        return None
+
+    def _remember_models(self, models):
+        """Cache a fresh list, or with None keep the old one for a short retry window."""
+        ttl = AI_MODEL_LIST_TTL_SECONDS
+        if models is None:
+            models = self._models or []
+            ttl = AI_MODEL_LIST_RETRY_SECONDS
+        with self._lock:
+            self._models = models
+            self._models_expire = time.monotonic() + ttl
+        return models
+
+    def supported_models(self, api_key):
+        models = self._cached_models()
+        if models is not None:
+            return models
+        try:
+            models = self.list_models(api_key)
+        except Exception:
+            app.logger.warning("Could not list Gemini models", exc_info=True)
+            models = None
+        return self._remember_models(models)
+
+    async def supported_models_async(self, api_key):
+        models = self._cached_models()
+        if models is not None:
+            return models
+        try:
+            models = await self.list_models_async(api_key)
+        except Exception:
+            app.logger.warning("Could not list Gemini models", exc_info=True)
+            models = None
+        return self._remember_models(models)
+
+    def available(self, model):
+        with self._lock:
+            state = self._open.get(model)
+            if state is None:
+                return True
+            if time.monotonic() >= state[0]:
+                del self._open[model]
+                return True
+            return False
+
+    def candidates(self, models):
+        """``models`` in order, minus parked ones, with last_good right after the first."""
+        ordered = list(models[:1])
+        if self.last_good:
+            ordered.append(self.last_good)
+        ordered.extend(models[1:])
+        seen = set()
+        result = []
+        for model in ordered:
+            if model not in seen and self.available(model):
+                seen.add(model)
+                result.append(model)
+        return result
+
+    def record_success(self, model):
+        with self._lock:
+            self._open.pop(model, None)
+            self._errors.pop(model, None)
+            self.last_good = model
+
+    def record_not_found(self, model):
+        self._park(model, AI_MODEL_NOT_FOUND_SECONDS, "not_found")
+
+    def record_quota(self, model, retry_after=None):
+        self._park(model, retry_after if retry_after is not None else AI_MODEL_QUOTA_SECONDS, "quota")
+
+    def record_error(self, model):
+        with self._lock:
+            errors = self._errors.get(model, 0) + 1
+            self._errors[model] = errors
+        if errors >= AI_MODEL_ERROR_THRESHOLD:
+            self._park(model, AI_MODEL_ERROR_SECONDS, "error")
+
+    def _park(self, model, seconds, reason):
+        with self._lock:
+            self._open[model] = (time.monotonic() + seconds, reason)
+            self._errors.pop(model, None)
+            if self.last_good == model:
+                self.last_good = None
+
+    def quota_retry_after(self):
+        """Seconds until the first quota-parked model reopens, or None."""
+        now = time.monotonic()
+        with self._lock:
+            waits = [until - now for until, reason in self._open.values() if reason == "quota" and until > now]
+        return min(waits) if waits else None
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "last_good": self.last_good,
+                "models_cached": len(self._models or []),
+                "parked": {
+                    model: {"reason": reason, "seconds_left": round(until - now, 1)}
+                    for model, (until, reason) in self._open.items() if until > now
+                }
+            }
+
+
+ai_models = ModelRegistry(_list_gemini_models, _list_gemini_models_async)
 
-    if not final_user:
-        return None, "Unable to complete OAuth sign-in."
-    if int(final_user[3]) == 0:
-        return None, "This account is deactivated. Contact support to reactivate."
-    return {"id": final_user[0], "username": final_user[1], "email": final_user[2]}, None
 
 # --- Routes ---
 @app.route('/')
@@ -411,7 +2498,7 @@ def login():
         email = request.form['email']
         password = request.form['password']
 
-        conn = sqlite3.connect('users.db')
+        conn = get_db()
         cursor = conn.cursor()
         cursor.execute(
             "SELECT id, username, email, password, is_active FROM users WHERE email=?",
@@ -447,7 +2534,7 @@ def signup():
 
         hashed_password = generate_password_hash(password)
 
-        conn = sqlite3.connect('users.db')
+        conn = get_db()
         cursor = conn.cursor()
 
         try:
@@ -489,18 +2576,22 @@ def oauth_google_start():
     return redirect(auth_url)
 
 
-@app.route('/auth/google/callback')
-def oauth_google_callback():
+GOOGLE_OAUTH_TOKEN_URL = "https://oauth2.googleapis.com/token"
+GOOGLE_OAUTH_USERINFO_URL = "https://www.googleapis.com/oauth2/v3/userinfo"
+
+
+def _google_callback_token_form():
+    """Check the callback's state and code; returns (error_response, None) or (None, form)."""
     expected_state = session.pop("oauth_google_state", "")
     received_state = (request.args.get("state") or "").strip()
     if not expected_state or expected_state != received_state:
         flash("Google sign-in failed: invalid state.", "danger")
-        return redirect(url_for('login'))
+        return redirect(url_for('login')), None
 
     code = (request.args.get("code") or "").strip()
     if not code:
         flash("Google sign-in failed: missing authorization code.", "danger")
-        return redirect(url_for('login'))
+        return redirect(url_for('login')), None
 
     client_id = (os.environ.get("GOOGLE_OAUTH_CLIENT_ID") or "").strip()
     client_secret = (os.environ.get("GOOGLE_OAUTH_CLIENT_SECRET") or "").strip()
@@ -510,43 +2601,59 @@ def oauth_google_callback():
 
     if not client_id or not client_secret:
         flash("Google OAuth is not configured on server.", "danger")
+        return redirect(url_for('login')), None
+
+    return None, {
+        "code": code,
+        "client_id": client_id,
+        "client_secret": client_secret,
+        "redirect_uri": redirect_uri,
+        "grant_type": "authorization_code"
+    }
+
+
+def _google_userinfo_url(token_data):
+    access_token = token_data.get("access_token")
+    if not access_token:
+        return None
+    return GOOGLE_OAUTH_USERINFO_URL + "?" + urllib.parse.urlencode({"access_token": access_token})
+
+
+def _google_login(user_info):
+    provider_user_id = user_info.get("sub")
+    email = user_info.get("email") or ""
+    name = user_info.get("name") or ""
+    picture = user_info.get("picture") or ""
+
+    user, error = _oauth_login_or_create_user("google", provider_user_id, email, name, picture)
+    if error:
+        flash(error, "danger")
         return redirect(url_for('login'))
 
-    try:
-        token_data = _oauth_post_form(
-            "https://oauth2.googleapis.com/token",
-            {
-                "code": code,
-                "client_id": client_id,
-                "client_secret": client_secret,
-                "redirect_uri": redirect_uri,
-                "grant_type": "authorization_code"
-            }
-        )
-        access_token = token_data.get("access_token")
-        if not access_token:
-            flash("Google sign-in failed: no access token.", "danger")
-            return redirect(url_for('login'))
+    _finalize_user_session(user["id"], user["username"], user["email"])
+    return redirect(url_for('home'))
+
+
+def _google_login_failed(reason=None):
+    flash(reason or "Google sign-in failed. Check OAuth credentials and callback URL.", "danger")
+    return redirect(url_for('login'))
 
-        user_info = _oauth_get_json(
-            "https://www.googleapis.com/oauth2/v3/userinfo?"
-            + urllib.parse.urlencode({"access_token": access_token})
-        )
-        provider_user_id = user_info.get("sub")
-        email = user_info.get("email") or ""
-        name = user_info.get("name") or ""
-        picture = user_info.get("picture") or ""
-
-        user, error = _oauth_login_or_create_user("google", provider_user_id, email, name, picture)
-        if error:
-            flash(error, "danger")
-            return redirect(url_for('login'))
 
-        _finalize_user_session(user["id"], user["username"], user["email"])
-        return redirect(url_for('home'))
+@app.route('/auth/google/callback')
+async def oauth_google_callback():
+    error, token_form = _google_callback_token_form()
+    if error:
+        return error
+
+    release_request_db()
+    try:
+        userinfo_url = _google_userinfo_url(await _oauth_post_form(GOOGLE_OAUTH_TOKEN_URL, token_form))
+        if not userinfo_url:
+            return _google_login_failed("Google sign-in failed: no access token.")
+        user_info = await _oauth_get_json(userinfo_url)
+        return await asyncio.to_thread(_google_login, user_info)
     except Exception:
-        flash("Google sign-in failed. Check OAuth credentials and callback URL.", "danger")
-        return redirect(url_for('login'))
+        return _google_login_failed()
 
 
 @app.route('/about')
@@ -587,34 +2694,48 @@ def home():
 import random
 
 @app.route("/api/instagram/analytics")
+@analytics_cached("instagram")
 def dynamic_mock_analytics():
-    def generate_series(start):
-        values = [start]
-        for _ in range(6):
-            values.append(values[-1] + random.randint(-50, 150))
-        return values
-
-    followers = generate_series(2500)
-    impressions = generate_series(2000)
-    likes = generate_series(800)
+    try:
+        series, labels, graphs = platform_analytics(session["user_id"], "instagram")
+    except ValueError as err:
+        return jsonify({"error": str(err)}), 400
+    followers = series["followers"]
+    impressions = series["impressions"]
+    likes = series["likes"]
 
     analytics = {
         "followers": followers[-1],
-        "followers_change": followers[-1] - followers[-2],
+        "followers_change": _metric_change(followers),
         "impressions": impressions[-1],
-        "impressions_change": impressions[-1] - impressions[-2],
-        "engagement_rate": round((likes[-1] / impressions[-1]) * 100, 2),
+        "impressions_change": _metric_change(impressions),
+        "engagement_rate": round((likes[-1] / impressions[-1]) * 100, 2) if impressions[-1] else 0,
         "likes": likes[-1],
-        "followers_graph": followers,
-        "impressions_graph": impressions,
-        "likes_graph": likes,
-        "labels": ["Mon","Tue","Wed","Thu","Fri","Sat","Sun"]
+        "followers_graph": graphs["followers"],
+        "impressions_graph": graphs["impressions"],
+        "likes_graph": graphs["likes"],
+        "labels": labels
     }
 
     return jsonify(analytics)
 import random
 from flask import jsonify
 
+@app.route("/api/analytics/overview")
+@analytics_cached("overview")
+def analytics_overview():
+    results, missing = gather_analytics(session["user_id"])
+    response = jsonify({
+        "kpis": merge_analytics_kpis(results),
+        "sources": results,
+        "missing": missing,
+        "partial": bool(missing)
+    })
+    # Partial answers are retried on the next poll rather than cached.
+    response.cache_control.no_store = bool(missing)
+    return response
+
+
 @app.route("/api/analytics")
 def analytics():
     followers = random.randint(2500, 4000)
@@ -639,97 +2760,454 @@ import random
 from flask import jsonify
 
 @app.route("/api/youtube")
+@analytics_cached("youtube")
 def youtube_analytics():
-
-    def generate_series(start):
-        values = [start]
-        for _ in range(6):
-            values.append(values[-1] + random.randint(-20, 200))
-        return values
-
-    subscribers = generate_series(2800)
-    views = generate_series(5000)
-    likes = generate_series(800)
+    try:
+        series, labels, graphs = platform_analytics(session["user_id"], "youtube")
+    except ValueError as err:
+        return jsonify({"error": str(err)}), 400
+    subscribers = series["subscribers"]
+    views = series["views"]
+    likes = series["likes"]
+    engagement = series["engagement_rate"]
 
     return jsonify({
         "subscribers": subscribers[-1],
-        "subscribers_change": subscribers[-1] - subscribers[-2],
+        "subscribers_change": _metric_change(subscribers),
 
         "views": views[-1],
-        "views_change": views[-1] - views[-2],
+        "views_change": _metric_change(views),
 
-        "engagement_rate": random.randint(20, 50),
-        "engagement_change": random.randint(-5, 10),
+        "engagement_rate": engagement[-1],
+        "engagement_change": _metric_change(engagement),
 
         "likes": likes[-1],
-        "likes_change": likes[-1] - likes[-2],
+        "likes_change": _metric_change(likes),
 
-        "subscribers_graph": subscribers,
-        "views_graph": views,
-        "labels": ["Mon","Tue","Wed","Thu","Fri","Sat","Sun"]
+        "subscribers_graph": graphs["subscribers"],
+        "views_graph": graphs["views"],
+        "labels": labels
     })
 
 @app.route("/api/twitter")
+@analytics_cached("twitter")
 def twitter_analytics():
-
-    def generate_series(start):
-        values = [start]
-        for _ in range(6):
-            values.append(values[-1] + random.randint(5, 120))
-        return values
-
-    followers = generate_series(1800)
-    impressions = generate_series(9000)
+    try:
+        series, labels, graphs = platform_analytics(session["user_id"], "twitter")
+    except ValueError as err:
+        return jsonify({"error": str(err)}), 400
+    followers = series["followers"]
+    impressions = series["impressions"]
+    likes = series["likes"]
+    engagement = series["engagement_rate"]
 
     return jsonify({
         "followers": followers[-1],
-        "followers_change": followers[-1] - followers[-2],
+        "followers_change": _metric_change(followers),
 
         "impressions": impressions[-1],
-        "impressions_change": impressions[-1] - impressions[-2],
+        "impressions_change": _metric_change(impressions),
 
-        "engagement_rate": random.randint(10, 40),
-        "engagement_change": random.randint(-5, 12),
+        "engagement_rate": engagement[-1],
+        "engagement_change": _metric_change(engagement),
 
-        "likes": random.randint(500, 2500),
-        "likes_change": random.randint(-50, 120),
+        "likes": likes[-1],
+        "likes_change": _metric_change(likes),
 
-        "followers_graph": followers,
-        "impressions_graph": impressions,
+        "followers_graph": graphs["followers"],
+        "impressions_graph": graphs["impressions"],
 
-        "labels": ["Mon","Tue","Wed","Thu","Fri","Sat","Sun"]
+        "labels": labels
     })
 
 @app.route("/api/facebook")
+@analytics_cached("facebook")
 def facebook_analytics():
+    try:
+        series, labels, graphs = platform_analytics(session["user_id"], "facebook")
+    except ValueError as err:
+        return jsonify({"error": str(err)}), 400
+    followers = series["followers"]
+    reach = series["reach"]
+    likes = series["likes"]
+    engagement = series["engagement_rate"]
+
+    return jsonify({
+        "followers": followers[-1],
+        "followers_change": _metric_change(followers),
+
+        "reach": reach[-1],
+        "reach_change": _metric_change(reach),
+
+        "engagement_rate": engagement[-1],
+        "engagement_change": _metric_change(engagement),
+
+        "likes": likes[-1],
+        "likes_change": _metric_change(likes),
+
+        "followers_graph": graphs["followers"],
+        "reach_graph": graphs["reach"],
+
+        "labels": labels
+    })
+
+
+@app.route("/api/metrics/outbound")
+def outbound_metrics():
+    if "user_id" not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    return jsonify({
+        "hosts": http_client.stats(),
+        "ai_models": ai_models.snapshot(),
+        "ai_cache": ai_response_cache.stats(),
+        "ai_admission": ai_admission.gauges()
+    })
+
+
+@app.route("/api/metrics/samples", methods=["POST"])
+def ingest_metrics():
+    if "user_id" not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+
+    data = request.json or {}
+    raw_samples = data.get("samples")
+    if not isinstance(raw_samples, list) or not raw_samples:
+        return jsonify({"error": "samples must be a non-empty list"}), 400
+    if len(raw_samples) > METRIC_INGEST_MAX_BATCH:
+        return jsonify({"error": f"At most {METRIC_INGEST_MAX_BATCH} samples per batch"}), 400
+
+    now = int(time.time())
+    samples = []
+    for index, item in enumerate(raw_samples):
+        if not isinstance(item, dict):
+            return jsonify({"error": f"Sample {index} must be an object"}), 400
+        platform = str(item.get("platform") or "").strip().lower()
+        metric = str(item.get("metric") or "").strip().lower()
+        if metric not in PLATFORM_METRICS.get(platform, {}):
+            return jsonify({"error": f"Sample {index} has an unknown platform/metric"}), 400
+        try:
+            ts = int(item.get("ts") or now)
+            value = float(item["value"])
+        except (KeyError, TypeError, ValueError):
+            return jsonify({"error": f"Sample {index} needs a numeric value and ts"}), 400
+        samples.append((platform, metric, ts, value))
+
+    conn = get_db()
+    cursor = conn.cursor()
+    ingest_metric_samples(cursor, session["user_id"], samples)
+    conn.commit()
+    conn.close()
+
+    metrics_rollup.ensure_running()
+    metrics_rollup.poke()
+    return jsonify({"accepted": len(samples)})
+
+
+@app.cli.command("rollup-metrics")
+def rollup_metrics_command():
+    """Fold pending metric samples into rollups (flask --app app rollup-metrics)."""
+    print(f"Rolled up {rollup_metrics()} samples")
+
+
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+
+def _spool_upload(file):
+    """Stream an upload into a temp file next to the store, hashing as it goes.
+
+    Returns (temp_path, sha256 hex digest, size).
+    """
+    digest = hashlib.sha256()
+    size = 0
+    fd, temp_path = tempfile.mkstemp(prefix=".upload-", dir=app.config["UPLOAD_FOLDER"])
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = file.stream.read(UPLOAD_CHUNK_BYTES)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                size += len(chunk)
+                out.write(chunk)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return temp_path, digest.hexdigest(), size
+
+
+def store_upload(cursor, file, ext=None):
+    """Save an upload by content and return its static/uploads path.
+
+    Identical bytes map to one file at uploads/<d[:2]>/<d[2:4]>/<digest><ext>
+    however often, and by whomever, they are uploaded.  Call this inside the
+    transaction that stores the reference: the blob row takes the database
+    write lock before the file is moved into place, which keeps it from
+    racing collect_uploads() in another worker.  A file placed for a new
+    row is deleted again if that transaction rolls back.
+    """
+    if ext is None:
+        ext = os.path.splitext(secure_filename(file.filename or ""))[1].lower()
+    if ext == ".jpeg":
+        ext = ".jpg"
+    temp_path, digest, size = _spool_upload(file)
+    try:
+        cursor.execute(
+            "INSERT OR IGNORE INTO upload_blobs (path, digest, size) VALUES (?, ?, ?)",
+            (f"static/uploads/{digest[:2]}/{digest[2:4]}/{digest}{ext}", digest, size)
+        )
+        inserted = cursor.rowcount == 1
+        # An earlier upload of the same bytes may have used another extension.
+        cursor.execute("SELECT path FROM upload_blobs WHERE digest=?", (digest,))
+        image_path = cursor.fetchone()[0]
+        full_path = os.path.join(app.root_path, image_path)
+        if not os.path.exists(full_path):
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            os.replace(temp_path, full_path)
+            temp_path = None
+            if inserted:
+                cursor.connection.remove_on_rollback(full_path)
+        return image_path
+    finally:
+        if temp_path is not None:
+            os.remove(temp_path)
+
+
+def _remove_upload_files(paths):
+    for path in paths:
+        try:
+            os.remove(os.path.join(app.root_path, path))
+        except OSError:
+            pass
+
 
-    def generate_series(start):
-        values = [start]
-        for _ in range(6):
-            values.append(values[-1] + random.randint(10, 200))
-        return values
+def collect_uploads(cursor):
+    """Delete stored files, and their variants, nothing references any more.
 
-    followers = generate_series(3200)
-    reach = generate_series(7000)
+    Call before committing the transaction that dropped the references, so
+    the write lock is still held while files are removed.
+    """
+    cursor.execute("SELECT path, variants FROM upload_blobs WHERE refcount <= 0")
+    rows = cursor.fetchall()
+    if not rows:
+        return
+    cursor.execute("DELETE FROM upload_blobs WHERE refcount <= 0")
+    paths = []
+    for path, variants in rows:
+        paths.append(path)
+        paths.extend(_variant_paths(upload_variants(variants)))
+    _remove_upload_files(paths)
+
+
+IMAGE_VARIANT_WIDTHS = tuple(sorted({
+    int(width) for width in (os.environ.get("IMAGE_VARIANT_WIDTHS") or "160,480,1080").split(",")
+    if width.strip()
+}))
+IMAGE_PIPELINE_INTERVAL_SECONDS = int((os.environ.get("IMAGE_PIPELINE_INTERVAL_SECONDS") or "60").strip())
+IMAGE_VARIANT_LEASE_SECONDS = 300
+
+# (key, Pillow format, extension, save options), most compact first.  AVIF
+# needs a Pillow built with libavif, so it is only offered when present.
+IMAGE_VARIANT_ENCODERS = [
+    ("avif", "AVIF", ".avif", {"quality": 50, "speed": 6}),
+    ("webp", "WEBP", ".webp", {"quality": 78, "method": 4}),
+]
+if not features.check("avif"):
+    IMAGE_VARIANT_ENCODERS = IMAGE_VARIANT_ENCODERS[1:]
+# What <img> falls back to for browsers that take neither of the above.
+IMAGE_FALLBACK_ENCODERS = {
+    "RGB": ("jpeg", "JPEG", ".jpg", {"quality": 82, "optimize": True, "progressive": True}),
+    "RGBA": ("png", "PNG", ".png", {"optimize": True}),
+}
+
+
+def upload_variants(raw):
+    """Decode an upload_blobs.variants value into {width: {format: path}}."""
+    if not raw:
+        return {}
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return {}
+
+
+def stored_variants(cursor, image_path):
+    """Variants already rendered for image_path, or {} while it is pending."""
+    cursor.execute("SELECT variants FROM upload_blobs WHERE path=?", (image_path,))
+    row = cursor.fetchone()
+    return upload_variants(row[0]) if row else {}
+
+
+def _variant_paths(variants):
+    return [path for formats in variants.values() for path in formats.values()]
+
+
+def _decode_upload(full_path):
+    """Decode an upload once, upright, at no more than the largest width needed.
+
+    JPEGs are decoded straight at a reduced scale (draft), which is where
+    most of the saving on large photos comes from.
+    """
+    with Image.open(full_path) as img:
+        width, height = img.size
+        # EXIF orientations 5-8 are rotated a quarter turn.
+        rotated = img.getexif().get(0x0112) in (5, 6, 7, 8)
+        target = min(IMAGE_VARIANT_WIDTHS[-1], height if rotated else width)
+        if rotated:
+            img.draft(None, (max(1, width * target // height), target))
+        else:
+            img.draft(None, (target, max(1, height * target // width)))
+        img = ImageOps.exif_transpose(img)
+    mode = "RGBA" if img.has_transparency_data else "RGB"
+    return img if img.mode == mode else img.convert(mode)
+
+
+def _save_variant(img, image_format, path, options):
+    full_path = os.path.join(app.root_path, path)
+    fd, temp_path = tempfile.mkstemp(prefix=".variant-", dir=os.path.dirname(full_path))
+    try:
+        with os.fdopen(fd, "wb") as out:
+            img.save(out, format=image_format, **options)
+        os.replace(temp_path, full_path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def render_upload_variants(image_path):
+    """Write size-bucketed variants of one stored upload next to it.
+
+    Each width in IMAGE_VARIANT_WIDTHS (capped at the image's own width)
+    gets every encoder in IMAGE_VARIANT_ENCODERS plus a JPEG or PNG
+    fallback, named <name>_<width><ext>.  Buckets are resized from the
+    next larger one, so the source is decoded only once.  Returns
+    {width: {format: path}}.
+    """
+    img = _decode_upload(os.path.join(app.root_path, image_path))
+    base = os.path.splitext(image_path)[0]
+    encoders = IMAGE_VARIANT_ENCODERS + [IMAGE_FALLBACK_ENCODERS[img.mode]]
+    variants = {}
+    try:
+        for width in sorted({min(width, img.width) for width in IMAGE_VARIANT_WIDTHS}, reverse=True):
+            if width != img.width:
+                img = img.resize((width, max(1, round(img.height * width / img.width))), Image.LANCZOS)
+            formats = variants[str(width)] = {}
+            for key, image_format, ext, options in encoders:
+                path = f"{base}_{width}{ext}"
+                _save_variant(img, image_format, path, options)
+                formats[key] = path
+    except BaseException:
+        _remove_upload_files(_variant_paths(variants))
+        raise
+    return variants
+
+
+def process_next_upload():
+    """Render variants for the oldest unprocessed upload.
+
+    Returns False when there is nothing left to do.  The row is leased
+    for IMAGE_VARIANT_LEASE_SECONDS so concurrent workers skip it, and
+    the slow part runs outside any transaction.
+    """
+    now = time.time()
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    cursor.execute(
+        """
+        SELECT path FROM upload_blobs
+        WHERE variants IS NULL AND refcount > 0
+          AND (variants_claimed_at IS NULL OR variants_claimed_at < ?)
+        ORDER BY created_at
+        LIMIT 1
+        """,
+        (now - IMAGE_VARIANT_LEASE_SECONDS,)
+    )
+    row = cursor.fetchone()
+    if row is None:
+        conn.commit()
+        conn.close()
+        return False
+    image_path = row[0]
+    cursor.execute(
+        "UPDATE upload_blobs SET variants_claimed_at=? WHERE path=?",
+        (now, image_path)
+    )
+    conn.commit()
+    conn.close()
 
-    return jsonify({
-        "followers": followers[-1],
-        "followers_change": followers[-1] - followers[-2],
+    try:
+        variants = render_upload_variants(image_path)
+    except (OSError, ValueError, Image.DecompressionBombError) as err:
+        # Not an image, truncated or gone: record that rather than retry forever.
+        app.logger.warning("No image variants for %s: %s", image_path, err)
+        variants = {}
 
-        "reach": reach[-1],
-        "reach_change": reach[-1] - reach[-2],
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute(
+        "UPDATE upload_blobs SET variants=?, variants_claimed_at=NULL WHERE path=?",
+        (json.dumps(variants), image_path)
+    )
+    if cursor.rowcount == 0:
+        # collect_uploads() removed the blob while we were rendering.
+        _remove_upload_files(_variant_paths(variants))
+    conn.commit()
+    conn.close()
+    return True
+
+
+class ImageVariantWorker:
+    """Background thread that renders upload variants off the request path.
+
+    Upload handlers poke it after committing; the interval sweep picks up
+    files stored before the pipeline existed and leases that expired.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+
+    def ensure_running(self):
+        if self.interval <= 0:
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="image-variants", daemon=True)
+            self._thread.start()
+
+    def poke(self):
+        """Process pending uploads now instead of waiting for the interval."""
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                with app.app_context():
+                    while process_next_upload():
+                        pass
+            except Exception:
+                # Keep the thread alive; the claimed upload's lease expires
+                # and it is retried on a later pass.
+                app.logger.exception("Image variant pass failed")
 
-        "engagement_rate": random.randint(20, 60),
-        "engagement_change": random.randint(-10, 15),
 
-        "likes": random.randint(1000, 4000),
-        "likes_change": random.randint(-100, 200),
+image_variants = ImageVariantWorker(IMAGE_PIPELINE_INTERVAL_SECONDS)
 
-        "followers_graph": followers,
-        "reach_graph": reach,
 
-        "labels": ["Mon","Tue","Wed","Thu","Fri","Sat","Sun"]
-    })
+@app.cli.command("process-images")
+def process_images_command():
+    """Render variants for every pending upload (flask --app app process-images)."""
+    count = 0
+    while process_next_upload():
+        count += 1
+    print(f"Processed {count} uploads")
 
 
 @app.route("/api/posts", methods=["POST"])
@@ -744,23 +3222,25 @@ def create_post():
     file = request.files.get("image")
     image_path = ""
 
-    if file:
-        filename = secure_filename(file.filename)
-        path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-        file.save(path)
-        image_path = f"static/uploads/{filename}"
-
     conn = get_db()
     cursor = conn.cursor()
 
+    if file:
+        image_path = store_upload(cursor, file)
+
     cursor.execute("""
         INSERT INTO posts (user_id, caption, image_path, platforms, status)
         VALUES (?, ?, ?, ?, ?)
     """, (session["user_id"], caption, image_path, platforms, status))
+    if status == "published":
+        _fan_out_post_notification(cursor, session["user_id"], cursor.lastrowid)
 
     conn.commit()
     conn.close()
 
+    if image_path:
+        image_variants.ensure_running()
+        image_variants.poke()
     return jsonify({"message": "Post saved"})
 
 @app.route("/api/posts")
@@ -768,20 +3248,22 @@ def get_posts():
     if "user_id" not in session:
         return jsonify([])
 
+    image_variants.ensure_running()
     conn = get_db()
     cursor = conn.cursor()
 
     cursor.execute("""
-        SELECT id, caption, image_path FROM posts
-        WHERE user_id=? AND status='published'
-        ORDER BY created_at DESC
+        SELECT p.id, p.caption, p.image_path, b.variants FROM posts p
+        LEFT JOIN upload_blobs b ON b.path = p.image_path
+        WHERE p.user_id=? AND p.status='published'
+        ORDER BY p.created_at DESC
     """, (session["user_id"],))
 
     posts = cursor.fetchall()
     conn.close()
 
     return jsonify([
-        {"id": p[0], "caption": p[1], "image": p[2]}
+        {"id": p[0], "caption": p[1], "image": p[2], "variants": upload_variants(p[3])}
         for p in posts
     ])
 
@@ -804,23 +3286,19 @@ def delete_post(post_id):
         conn.close()
         return jsonify({"error": "Post not found"}), 404
 
-    image_path = row[0]
-
     cursor.execute(
         "DELETE FROM posts WHERE id=? AND user_id=?",
         (post_id, session["user_id"])
     )
+    cursor.execute(
+        "DELETE FROM notifications WHERE kind='post' AND ref_id=?",
+        (post_id,)
+    )
+    # The image stays while a campaign or another post still uses it.
+    collect_uploads(cursor)
     conn.commit()
     conn.close()
 
-    if image_path and image_path.startswith("static/uploads/"):
-        full_image_path = os.path.join(app.root_path, image_path)
-        if os.path.exists(full_image_path):
-            try:
-                os.remove(full_image_path)
-            except OSError:
-                pass
-
     return jsonify({"message": "Post deleted"})
 
 
@@ -867,6 +3345,7 @@ def create_campaign():
         (session["user_id"], post_id, campaign_title, "Running", budget, row[1])
     )
     campaign_id = cursor.lastrowid
+    variants = stored_variants(cursor, row[1])
     conn.commit()
     conn.close()
 
@@ -878,7 +3357,8 @@ def create_campaign():
             "status": "Running",
             "budget": budget,
             "post_id": post_id,
-            "image": row[1]
+            "image": row[1],
+            "variants": variants
         }
     })
 
@@ -903,14 +3383,9 @@ def create_custom_campaign():
     if not file or not file.filename:
         return jsonify({"error": "Image is required"}), 400
 
-    filename = secure_filename(file.filename)
-    filename = f"{int(time.time())}_{filename}"
-    path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-    file.save(path)
-    image_path = f"static/uploads/{filename}"
-
     conn = get_db()
     cursor = conn.cursor()
+    image_path = store_upload(cursor, file)
 
     cursor.execute(
         """
@@ -920,6 +3395,7 @@ def create_custom_campaign():
         (session["user_id"], caption, image_path, "Ads", "published")
     )
     post_id = cursor.lastrowid
+    _fan_out_post_notification(cursor, session["user_id"], post_id)
 
     title = caption[:40] if caption else "Boost Campaign"
     campaign_title = f"Ad: {title}"
@@ -932,10 +3408,15 @@ def create_custom_campaign():
         (session["user_id"], post_id, campaign_title, "Running", budget, image_path)
     )
     campaign_id = cursor.lastrowid
+    # Only non-empty when these exact bytes were uploaded before.
+    variants = stored_variants(cursor, image_path)
 
     conn.commit()
     conn.close()
 
+    image_variants.ensure_running()
+    image_variants.poke()
+
     return jsonify({
         "message": "Ad campaign created",
         "campaign": {
@@ -944,7 +3425,8 @@ def create_custom_campaign():
             "status": "Running",
             "budget": budget,
             "post_id": post_id,
-            "image": image_path
+            "image": image_path,
+            "variants": variants
         }
     })
 
@@ -954,14 +3436,16 @@ def get_campaigns():
     if "user_id" not in session:
         return jsonify([]), 401
 
+    image_variants.ensure_running()
     conn = get_db()
     cursor = conn.cursor()
     cursor.execute(
         """
-        SELECT id, title, status, budget, image_path
-        FROM campaigns
-        WHERE user_id=?
-        ORDER BY created_at DESC
+        SELECT c.id, c.title, c.status, c.budget, c.image_path, b.variants
+        FROM campaigns c
+        LEFT JOIN upload_blobs b ON b.path = c.image_path
+        WHERE c.user_id=?
+        ORDER BY c.created_at DESC
         """,
         (session["user_id"],)
     )
@@ -974,7 +3458,8 @@ def get_campaigns():
             "title": r[1],
             "status": r[2],
             "budget": r[3],
-            "image": r[4]
+            "image": r[4],
+            "variants": upload_variants(r[5])
         }
         for r in rows
     ])
@@ -1021,8 +3506,9 @@ def delete_campaign(campaign_id):
         "DELETE FROM campaigns WHERE id=? AND user_id=?",
         (campaign_id, session["user_id"])
     )
-    conn.commit()
     deleted = cursor.rowcount
+    collect_uploads(cursor)
+    conn.commit()
     conn.close()
 
     if not deleted:
@@ -1260,10 +3746,12 @@ def block_user():
             "INSERT INTO blocked_users (user_id, blocked_user_id) VALUES (?, ?)",
             (session["user_id"], blocked_user_id)
         )
+        _delete_pair_notifications(cursor, session["user_id"], blocked_user_id)
         conn.commit()
     except sqlite3.IntegrityError:
         conn.close()
         return jsonify({"error": "User already blocked"}), 409
+    blocklist.invalidate(session["user_id"], blocked_user_id)
 
     conn.close()
     return jsonify({"message": "User blocked"})
@@ -1280,9 +3768,10 @@ def unblock_user(blocked_user_id):
         "DELETE FROM blocked_users WHERE user_id=? AND blocked_user_id=?",
         (session["user_id"], blocked_user_id)
     )
-    conn.commit()
     deleted = cursor.rowcount
+    conn.commit()
     conn.close()
+    blocklist.invalidate(session["user_id"], blocked_user_id)
 
     if not deleted:
         return jsonify({"error": "Blocked user not found"}), 404
@@ -1298,7 +3787,12 @@ def get_account_info():
     conn = get_db()
     cursor = conn.cursor()
     cursor.execute(
-        "SELECT username, email, profile_image FROM users WHERE id=?",
+        """
+        SELECT u.username, u.email, u.profile_image, b.variants
+        FROM users u
+        LEFT JOIN upload_blobs b ON b.path = u.profile_image
+        WHERE u.id=?
+        """,
         (session["user_id"],)
     )
     row = cursor.fetchone()
@@ -1310,7 +3804,8 @@ def get_account_info():
     return jsonify({
         "username": row[0],
         "email": row[1],
-        "profile_image": row[2] or ""
+        "profile_image": row[2] or "",
+        "profile_image_variants": upload_variants(row[3])
     })
 
 
@@ -1329,38 +3824,25 @@ def upload_profile_photo():
     if ext not in allowed_exts:
         return jsonify({"error": "Invalid file type"}), 400
 
-    filename = f"profile_{session['user_id']}_{int(time.time())}{ext}"
-    path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-    file.save(path)
-    image_path = f"static/uploads/{filename}"
-
     conn = get_db()
     cursor = conn.cursor()
-    cursor.execute(
-        "SELECT profile_image FROM users WHERE id=?",
-        (session["user_id"],)
-    )
-    row = cursor.fetchone()
-    old_image = row[0] if row else ""
-
+    image_path = store_upload(cursor, file, ext)
     cursor.execute(
         "UPDATE users SET profile_image=? WHERE id=?",
         (image_path, session["user_id"])
     )
+    # Frees the previous photo unless something else still uses it.
+    collect_uploads(cursor)
+    variants = stored_variants(cursor, image_path)
     conn.commit()
     conn.close()
 
-    if old_image and old_image.startswith("static/uploads/") and old_image != image_path:
-        old_full = os.path.join(app.root_path, old_image)
-        if os.path.exists(old_full):
-            try:
-                os.remove(old_full)
-            except OSError:
-                pass
-
+    image_variants.ensure_running()
+    image_variants.poke()
     return jsonify({
         "message": "Profile photo updated",
-        "profile_image": image_path
+        "profile_image": image_path,
+        "profile_image_variants": variants
     })
 
 
@@ -1473,14 +3955,48 @@ def delete_account():
     conn = get_db()
     cursor = conn.cursor()
     cursor.execute("DELETE FROM messages WHERE sender_id=? OR receiver_id=?", (user_id, user_id))
+    cursor.execute(
+        "SELECT user_id, unread_count FROM conversations WHERE peer_id=? AND unread_count > 0",
+        (user_id,)
+    )
+    for peer_id, unread_count in cursor.fetchall():
+        _adjust_unread_messages(cursor, peer_id, -unread_count)
+    cursor.execute("DELETE FROM conversations WHERE user_id=? OR peer_id=?", (user_id, user_id))
+    cursor.execute("DELETE FROM user_counters WHERE user_id=?", (user_id,))
+    cursor.execute("DELETE FROM notifications WHERE user_id=? OR actor_id=?", (user_id, user_id))
+    cursor.execute(
+        """
+        SELECT blocked_user_id FROM blocked_users WHERE user_id = ?
+        UNION
+        SELECT user_id FROM blocked_users WHERE blocked_user_id = ?
+        """,
+        (user_id, user_id)
+    )
+    block_counterparts = [row[0] for row in cursor.fetchall()]
+    cursor.execute(
+        "DELETE FROM blocked_users WHERE user_id=? OR blocked_user_id=?",
+        (user_id, user_id)
+    )
     cursor.execute("DELETE FROM campaigns WHERE user_id=?", (user_id,))
     cursor.execute("DELETE FROM posts WHERE user_id=?", (user_id,))
     cursor.execute("DELETE FROM tasks WHERE user_id=?", (user_id,))
     cursor.execute("DELETE FROM live_sessions WHERE user_id=?", (user_id,))
+    cursor.execute("DELETE FROM live_totals WHERE user_id=?", (user_id,))
+    cursor.execute(
+        "DELETE FROM ai_messages WHERE conversation_id IN "
+        "(SELECT id FROM ai_conversations WHERE user_id=?)",
+        (user_id,)
+    )
+    cursor.execute("DELETE FROM ai_conversations WHERE user_id=?", (user_id,))
     cursor.execute("DELETE FROM settings WHERE user_id=?", (user_id,))
     cursor.execute("DELETE FROM users WHERE id=?", (user_id,))
+    collect_uploads(cursor)
     conn.commit()
     conn.close()
+    blocklist.invalidate(user_id, *block_counterparts)
+    ai_admission.forget(user_id)
+    live_presence.stop(user_id)
+    analytics_cache.invalidate_users([user_id])
 
     session.clear()
     return jsonify({"message": "Account deleted"})
@@ -1535,322 +4051,1152 @@ def get_notifications():
         conn.close()
         return jsonify({"items": [], "disabled": True})
 
+    # Rows are written per recipient with blocklists already applied, so the
+    # feed is a single range read on (user_id, created_at).
     cursor.execute(
         """
-        SELECT
-            m.id,
-            u.username,
-            m.body,
-            m.created_at
-        FROM messages m
-        JOIN users u ON u.id = m.sender_id
-        WHERE m.receiver_id = ?
-        AND m.sender_id NOT IN (
-            SELECT blocked_user_id FROM blocked_users WHERE user_id = ?
-        )
-        AND m.sender_id NOT IN (
-            SELECT user_id FROM blocked_users WHERE blocked_user_id = ?
-        )
-        ORDER BY m.created_at DESC, m.id DESC
-        LIMIT 12
+        SELECT n.kind, u.username, n.preview, n.created_at
+        FROM notifications n
+        JOIN users u ON u.id = n.actor_id
+        WHERE n.user_id = ?
+        ORDER BY n.created_at DESC, n.id DESC
+        LIMIT 20
         """,
-        (user_id, user_id, user_id)
+        (user_id,)
     )
-    message_rows = cursor.fetchall()
-
+    rows = cursor.fetchall()
     cursor.execute(
         """
-        SELECT
-            p.id,
-            u.username,
-            p.caption,
-            p.created_at
-        FROM posts p
-        JOIN users u ON u.id = p.user_id
-        WHERE p.user_id != ?
-        AND p.status = 'published'
-        AND p.user_id NOT IN (
-            SELECT blocked_user_id FROM blocked_users WHERE user_id = ?
-        )
-        AND p.user_id NOT IN (
-            SELECT user_id FROM blocked_users WHERE blocked_user_id = ?
-        )
-        ORDER BY p.created_at DESC, p.id DESC
-        LIMIT 12
+        INSERT INTO user_counters (user_id, seen_notification_id)
+        VALUES (?, COALESCE((SELECT MAX(id) FROM notifications WHERE user_id = ?), 0))
+        ON CONFLICT(user_id) DO UPDATE SET
+            seen_notification_id=excluded.seen_notification_id
         """,
-        (user_id, user_id, user_id)
+        (user_id, user_id)
     )
-    post_rows = cursor.fetchall()
-
+    conn.commit()
     conn.close()
 
     items = []
-    for row in message_rows:
-        preview = (row[2] or "").strip()
+    for kind, username, preview, created_at in rows:
+        preview = (preview or "").strip()
         if len(preview) > 70:
             preview = preview[:67] + "..."
-        items.append({
-            "kind": "message",
-            "created_at": row[3],
-            "title": f"{row[1]} sent you a message",
-            "description": preview or "Tap Inbox to view message."
-        })
-
-    for row in post_rows:
-        caption = (row[2] or "").strip()
-        if len(caption) > 70:
-            caption = caption[:67] + "..."
-        items.append({
-            "kind": "post",
-            "created_at": row[3],
-            "title": f"{row[1]} published a new post",
-            "description": caption or "Open Explore to check this creator."
-        })
-
-    items.sort(key=lambda item: item["created_at"] or "", reverse=True)
-    items = items[:20]
+        if kind == "message":
+            items.append({
+                "kind": "message",
+                "created_at": created_at,
+                "title": f"{username} sent you a message",
+                "description": preview or "Tap Inbox to view message."
+            })
+        else:
+            items.append({
+                "kind": "post",
+                "created_at": created_at,
+                "title": f"{username} published a new post",
+                "description": preview or "Open Explore to check this creator."
+            })
 
     return jsonify({"items": items, "disabled": False})
 
 
-@app.route("/api/ai/chat", methods=["POST"])
-def ai_chat():
+@app.route("/api/notifications/count")
+def notification_count():
     if "user_id" not in session:
         return jsonify({"error": "Unauthorized"}), 401
 
-    data = request.json or {}
+    user_id = session["user_id"]
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        SELECT
+            COALESCE(c.unread_messages, 0),
+            COALESCE(c.seen_notification_id, 0),
+            COALESCE(s.inapp_notifications, 1)
+        FROM (SELECT ? AS id) me
+        LEFT JOIN user_counters c ON c.user_id = me.id
+        LEFT JOIN settings s ON s.user_id = me.id
+        """,
+        (user_id,)
+    )
+    unread_messages, seen_id, inapp_enabled = cursor.fetchone()
+    disabled = int(inapp_enabled) == 0
+    unseen = 0
+    if not disabled:
+        # Feeds are capped, so this walks at most NOTIFICATIONS_PER_USER entries.
+        cursor.execute(
+            "SELECT COUNT(*) FROM notifications WHERE user_id=? AND id > ?",
+            (user_id, seen_id)
+        )
+        unseen = cursor.fetchone()[0]
+    conn.close()
+
+    etag = f"{user_id}-{unread_messages}-{seen_id}-{unseen}-{int(disabled)}"
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify({
+            "unread_messages": unread_messages,
+            "unseen_notifications": unseen,
+            "disabled": disabled
+        })
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+
+GOOGLE_AI_TEMPERATURE = float((os.environ.get("GOOGLE_AI_TEMPERATURE") or "0.7").strip())
+# Replies sampled hotter than this are meant to vary, so they skip the cache.
+AI_CACHE_MAX_TEMPERATURE = float((os.environ.get("AI_CACHE_MAX_TEMPERATURE") or "0.7").strip())
+AI_CACHE_TTL_SECONDS = 3600
+AI_CACHE_MAX_BYTES = 8 * 1024 * 1024
+AI_CACHE_DIR = (os.environ.get("AI_CACHE_DIR") or "").strip()
+
+
+class AIResponseCache:
+    """LRU+TTL cache of finished chat replies keyed by the exact upstream request.
+
+    The key hashes the model name and the generateContent body (system
+    instruction, trimmed history, message, generation config).  Memory is
+    capped in bytes; with ``directory`` set, entries are also written there
+    as one JSON file each so other workers and restarts can reuse them.
+    """
+
+    def __init__(self, max_bytes, ttl, directory=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.directory = directory or None
+        self._entries = OrderedDict()  # key -> (expires, size, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0, "bypassed": 0}
+
+    @staticmethod
+    def key(model, payload):
+        return hashlib.sha256(model.encode("utf-8") + b"\0" + payload).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def _count(self, stat):
+        with self._lock:
+            self._stats[stat] += 1
+
+    def bypass(self):
+        self._count("bypassed")
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return entry[2]
+                del self._entries[key]
+                self._bytes -= entry[1]
+
+        if self.directory:
+            path = self._path(key)
+            try:
+                with open(path, "r", encoding="utf-8") as cached:
+                    stored = json.load(cached)
+            except (OSError, ValueError):
+                stored = None
+            if stored and stored.get("expires", 0) > now:
+                self._remember(key, stored["expires"], stored["value"])
+                self._count("disk_hits")
+                return stored["value"]
+            if stored:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+        self._count("misses")
+        return None
+
+    def put(self, key, value):
+        expires = time.time() + self.ttl
+        self._remember(key, expires, value)
+        self._count("stores")
+        if not self.directory:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as cached:
+                json.dump({"expires": expires, "value": value}, cached)
+            os.replace(temp_path, path)
+        except OSError:
+            app.logger.warning("Could not write AI cache entry to %s", path, exc_info=True)
+
+    def _remember(self, key, expires, value):
+        size = len(json.dumps(value))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._entries[key] = (expires, size, value)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self._stats["evictions"] += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["disk_hits"] + self._stats["misses"]
+            hit_rate = (self._stats["hits"] + self._stats["disk_hits"]) / lookups if lookups else 0.0
+            return dict(
+                self._stats,
+                entries=len(self._entries),
+                bytes=self._bytes,
+                hit_rate=round(hit_rate, 3),
+                disk=bool(self.directory)
+            )
+
+
+ai_response_cache = AIResponseCache(AI_CACHE_MAX_BYTES, AI_CACHE_TTL_SECONDS, AI_CACHE_DIR)
+
+
+AI_MAX_CONCURRENT = int((os.environ.get("AI_MAX_CONCURRENT") or "4").strip())
+AI_MAX_QUEUED = 8
+AI_QUEUE_WAIT_SECONDS = 5
+AI_BUSY_RETRY_SECONDS = 5
+# A dead worker's slot is reclaimed after this; longer than any stream.
+AI_SLOT_LEASE_SECONDS = 300
+# Queued callers are woken at once by a release in their own process and
+# look for releases in other workers this often.
+AI_QUEUE_RECHECK_SECONDS = 0.25
+# 0 turns the per-user limit off.
+AI_USER_RATE_PER_MINUTE = float((os.environ.get("AI_USER_RATE_PER_MINUTE") or "6").strip())
+AI_USER_BURST = 3
+# Slots and token buckets are shared by every worker through their own small
+# database, so admission never waits on users.db's write lock.
+AI_ADMISSION_DB_PATH = (
+    os.environ.get("AI_ADMISSION_DB_PATH") or f"{os.path.splitext(DATABASE_PATH)[0]}-admission.db"
+).strip()
+
+
+class AIAdmission:
+    """Admission control for outbound AI calls.
+
+    At most ``max_concurrent`` calls run at once across every worker (leased
+    rows in ai_inflight) and each user spends one token per call from a
+    bucket refilled at ``rate_per_minute`` (0 disables the bucket).  Both
+    live in a separate SQLite file, so admission's short write transactions
+    never hold users.db's lock.  A caller that finds all slots busy waits in
+    this process's bounded queue for up to ``queue_wait`` seconds: a release
+    in this process wakes it at once, releases in other workers are seen
+    within AI_QUEUE_RECHECK_SECONDS.  Everything else is turned away at once
+    with a retry hint.
+    """
+
+    def __init__(self, max_concurrent, max_queued, queue_wait, rate_per_minute, burst, db_path):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.queue_wait = queue_wait
+        self.rate = max(0.0, rate_per_minute) / 60.0
+        self.burst = burst
+        self._db = ConnectionPool(db_path, 4)
+        self._db_ready = False
+        self._queued = 0
+        self._releases = 0
+        self._cond = threading.Condition()
+        self._async_waiters = set()
+        self._counts = {"admitted": 0, "rejected_rate": 0, "rejected_busy": 0}
+
+    def _admission_db(self):
+        conn = self._db.acquire()
+        if not self._db_ready:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS ai_inflight (
+                    token TEXT PRIMARY KEY,
+                    user_id INTEGER NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+                ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS ai_rate_buckets (
+                    user_id INTEGER PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                ''')
+            conn.commit()
+            self._db_ready = True
+        return conn
+
+    def _try_acquire(self, user_id, token, spend_token):
+        """Returns (None, None) when admitted, else ("rate", wait) or ("busy", None)."""
+        conn = self._admission_db()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            tokens = None
+            if spend_token and self.rate:
+                row = conn.execute(
+                    "SELECT tokens, updated_at FROM ai_rate_buckets WHERE user_id=?", (user_id,)
+                ).fetchone()
+                tokens = self.burst if row is None else min(self.burst, row[0] + (now - row[1]) * self.rate)
+                if tokens < 1:
+                    return "rate", (1 - tokens) / self.rate
+
+            conn.execute("DELETE FROM ai_inflight WHERE expires_at <= ?", (now,))
+            inflight = conn.execute("SELECT COUNT(*) FROM ai_inflight").fetchone()[0]
+            if inflight >= self.max_concurrent:
+                return "busy", None
+
+            conn.execute(
+                "INSERT INTO ai_inflight (token, user_id, expires_at) VALUES (?, ?, ?)",
+                (token, user_id, now + AI_SLOT_LEASE_SECONDS)
+            )
+            if tokens is not None:
+                conn.execute(
+                    """
+                    INSERT INTO ai_rate_buckets (user_id, tokens, updated_at) VALUES (?, ?, ?)
+                    ON CONFLICT(user_id) DO UPDATE SET
+                        tokens=excluded.tokens, updated_at=excluded.updated_at
+                    """,
+                    (user_id, tokens - 1, now)
+                )
+            conn.commit()
+            return None, None
+        finally:
+            self._db.release(conn)
+
+    def forget(self, user_id):
+        conn = self._admission_db()
+        try:
+            conn.execute("DELETE FROM ai_rate_buckets WHERE user_id=?", (user_id,))
+            conn.commit()
+        finally:
+            self._db.release(conn)
+
+    def _release_count(self):
+        with self._cond:
+            return self._releases
+
+    def _enqueue(self):
+        with self._cond:
+            if self._queued >= self.max_queued:
+                return False
+            self._queued += 1
+            return True
+
+    def _dequeue(self):
+        with self._cond:
+            self._queued -= 1
+
+    def acquire(self, user_id, spend_token=True):
+        """Returns (release, None) when admitted, or (None, retry_after_seconds).
+
+        Work the user did not ask for directly (conversation summaries)
+        passes ``spend_token=False`` and only competes for a slot.
+        """
+        token = secrets.token_hex(8)
+        seen = self._release_count()
+        reason, wait = self._try_acquire(user_id, token, spend_token)
+        if reason == "busy" and self._enqueue():
+            try:
+                deadline = time.monotonic() + self.queue_wait
+                while reason == "busy" and time.monotonic() < deadline:
+                    with self._cond:
+                        if self._releases == seen:
+                            self._cond.wait(
+                                min(AI_QUEUE_RECHECK_SECONDS, max(0.0, deadline - time.monotonic()))
+                            )
+                        seen = self._releases
+                    reason, wait = self._try_acquire(user_id, token, spend_token)
+            finally:
+                self._dequeue()
+        return self._admit(token, reason, wait)
+
+    async def acquire_async(self, user_id, spend_token=True):
+        """``acquire()`` for coroutines; queued callers await the next release.
+
+        Each attempt is a short write transaction on the admission database,
+        so it runs off the event loop.
+        """
+        token = secrets.token_hex(8)
+        seen = self._release_count()
+        reason, wait = await asyncio.to_thread(self._try_acquire, user_id, token, spend_token)
+        if reason == "busy" and self._enqueue():
+            loop = asyncio.get_running_loop()
+            try:
+                deadline = loop.time() + self.queue_wait
+                while reason == "busy" and loop.time() < deadline:
+                    woken = loop.create_future()
+                    with self._cond:
+                        if self._releases == seen:
+                            self._async_waiters.add(woken)
+                        else:
+                            woken.set_result(None)
+                        seen = self._releases
+                    try:
+                        await asyncio.wait(
+                            (woken,), timeout=min(AI_QUEUE_RECHECK_SECONDS, max(0.0, deadline - loop.time()))
+                        )
+                    finally:
+                        with self._cond:
+                            self._async_waiters.discard(woken)
+                    reason, wait = await asyncio.to_thread(self._try_acquire, user_id, token, spend_token)
+            finally:
+                self._dequeue()
+        return self._admit(token, reason, wait)
+
+    @staticmethod
+    def _wake(future):
+        if not future.done():
+            future.set_result(None)
+
+    def _release(self, token):
+        conn = self._admission_db()
+        try:
+            conn.execute("DELETE FROM ai_inflight WHERE token=?", (token,))
+            conn.commit()
+        finally:
+            self._db.release(conn)
+        with self._cond:
+            self._releases += 1
+            self._cond.notify_all()
+            woken = list(self._async_waiters)
+        for future in woken:
+            try:
+                future.get_loop().call_soon_threadsafe(self._wake, future)
+            except RuntimeError:
+                pass  # that loop has closed
+
+    def _admit(self, token, reason, wait):
+        with self._cond:
+            if reason == "rate":
+                self._counts["rejected_rate"] += 1
+                return None, wait
+            if reason == "busy":
+                self._counts["rejected_busy"] += 1
+                return None, AI_BUSY_RETRY_SECONDS
+            self._counts["admitted"] += 1
+        released = []
+
+        def release():
+            if released:
+                return
+            released.append(True)
+            self._release(token)
+
+        return release, None
+
+    def gauges(self):
+        conn = self._admission_db()
+        try:
+            inflight = conn.execute(
+                "SELECT COUNT(*) FROM ai_inflight WHERE expires_at > ?", (time.time(),)
+            ).fetchone()[0]
+        finally:
+            self._db.release(conn)
+        with self._cond:
+            return dict(
+                self._counts,
+                in_flight=inflight,
+                queued=self._queued,
+                max_concurrent=self.max_concurrent
+            )
+
+
+ai_admission = AIAdmission(
+    AI_MAX_CONCURRENT, AI_MAX_QUEUED, AI_QUEUE_WAIT_SECONDS, AI_USER_RATE_PER_MINUTE, AI_USER_BURST,
+    AI_ADMISSION_DB_PATH
+)
+
+
+def _ai_rejected(retry_after):
+    seconds = max(1, int(retry_after + 0.999))
+    response = jsonify({
+        "error": "AI assistant is busy. Please try again shortly.",
+        "retry_after": seconds
+    })
+    response.headers["Retry-After"] = str(seconds)
+    return response, 429
+
+
+def _parse_google_error(error_body):
+    if not error_body:
+        return None, None, None
+    try:
+        payload = json.loads(error_body)
+    except Exception:
+        return None, None, None
+    error_obj = payload.get("error") or {}
+    message = error_obj.get("message")
+    status = error_obj.get("status")
+    retry_after = None
+    for detail in error_obj.get("details") or []:
+        if detail.get("@type") == "type.googleapis.com/google.rpc.RetryInfo":
+            retry_after = detail.get("retryDelay")
+            break
+    return message, status, retry_after
+
+
+AI_SYSTEM_INSTRUCTION = (
+    "Give complete, clear answers. "
+    "Use multiple sentences and include useful detail when appropriate."
+)
+# History sent upstream is trimmed to this many (estimated) tokens; older
+# turns are folded into the conversation's rolling summary.
+AI_HISTORY_TOKEN_BUDGET = 1500
+AI_SUMMARY_MIN_TOKENS = 400
+AI_SUMMARY_MAX_CHARS = 2000
+AI_CONVERSATION_PAGE = 50
+
+
+def _estimate_tokens(text):
+    # Roughly four characters per token for English text.
+    return len(text) // 4 + 1
+
+
+def _ai_history(cursor, conversation_id, summarized_through):
+    """Turns after the summary that fit the token budget, oldest first.
+
+    Returns (turns, overflow_tokens, overflow_through) where the overflow is
+    everything older than the kept window that the summary doesn't cover yet.
+    """
+    cursor.execute(
+        """
+        SELECT id, role, content, tokens FROM ai_messages
+        WHERE conversation_id=? AND id > ?
+        ORDER BY id DESC
+        """,
+        (conversation_id, summarized_through)
+    )
+    kept = []
+    used = 0
+    overflow_tokens = 0
+    overflow_through = 0
+    for message_id, role, content, tokens in cursor.fetchall():
+        if not overflow_through and used + tokens <= AI_HISTORY_TOKEN_BUDGET:
+            kept.append((message_id, role, content, tokens))
+            used += tokens
+            continue
+        overflow_through = max(overflow_through, message_id)
+        overflow_tokens += tokens
+    # Keep user/model turns paired: the window must open on a user turn.
+    while kept and kept[-1][1] != "user":
+        message_id, _, _, tokens = kept.pop()
+        overflow_through = max(overflow_through, message_id)
+        overflow_tokens += tokens
+    kept.reverse()
+    return [(role, content) for _, role, content, _ in kept], overflow_tokens, overflow_through
+
+
+def _ai_contents(turns, message):
+    contents = [
+        {"role": "model" if role == "assistant" else "user", "parts": [{"text": content}]}
+        for role, content in turns
+    ]
+    contents.append({"role": "user", "parts": [{"text": message}]})
+    return contents
+
+
+def _ai_max_output_tokens():
+    max_output_tokens_raw = (os.environ.get("GOOGLE_AI_MAX_OUTPUT_TOKENS") or "").strip()
+    try:
+        max_output_tokens = int(max_output_tokens_raw) if max_output_tokens_raw else 1536
+    except ValueError:
+        max_output_tokens = 1536
+    return max(256, min(max_output_tokens, 4096))
+
+
+def _prepare_ai_chat(data, user_id):
+    """Validate a chat request; returns (error_response, None) or (None, request).
+
+    History comes from the stored conversation named by ``conversation_id``,
+    not from the client.  Without one the request's ``conversation_id`` is
+    None until ``_record_ai_turn`` saves the first turn, so a failed or
+    rejected call leaves nothing behind.
+    """
     message = (data.get("message") or "").strip()
-    history = data.get("history") or []
 
     if not message:
-        return jsonify({"error": "Message is required"}), 400
+        return (jsonify({"error": "Message is required"}), 400), None
 
     api_key = (os.environ.get("GOOGLE_API_KEY") or "").strip()
     if not api_key:
-        return jsonify({
+        return (jsonify({
             "error": "Google AI key missing. Set GOOGLE_API_KEY in environment."
-        }), 500
+        }), 500), None
 
     model = (os.environ.get("GOOGLE_AI_MODEL") or "gemini-2.0-flash").strip()
     if model.startswith("models/"):
         model = model.split("/", 1)[1]
 
-    def parse_google_error(error_body):
-        if not error_body:
-            return None, None, None
+    conn = get_db()
+    cursor = conn.cursor()
+    conversation_id = data.get("conversation_id")
+    if conversation_id:
         try:
-            payload = json.loads(error_body)
-        except Exception:
-            return None, None, None
-        error_obj = payload.get("error") or {}
-        message = error_obj.get("message")
-        status = error_obj.get("status")
-        retry_after = None
-        for detail in error_obj.get("details") or []:
-            if detail.get("@type") == "type.googleapis.com/google.rpc.RetryInfo":
-                retry_after = detail.get("retryDelay")
-                break
-        return message, status, retry_after
-
-    def list_supported_models():
-        list_url = (
-            "https://generativelanguage.googleapis.com/v1beta/models"
-            f"?key={urllib.parse.quote(api_key)}"
-        )
-        list_req = urllib.request.Request(
-            list_url,
-            headers={"Content-Type": "application/json"},
-            method="GET"
+            conversation_id = int(conversation_id)
+        except (TypeError, ValueError):
+            conversation_id = 0
+        cursor.execute(
+            "SELECT summary, summarized_through FROM ai_conversations WHERE id=? AND user_id=?",
+            (conversation_id, user_id)
         )
-        with urllib.request.urlopen(list_req, timeout=20) as response:
-            payload = json.loads(response.read().decode("utf-8"))
-        models = payload.get("models") or []
-        return [
-            (m.get("name") or "").split("/", 1)[-1]
-            for m in models
-            if "generateContent" in (m.get("supportedGenerationMethods") or [])
-        ]
-
-    contents = []
-    for item in history[-10:]:
-        role = "model" if str(item.get("role")) == "assistant" else "user"
-        text = str(item.get("content") or "").strip()
-        if text:
-            contents.append({
-                "role": role,
-                "parts": [{"text": text}]
-            })
-    contents.append({
-        "role": "user",
-        "parts": [{"text": message}]
-    })
+        row = cursor.fetchone()
+        if row is None:
+            conn.close()
+            return (jsonify({"error": "Conversation not found"}), 404), None
+        summary, summarized_through = row
+        turns, overflow_tokens, _ = _ai_history(cursor, conversation_id, summarized_through)
+    else:
+        conversation_id = None
+        summary, turns, overflow_tokens = "", [], 0
+    conn.close()
 
-    max_output_tokens_raw = (os.environ.get("GOOGLE_AI_MAX_OUTPUT_TOKENS") or "").strip()
-    try:
-        max_output_tokens = int(max_output_tokens_raw) if max_output_tokens_raw else 1536
-    except ValueError:
-        max_output_tokens = 1536
-    max_output_tokens = max(256, min(max_output_tokens, 4096))
+    system_text = AI_SYSTEM_INSTRUCTION
+    if summary:
+        system_text += "\n\nSummary of the earlier conversation:\n" + summary
 
     payload = json.dumps({
         "systemInstruction": {
-            "parts": [{
-                "text": (
-                    "Give complete, clear answers. "
-                    "Use multiple sentences and include useful detail when appropriate."
-                )
-            }]
+            "parts": [{"text": system_text}]
         },
-        "contents": contents,
+        "contents": _ai_contents(turns, message),
         "generationConfig": {
-            "temperature": 0.7,
-            "maxOutputTokens": max_output_tokens
+            "temperature": GOOGLE_AI_TEMPERATURE,
+            "maxOutputTokens": _ai_max_output_tokens()
         }
     }).encode("utf-8")
 
-    preferred_fallbacks = [
-        "gemini-2.0-flash",
-        "gemini-2.0-flash-lite",
-        "gemini-1.5-flash",
-        "gemini-1.5-pro"
-    ]
+    cache_key = None
+    if GOOGLE_AI_TEMPERATURE <= AI_CACHE_MAX_TEMPERATURE:
+        cache_key = AIResponseCache.key(model, payload)
+    return None, {
+        "api_key": api_key,
+        "model": model,
+        "payload": payload,
+        "cache_key": cache_key,
+        "user_id": user_id,
+        "conversation_id": conversation_id,
+        "message": message,
+        "needs_summary": overflow_tokens >= AI_SUMMARY_MIN_TOKENS
+    }
 
-    model_candidates = [model]
-    for candidate in preferred_fallbacks:
-        if candidate not in model_candidates:
-            model_candidates.append(candidate)
-
-    result = None
-    used_model = None
-    last_error = None
-    available_models = []
-    quota_exceeded = False
-    retry_after_delay = None
-
-    for candidate_model in model_candidates:
-        url = (
-            "https://generativelanguage.googleapis.com/v1beta/models/"
-            f"{urllib.parse.quote(candidate_model)}:generateContent?key={urllib.parse.quote(api_key)}"
-        )
-        req = urllib.request.Request(
-            url,
-            data=payload,
-            headers={"Content-Type": "application/json"},
-            method="POST"
-        )
 
-        try:
-            with urllib.request.urlopen(req, timeout=25) as response:
-                raw = response.read().decode("utf-8")
-            result = json.loads(raw)
-            used_model = candidate_model
-            break
-        except urllib.error.HTTPError as err:
-            error_body = ""
-            try:
-                error_body = err.read().decode("utf-8")
-            except Exception:
-                error_body = ""
-            google_message, google_status, google_retry_after = parse_google_error(error_body)
-            if err.code == 404:
-                last_error = error_body or str(err)
-                continue
-            if err.code == 429 or google_status == "RESOURCE_EXHAUSTED":
-                quota_exceeded = True
-                retry_after_delay = google_retry_after or retry_after_delay
-                last_error = google_message or error_body or str(err)
-                continue
-            return jsonify({
-                "error": "Google AI request failed",
-                "details": error_body or str(err)
-            }), 502
-        except urllib.error.URLError as err:
-            return jsonify({
-                "error": "Google AI is unreachable",
-                "details": str(err)
-            }), 502
-        except Exception as err:
-            return jsonify({
-                "error": "Could not process AI response",
-                "details": str(err)
-            }), 500
+_ai_summaries_running = set()
+_ai_summaries_lock = threading.Lock()
 
-    if result is None:
-        try:
-            available_models = list_supported_models()
-        except Exception:
-            available_models = []
 
-    if result is None and available_models:
-        for listed_model in available_models:
-            if listed_model in model_candidates:
-                continue
-            url = (
-                "https://generativelanguage.googleapis.com/v1beta/models/"
-                f"{urllib.parse.quote(listed_model)}:generateContent?key={urllib.parse.quote(api_key)}"
+def _record_ai_turn(chat, reply):
+    """Append the user message and reply; fold old turns into the summary when due.
+
+    Starts the conversation on its first turn and stores the new id in ``chat``.
+    """
+    conn = get_db()
+    cursor = conn.cursor()
+    if chat["conversation_id"] is None:
+        cursor.execute("INSERT INTO ai_conversations (user_id) VALUES (?)", (chat["user_id"],))
+        chat["conversation_id"] = cursor.lastrowid
+    cursor.executemany(
+        "INSERT INTO ai_messages (conversation_id, role, content, tokens) VALUES (?, ?, ?, ?)",
+        [
+            (chat["conversation_id"], "user", chat["message"], _estimate_tokens(chat["message"])),
+            (chat["conversation_id"], "assistant", reply, _estimate_tokens(reply))
+        ]
+    )
+    cursor.execute(
+        "UPDATE ai_conversations SET updated_at=CURRENT_TIMESTAMP WHERE id=?",
+        (chat["conversation_id"],)
+    )
+    conn.commit()
+    conn.close()
+
+    if not chat["needs_summary"]:
+        return
+    with _ai_summaries_lock:
+        if chat["conversation_id"] in _ai_summaries_running:
+            return
+        _ai_summaries_running.add(chat["conversation_id"])
+    threading.Thread(
+        target=_summarize_ai_conversation,
+        args=(chat["conversation_id"], chat["user_id"], chat["api_key"], chat["model"]),
+        name="ai-summary",
+        daemon=True
+    ).start()
+
+
+def _summarize_ai_conversation(conversation_id, user_id, api_key, model):
+    """Fold turns that fell out of the history budget into the rolling summary.
+
+    Uses a short generateContent call that waits for an admission slot like
+    any chat (without spending the user's tokens); if admission turns it
+    away the summary is left for a later turn.  If the call fails the
+    oldest user turns are kept as clipped notes instead so the summary
+    still advances.
+    """
+    try:
+        with app.app_context():
+            conn = get_db()
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT summary, summarized_through FROM ai_conversations WHERE id=?",
+                (conversation_id,)
             )
-            req = urllib.request.Request(
-                url,
-                data=payload,
-                headers={"Content-Type": "application/json"},
-                method="POST"
+            row = cursor.fetchone()
+            if row is None:
+                return
+            summary, summarized_through = row
+            _, overflow_tokens, overflow_through = _ai_history(cursor, conversation_id, summarized_through)
+            if overflow_tokens < AI_SUMMARY_MIN_TOKENS:
+                return
+            cursor.execute(
+                """
+                SELECT role, content FROM ai_messages
+                WHERE conversation_id=? AND id > ? AND id <= ?
+                ORDER BY id
+                """,
+                (conversation_id, summarized_through, overflow_through)
+            )
+            turns = cursor.fetchall()
+            conn.close()
+            release_request_db()
+
+            transcript = "\n".join(f"{role}: {content}" for role, content in turns)
+            prompt = (
+                "Update the running summary of a conversation between a user and an assistant. "
+                "Keep facts, preferences and open questions; stay under 200 words.\n\n"
+                f"Current summary:\n{summary or '(none)'}\n\nNew turns:\n{transcript}"
             )
+            payload = json.dumps({
+                "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+                "generationConfig": {"temperature": 0.2, "maxOutputTokens": 320}
+            }).encode("utf-8")
+            release, _ = ai_admission.acquire(user_id, spend_token=False)
+            if release is None:
+                return
             try:
-                with urllib.request.urlopen(req, timeout=25) as response:
-                    raw = response.read().decode("utf-8")
-                result = json.loads(raw)
-                used_model = listed_model
-                break
-            except urllib.error.HTTPError as err:
-                if err.code == 429:
-                    quota_exceeded = True
-                    try:
-                        body = err.read().decode("utf-8")
-                    except Exception:
-                        body = ""
-                    google_message, _, google_retry_after = parse_google_error(body)
-                    retry_after_delay = google_retry_after or retry_after_delay
-                    last_error = google_message or body or str(err)
-                    continue
-                last_error = str(err)
-                continue
-            except Exception as err:
-                last_error = str(err)
-                continue
+                error, _, result = _call_gemini(api_key, model, payload)
+            finally:
+                release()
+            new_summary = None if error else (_candidate_text(result) or "").strip()
+            if not new_summary:
+                notes = [content[:160] for role, content in turns if role == "user"]
+                new_summary = "\n".join(filter(None, [summary] + [f"- {note}" for note in notes]))
+            new_summary = new_summary[-AI_SUMMARY_MAX_CHARS:]
+
+            conn = get_db()
+            conn.execute(
+                """
+                UPDATE ai_conversations SET summary=?, summarized_through=?
+                WHERE id=? AND summarized_through=?
+                """,
+                (new_summary, overflow_through, conversation_id, summarized_through)
+            )
+            conn.commit()
+            conn.close()
+    except Exception:
+        app.logger.exception("AI conversation summary failed")
+    finally:
+        with _ai_summaries_lock:
+            _ai_summaries_running.discard(conversation_id)
+
+
+def _cached_ai_reply(chat):
+    if chat["cache_key"] is None:
+        ai_response_cache.bypass()
+        return None
+    return ai_response_cache.get(chat["cache_key"])
+
+
+def _store_ai_reply(chat, reply, model):
+    if chat["cache_key"] is not None:
+        ai_response_cache.put(chat["cache_key"], {"reply": reply, "model": model})
+
+
+AI_PREFERRED_FALLBACKS = [
+    "gemini-2.0-flash",
+    "gemini-2.0-flash-lite",
+    "gemini-1.5-flash",
+    "gemini-1.5-pro"
+]
+
+
+class GeminiAttempts:
+    """The model fallback walk for one Gemini call, without the I/O.
+
+    ``next_model()`` hands out models in registry order, at most
+    AI_MAX_MODEL_ATTEMPTS of them.  Once the configured and preferred names
+    run out it returns None and ``wants_models`` turns true: the caller
+    fetches the supported-model list (blocking or async) and passes it to
+    ``add_models()``.  ``failed()`` files each error and returns the response
+    to give up with, or None to move on; ``exhausted()`` is the final answer.
+    """
+
+    def __init__(self, model):
+        self._queue = deque(ai_models.candidates([model] + AI_PREFERRED_FALLBACKS))
+        self.tried = []
+        self.listed = False
+        self.last_error = None
+        self.quota_exceeded = False
+        self.retry_after_delay = None
+
+    def next_model(self):
+        while self._queue and len(self.tried) < AI_MAX_MODEL_ATTEMPTS:
+            model = self._queue.popleft()
+            if model not in self.tried:
+                self.tried.append(model)
+                return model
+        return None
+
+    @property
+    def wants_models(self):
+        # Only consult the model list once the known names are exhausted.
+        return not self.listed and len(self.tried) < AI_MAX_MODEL_ATTEMPTS
+
+    def add_models(self, models):
+        self.listed = True
+        self._queue.extend(ai_models.candidates(models))
+
+    def failed(self, model, err):
+        if isinstance(err, http_client.HTTPError):
+            error_body = err.body.decode("utf-8", "replace")
+            google_message, google_status, google_retry_after = _parse_google_error(error_body)
+            if err.code == 404:
+                ai_models.record_not_found(model)
+                self.last_error = error_body or str(err)
+                return None
+            if err.code == 429 or google_status == "RESOURCE_EXHAUSTED":
+                ai_models.record_quota(model, _parse_retry_delay(google_retry_after))
+                self.quota_exceeded = True
+                self.retry_after_delay = google_retry_after or self.retry_after_delay
+                self.last_error = google_message or error_body or str(err)
+                return None
+            ai_models.record_error(model)
+            return jsonify({
+                "error": "Google AI request failed",
+                "details": error_body or str(err)
+            }), 502
+        if isinstance(err, http_client.TransportError):
+            ai_models.record_error(model)
+            return jsonify({
+                "error": "Google AI is unreachable",
+                "details": str(err)
+            }), 502
+        return jsonify({
+            "error": "Could not process AI response",
+            "details": str(err)
+        }), 500
 
-    if result is None and quota_exceeded:
-        response = jsonify({
-            "error": "Google AI quota exceeded",
-            "details": (
-                (last_error or "Quota exhausted for the configured API key/project.")
-                + " Check API key project, billing plan, and Gemini rate limits."
-            ),
-            "retry_after": retry_after_delay or ""
-        })
-        if retry_after_delay:
-            response.headers["Retry-After"] = retry_after_delay.rstrip("s")
-        return response, 429
+    def exhausted(self, available_models):
+        quota_exceeded = self.quota_exceeded
+        retry_after_delay = self.retry_after_delay
+        if not quota_exceeded:
+            parked_for = ai_models.quota_retry_after()
+            if parked_for is not None:
+                # Every usable model is still inside its RetryInfo window.
+                quota_exceeded = True
+                retry_after_delay = f"{int(parked_for) + 1}s"
+
+        if quota_exceeded:
+            response = jsonify({
+                "error": "Google AI quota exceeded",
+                "details": (
+                    (self.last_error or "Quota exhausted for the configured API key/project.")
+                    + " Check API key project, billing plan, and Gemini rate limits."
+                ),
+                "retry_after": retry_after_delay or ""
+            })
+            retry_seconds = _parse_retry_delay(retry_after_delay)
+            if retry_seconds is not None:
+                response.headers["Retry-After"] = str(int(retry_seconds + 0.999))
+            return response, 429
 
-    if result is None:
         available_preview = ", ".join(available_models[:8]) if available_models else "none"
         return jsonify({
             "error": "Google AI request failed",
             "details": (
-                (last_error or "No working model found")
+                (self.last_error or "No working model found")
                 + f" | Available generateContent models: {available_preview}"
             )
         }), 502
 
+
+def _gemini_url(api_key, model, method):
+    return (
+        f"{GOOGLE_AI_BASE_URL}/models/"
+        f"{urllib.parse.quote(model)}:{method}?key={urllib.parse.quote(api_key)}"
+    )
+
+
+def _call_gemini(api_key, model, payload, stream=False):
+    """Try models in registry order; returns (error_response, None, None) or (None, model, upstream).
+
+    ``upstream`` is the parsed generateContent reply, or with ``stream`` an
+    open http_client.StreamResponse of streamGenerateContent SSE chunks.
+    """
+    attempts = GeminiAttempts(model)
+    while True:
+        candidate_model = attempts.next_model()
+        if candidate_model is None and attempts.wants_models:
+            attempts.add_models(ai_models.supported_models(api_key))
+            candidate_model = attempts.next_model()
+        if candidate_model is None:
+            break
+        try:
+            if stream:
+                upstream = http_client.stream(
+                    "POST",
+                    _gemini_url(api_key, candidate_model, "streamGenerateContent") + "&alt=sse",
+                    headers={"Content-Type": "application/json"},
+                    body=payload,
+                    timeout=25
+                )
+            else:
+                upstream = http_client.request(
+                    "POST",
+                    _gemini_url(api_key, candidate_model, "generateContent"),
+                    headers={"Content-Type": "application/json"},
+                    body=payload,
+                    timeout=25
+                ).json()
+        except Exception as err:
+            error = attempts.failed(candidate_model, err)
+            if error is not None:
+                return error, None, None
+            continue
+        ai_models.record_success(candidate_model)
+        return None, candidate_model, upstream
+    return attempts.exhausted(ai_models.supported_models(api_key)), None, None
+
+
+async def _call_gemini_async(api_key, model, payload):
+    """``_call_gemini()`` (non-streaming) on the event loop."""
+    attempts = GeminiAttempts(model)
+    while True:
+        candidate_model = attempts.next_model()
+        if candidate_model is None and attempts.wants_models:
+            attempts.add_models(await ai_models.supported_models_async(api_key))
+            candidate_model = attempts.next_model()
+        if candidate_model is None:
+            break
+        try:
+            upstream = (await http_client.arequest(
+                "POST",
+                _gemini_url(api_key, candidate_model, "generateContent"),
+                headers={"Content-Type": "application/json"},
+                body=payload,
+                timeout=25
+            )).json()
+        except Exception as err:
+            error = attempts.failed(candidate_model, err)
+            if error is not None:
+                return error, None, None
+            continue
+        ai_models.record_success(candidate_model)
+        return None, candidate_model, upstream
+    return attempts.exhausted(await ai_models.supported_models_async(api_key)), None, None
+
+
+def _candidate_text(result):
     candidates = result.get("candidates") or []
     if not candidates:
+        return None
+    parts = ((candidates[0].get("content") or {}).get("parts") or [])
+    return "".join(str(part.get("text") or "") for part in parts)
+
+
+@app.route("/api/ai/chat", methods=["POST"])
+async def ai_chat():
+    """Answer one chat message; Gemini and the admission queue are awaited.
+
+    Everything that touches SQLite or the reply cache on disk runs through
+    ``asyncio.to_thread`` so a busy database never stalls the event loop.
+    """
+    if "user_id" not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+
+    error, chat = await asyncio.to_thread(_prepare_ai_chat, request.json or {}, session["user_id"])
+    if error:
+        return error
+
+    cached = await asyncio.to_thread(_cached_ai_reply, chat)
+    if cached is not None:
+        await asyncio.to_thread(_record_ai_turn, chat, cached["reply"])
+        return jsonify(dict(cached, conversation_id=chat["conversation_id"]))
+
+    release, retry_after = await ai_admission.acquire_async(session["user_id"])
+    if release is None:
+        return _ai_rejected(retry_after)
+    release_request_db()
+    try:
+        error, used_model, result = await _call_gemini_async(chat["api_key"], chat["model"], chat["payload"])
+    finally:
+        await asyncio.to_thread(release)
+    if error:
+        return error
+    return await asyncio.to_thread(_ai_chat_reply, chat, used_model, result)
+
+
+def _ai_chat_reply(chat, used_model, result):
+    reply = _candidate_text(result)
+    if reply is None:
         return jsonify({"error": "No response from Google AI"}), 502
 
-    parts = ((candidates[0].get("content") or {}).get("parts") or [])
-    reply = "".join(str(part.get("text") or "") for part in parts).strip()
+    reply = reply.strip()
     if not reply:
         reply = "I could not generate a response right now."
+    else:
+        _store_ai_reply(chat, reply, used_model or chat["model"])
+        _record_ai_turn(chat, reply)
+
+    return jsonify({
+        "reply": reply,
+        "model": used_model or chat["model"],
+        "conversation_id": chat["conversation_id"]
+    })
+
+
+@app.route("/api/ai/chat/stream", methods=["POST"])
+def ai_chat_stream():
+    """Same request as /api/ai/chat, answered as server-sent events.
+
+    Emits ``model`` once, a ``delta`` per upstream chunk and then ``done``
+    with the full reply (or ``error``).  Both ``model`` and ``done`` carry
+    the conversation id; for a new conversation it is null on ``model`` and
+    only set once ``done`` has saved the first turn.  If the browser goes away the
+    generator is closed, which drops the upstream connection.
+    """
+    if "user_id" not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+
+    error, chat = _prepare_ai_chat(request.json or {}, session["user_id"])
+    if error:
+        return error
+
+    cached = _cached_ai_reply(chat)
+    if cached is not None:
+        _record_ai_turn(chat, cached["reply"])
+        conversation_id = chat["conversation_id"]
+        return Response(
+            [
+                _format_sse(0, "model", {"model": cached["model"], "conversation_id": conversation_id}),
+                _format_sse(1, "delta", {"text": cached["reply"]}),
+                _format_sse(2, "done", dict(cached, conversation_id=conversation_id))
+            ],
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache"}
+        )
+
+    release, retry_after = ai_admission.acquire(session["user_id"])
+    if release is None:
+        return _ai_rejected(retry_after)
+    try:
+        error, used_model, upstream = _call_gemini(
+            chat["api_key"], chat["model"], chat["payload"], stream=True
+        )
+    except Exception:
+        release()
+        raise
+    if error:
+        release()
+        return error
+
+    def generate():
+        event_id = 0
+        parts = []
+        try:
+            yield _format_sse(event_id, "model", {
+                "model": used_model,
+                "conversation_id": chat["conversation_id"]
+            })
+            for data in upstream.iter_sse_data():
+                try:
+                    text = _candidate_text(json.loads(data))
+                except ValueError:
+                    continue
+                if text:
+                    event_id += 1
+                    parts.append(text)
+                    yield _format_sse(event_id, "delta", {"text": text})
+            reply = "".join(parts).strip()
+            if reply:
+                _store_ai_reply(chat, reply, used_model)
+                _record_ai_turn(chat, reply)
+            else:
+                reply = "I could not generate a response right now."
+            yield _format_sse(event_id + 1, "done", {
+                "reply": reply,
+                "model": used_model,
+                "conversation_id": chat["conversation_id"]
+            })
+        except http_client.TransportError as err:
+            yield _format_sse(event_id + 1, "error", {
+                "error": "Google AI stream interrupted",
+                "details": str(err)
+            })
+        finally:
+            upstream.close()
+
+    response = Response(
+        generate(),
+        mimetype="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
+    # Runs even if the client left before the generator was first resumed.
+    response.call_on_close(upstream.close)
+    response.call_on_close(release)
+    return response
+
+
+@app.route("/api/ai/conversations/<int:conversation_id>")
+def ai_conversation(conversation_id):
+    if "user_id" not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT summary FROM ai_conversations WHERE id=? AND user_id=?",
+        (conversation_id, session["user_id"])
+    )
+    row = cursor.fetchone()
+    if row is None:
+        conn.close()
+        return jsonify({"error": "Conversation not found"}), 404
+    cursor.execute(
+        """
+        SELECT role, content FROM ai_messages
+        WHERE conversation_id=?
+        ORDER BY id DESC
+        LIMIT ?
+        """,
+        (conversation_id, AI_CONVERSATION_PAGE)
+    )
+    messages = [{"role": role, "content": content} for role, content in reversed(cursor.fetchall())]
+    conn.close()
+    return jsonify({"id": conversation_id, "summary": row[0], "messages": messages})
+
+
+def _encode_directory_cursor(username, user_id):
+    raw = json.dumps([username, user_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
 
-    return jsonify({"reply": reply, "model": used_model or model})
+
+def _decode_directory_cursor(value):
+    try:
+        raw = base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+        username, user_id = json.loads(raw.decode("utf-8"))
+        return str(username), int(user_id)
+    except (ValueError, TypeError):
+        return None
 
 
 @app.route("/api/inbox/users")
@@ -1858,30 +5204,66 @@ def inbox_users():
     if "user_id" not in session:
         return jsonify({"error": "Unauthorized"}), 401
 
+    prefix = (request.args.get("q") or "").strip()
+    try:
+        limit = int(request.args.get("limit") or USER_DIRECTORY_PAGE_SIZE)
+    except ValueError:
+        return jsonify({"error": "Invalid limit"}), 400
+    limit = max(1, min(limit, USER_DIRECTORY_PAGE_MAX))
+
+    after = None
+    if request.args.get("cursor"):
+        after = _decode_directory_cursor(request.args["cursor"])
+        if after is None:
+            return jsonify({"error": "Invalid cursor"}), 400
+
+    hidden_filter, hidden_params = _exclude_ids("id", blocklist.hidden_ids(session["user_id"]))
+    # Both the prefix and the cursor are ranges on the NOCASE username
+    # index, so each page is a bounded index walk.
+    prefix_filter = ""
+    prefix_params = ()
+    if prefix:
+        prefix_filter = (
+            "AND username COLLATE NOCASE >= ? "
+            "AND username COLLATE NOCASE < ?"
+        )
+        prefix_params = (prefix, prefix + "\U0010ffff")
+    cursor_filter = ""
+    cursor_params = ()
+    if after:
+        cursor_filter = "AND (username COLLATE NOCASE, id) > (?, ?)"
+        cursor_params = after
+
     conn = get_db()
     cursor = conn.cursor()
     cursor.execute(
-        """
+        f"""
         SELECT id, username
         FROM users
         WHERE id != ?
-        AND id NOT IN (
-            SELECT blocked_user_id FROM blocked_users WHERE user_id = ?
-        )
-        AND id NOT IN (
-            SELECT user_id FROM blocked_users WHERE blocked_user_id = ?
-        )
-        ORDER BY username COLLATE NOCASE ASC
+        {hidden_filter}
+        {prefix_filter}
+        {cursor_filter}
+        ORDER BY username COLLATE NOCASE ASC, id ASC
+        LIMIT ?
         """,
-        (session["user_id"], session["user_id"], session["user_id"])
+        (session["user_id"],) + hidden_params + prefix_params + cursor_params + (limit + 1,)
     )
     rows = cursor.fetchall()
     conn.close()
 
-    return jsonify([
-        {"id": row[0], "username": row[1]}
-        for row in rows
-    ])
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_directory_cursor(rows[-1][1], rows[-1][0])
+
+    return jsonify({
+        "users": [
+            {"id": row[0], "username": row[1]}
+            for row in rows
+        ],
+        "next_cursor": next_cursor
+    })
 
 
 @app.route("/api/inbox/conversations")
@@ -1889,59 +5271,24 @@ def inbox_conversations():
     if "user_id" not in session:
         return jsonify({"error": "Unauthorized"}), 401
 
+    hidden_filter, hidden_params = _exclude_ids("c.peer_id", blocklist.hidden_ids(session["user_id"]))
     conn = get_db()
     cursor = conn.cursor()
     cursor.execute(
-        """
+        f"""
         SELECT
             u.id,
             u.username,
-            m.body,
-            m.created_at,
-            (
-                SELECT COUNT(*)
-                FROM messages m3
-                WHERE m3.sender_id = u.id
-                  AND m3.receiver_id = ?
-                  AND m3.is_read = 0
-            ) AS unread_count
-        FROM users u
-        JOIN messages m
-            ON (
-                (m.sender_id = u.id AND m.receiver_id = ?)
-                OR
-                (m.receiver_id = u.id AND m.sender_id = ?)
-            )
-        WHERE u.id != ?
-        AND u.id NOT IN (
-            SELECT blocked_user_id FROM blocked_users WHERE user_id = ?
-        )
-        AND u.id NOT IN (
-            SELECT user_id FROM blocked_users WHERE blocked_user_id = ?
-        )
-        AND m.id = (
-            SELECT m2.id
-            FROM messages m2
-            WHERE (
-                (m2.sender_id = u.id AND m2.receiver_id = ?)
-                OR
-                (m2.receiver_id = u.id AND m2.sender_id = ?)
-            )
-            ORDER BY m2.created_at DESC, m2.id DESC
-            LIMIT 1
-        )
-        ORDER BY m.created_at DESC, m.id DESC
+            c.last_text,
+            c.last_time,
+            c.unread_count
+        FROM conversations c
+        JOIN users u ON u.id = c.peer_id
+        WHERE c.user_id = ?
+        {hidden_filter}
+        ORDER BY c.last_time DESC, c.last_message_id DESC
         """,
-        (
-            session["user_id"],
-            session["user_id"],
-            session["user_id"],
-            session["user_id"],
-            session["user_id"],
-            session["user_id"],
-            session["user_id"],
-            session["user_id"]
-        )
+        (session["user_id"],) + hidden_params
     )
     rows = cursor.fetchall()
     conn.close()
@@ -1966,6 +5313,16 @@ def get_chat_messages(other_user_id):
     if other_user_id == session["user_id"]:
         return jsonify({"error": "Invalid user"}), 400
 
+    try:
+        before_id = int(request.args["before_id"]) if request.args.get("before_id") else None
+        after_id = int(request.args["after_id"]) if request.args.get("after_id") else None
+        limit = int(request.args.get("limit") or CHAT_PAGE_SIZE)
+    except ValueError:
+        return jsonify({"error": "Invalid pagination parameters"}), 400
+    if before_id is not None and after_id is not None:
+        return jsonify({"error": "Use either before_id or after_id"}), 400
+    limit = max(1, min(limit, CHAT_PAGE_MAX))
+
     conn = get_db()
     cursor = conn.cursor()
     cursor.execute(
@@ -1977,20 +5334,7 @@ def get_chat_messages(other_user_id):
         conn.close()
         return jsonify({"error": "User not found"}), 404
 
-    cursor.execute(
-        """
-        SELECT 1
-        FROM blocked_users
-        WHERE
-            (user_id=? AND blocked_user_id=?)
-            OR
-            (user_id=? AND blocked_user_id=?)
-        LIMIT 1
-        """,
-        (session["user_id"], other_user_id, other_user_id, session["user_id"])
-    )
-    blocked = cursor.fetchone()
-    if blocked:
+    if blocklist.is_blocked(session["user_id"], other_user_id):
         conn.close()
         return jsonify({"error": "Chat unavailable"}), 403
 
@@ -2004,24 +5348,88 @@ def get_chat_messages(other_user_id):
         """,
         (other_user_id, session["user_id"])
     )
+    marked_read = cursor.rowcount
+    _adjust_unread_messages(cursor, session["user_id"], -marked_read)
+    cursor.execute(
+        "UPDATE conversations SET unread_count=0 WHERE user_id=? AND peer_id=? AND unread_count != 0",
+        (session["user_id"], other_user_id)
+    )
 
+    cursor_id = before_id if before_id is not None else after_id
+    cursor_key = None
+    if cursor_id is not None:
+        cursor.execute(
+            """
+            SELECT created_at, id
+            FROM messages
+            WHERE id = ?
+            AND (
+                (sender_id=? AND receiver_id=?)
+                OR
+                (sender_id=? AND receiver_id=?)
+            )
+            """,
+            (cursor_id, session["user_id"], other_user_id, other_user_id, session["user_id"])
+        )
+        cursor_key = cursor.fetchone()
+        if not cursor_key:
+            conn.commit()
+            conn.close()
+            return jsonify({"error": "Invalid cursor"}), 400
+
+    # One ordered range scan per direction of the thread, merged and cut to
+    # the page size; (created_at, id) is the keyset so ties stay stable.
+    if after_id is not None:
+        key_filter = "AND (created_at, id) > (?, ?)"
+        order = "ASC"
+    elif before_id is not None:
+        key_filter = "AND (created_at, id) < (?, ?)"
+        order = "DESC"
+    else:
+        key_filter = ""
+        order = "DESC"
+    key_params = tuple(cursor_key) if cursor_key else ()
     cursor.execute(
-        """
-        SELECT id, sender_id, receiver_id, body, created_at
-        FROM messages
-        WHERE
-            (sender_id=? AND receiver_id=?)
-            OR
-            (sender_id=? AND receiver_id=?)
-        ORDER BY created_at ASC, id ASC
+        f"""
+        SELECT id, sender_id, receiver_id, body, created_at FROM (
+            SELECT id, sender_id, receiver_id, body, created_at
+            FROM messages
+            WHERE sender_id=? AND receiver_id=? {key_filter}
+            ORDER BY created_at {order}, id {order}
+            LIMIT ?
+        )
+        UNION ALL
+        SELECT id, sender_id, receiver_id, body, created_at FROM (
+            SELECT id, sender_id, receiver_id, body, created_at
+            FROM messages
+            WHERE sender_id=? AND receiver_id=? {key_filter}
+            ORDER BY created_at {order}, id {order}
+            LIMIT ?
+        )
+        ORDER BY created_at {order}, id {order}
+        LIMIT ?
         """,
-        (session["user_id"], other_user_id, other_user_id, session["user_id"])
+        (
+            (session["user_id"], other_user_id) + key_params + (limit + 1,)
+            + (other_user_id, session["user_id"]) + key_params + (limit + 1,)
+            + (limit + 1,)
+        )
     )
     rows = cursor.fetchall()
     conn.commit()
     conn.close()
 
-    return jsonify([
+    if marked_read > 0:
+        receipt = {"reader_id": session["user_id"], "peer_id": other_user_id}
+        inbox_events.publish(other_user_id, "read-receipt", receipt)
+        inbox_events.publish(session["user_id"], "read-receipt", receipt)
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if order == "DESC":
+        rows.reverse()
+
+    messages = [
         {
             "id": row[0],
             "sender_id": row[1],
@@ -2030,7 +5438,17 @@ def get_chat_messages(other_user_id):
             "created_at": row[4]
         }
         for row in rows
-    ])
+    ]
+
+    # before_id pages further back in history; after_id is what a refresh
+    # sends to fetch only what arrived since.  has_more refers to the
+    # direction that was requested.
+    return jsonify({
+        "messages": messages,
+        "has_more": has_more,
+        "before_id": messages[0]["id"] if messages and has_more and after_id is None else None,
+        "after_id": messages[-1]["id"] if messages else after_id
+    })
 
 
 @app.route("/api/inbox/chats/<int:other_user_id>/messages", methods=["POST"])
@@ -2060,20 +5478,7 @@ def send_chat_message(other_user_id):
         conn.close()
         return jsonify({"error": "User not found"}), 404
 
-    cursor.execute(
-        """
-        SELECT 1
-        FROM blocked_users
-        WHERE
-            (user_id=? AND blocked_user_id=?)
-            OR
-            (user_id=? AND blocked_user_id=?)
-        LIMIT 1
-        """,
-        (session["user_id"], other_user_id, other_user_id, session["user_id"])
-    )
-    blocked = cursor.fetchone()
-    if blocked:
+    if blocklist.is_blocked(session["user_id"], other_user_id):
         conn.close()
         return jsonify({"error": "Chat unavailable"}), 403
 
@@ -2095,19 +5500,28 @@ def send_chat_message(other_user_id):
         (message_id,)
     )
     created_at = cursor.fetchone()[0]
+    _record_conversation_message(
+        cursor, session["user_id"], other_user_id, message_id, body, created_at
+    )
+    _notify_message(cursor, other_user_id, session["user_id"], message_id, body, created_at)
+    _adjust_unread_messages(cursor, other_user_id, 1)
 
     conn.commit()
     conn.close()
 
+    message_data = {
+        "id": message_id,
+        "sender_id": session["user_id"],
+        "receiver_id": other_user_id,
+        "body": body,
+        "created_at": created_at
+    }
+    inbox_events.publish(other_user_id, "new-message", message_data)
+    inbox_events.publish(session["user_id"], "new-message", message_data)
+
     return jsonify({
         "message": "Sent",
-        "data": {
-            "id": message_id,
-            "sender_id": session["user_id"],
-            "receiver_id": other_user_id,
-            "body": body,
-            "created_at": created_at
-        }
+        "data": message_data
     })
 
 
@@ -2131,12 +5545,70 @@ def delete_chat(other_user_id):
         """,
         (session["user_id"], other_user_id, other_user_id, session["user_id"])
     )
+    _delete_conversation(cursor, session["user_id"], other_user_id)
+    _delete_pair_notifications(cursor, session["user_id"], other_user_id, "message")
     conn.commit()
     conn.close()
 
+    deleted = {"user_id": session["user_id"], "peer_id": other_user_id}
+    inbox_events.publish(other_user_id, "chat-deleted", deleted)
+    inbox_events.publish(session["user_id"], "chat-deleted", deleted)
+
     return jsonify({"message": "Chat deleted"})
 
 
+@app.route("/api/inbox/stream")
+def inbox_stream():
+    if "user_id" not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+
+    user_id = session["user_id"]
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+
+    subscriber, replay, resync = inbox_events.subscribe(user_id, last_event_id)
+    if subscriber is None:
+        response = jsonify({
+            "error": "Live updates are busy; polling instead.",
+            "retry_after": INBOX_STREAM_BUSY_RETRY_SECONDS
+        })
+        response.headers["Retry-After"] = str(INBOX_STREAM_BUSY_RETRY_SECONDS)
+        return response, 503
+
+    def stream():
+        try:
+            yield "retry: 3000\n\n"
+            if resync:
+                yield "event: resync\ndata: {}\n\n"
+            for item in replay:
+                yield _format_sse(*item)
+
+            # Streams are recycled periodically; EventSource reconnects
+            # with Last-Event-ID and the backlog fills the gap.
+            deadline = time.monotonic() + INBOX_STREAM_MAX_SECONDS
+            while not subscriber.closed and time.monotonic() < deadline:
+                try:
+                    item = subscriber.get(timeout=INBOX_STREAM_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ": heartbeat\n\n"
+                    continue
+                yield _format_sse(*item)
+        finally:
+            inbox_events.unsubscribe(user_id, subscriber)
+
+    return Response(
+        stream(),
+        mimetype="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+
 @app.route('/post')
 def post():
     if 'user_id' not in session:
@@ -2173,35 +5645,15 @@ def trends():
 
 
 @app.route("/api/trends/creators")
-def trends_creators():
+async def trends_creators():
     if "user_id" not in session:
         return jsonify({"error": "Unauthorized"}), 401
 
-    global trend_cache_data, trend_cache_time
-
-    now = time.time()
-    if trend_cache_data and (now - trend_cache_time) < TREND_CACHE_SECONDS:
-        return jsonify({
-            "source": "cache",
-            "creators": trend_cache_data
-        })
-
-    try:
-        creators = fetch_trending_creators()
-        trend_cache_data = creators
-        trend_cache_time = now
-        return jsonify({
-            "source": "github",
-            "creators": creators
-        })
-    except Exception:
-        fallback = get_fallback_creators()
-        trend_cache_data = fallback
-        trend_cache_time = now
-        return jsonify({
-            "source": "fallback",
-            "creators": fallback
-        })
+    source, creators = await trend_cache.get()
+    return jsonify({
+        "source": source,
+        "creators": creators
+    })
 
 
 @app.route('/live')
@@ -2216,51 +5668,26 @@ def live_summary():
     if "user_id" not in session:
         return jsonify({"error": "Unauthorized"}), 401
 
+    active_since = live_presence.started_at(session["user_id"])
+
     conn = get_db()
     cursor = conn.cursor()
-
-    cursor.execute(
-        """
-        SELECT EXISTS(
-            SELECT 1
-            FROM live_sessions
-            WHERE user_id=? AND ended_at IS NULL
-        )
-        """,
-        (session["user_id"],)
-    )
-    currently_live = bool(cursor.fetchone()[0])
-
-    cursor.execute(
-        """
-        SELECT COALESCE(
-            SUM((julianday(COALESCE(ended_at, CURRENT_TIMESTAMP)) - julianday(started_at)) * 24),
-            0
-        )
-        FROM live_sessions
-        WHERE user_id=?
-        """,
-        (session["user_id"],)
-    )
-    total_hours = float(cursor.fetchone()[0] or 0)
-
     cursor.execute(
-        """
-        SELECT started_at
-        FROM live_sessions
-        WHERE user_id=? AND ended_at IS NULL
-        ORDER BY started_at DESC
-        LIMIT 1
-        """,
+        "SELECT streamed_seconds FROM live_totals WHERE user_id=?",
         (session["user_id"],)
     )
-    active_session = cursor.fetchone()
+    row = cursor.fetchone()
     conn.close()
 
+    total_seconds = float(row[0]) if row else 0.0
+    if active_since:
+        elapsed = datetime.now(timezone.utc) - _parse_db_timestamp(active_since)
+        total_seconds += max(0.0, elapsed.total_seconds())
+
     return jsonify({
-        "currently_live": currently_live,
-        "total_hours": round(total_hours, 2),
-        "active_since": active_session[0] if active_session else None
+        "currently_live": active_since is not None,
+        "total_hours": round(total_seconds / 3600, 2),
+        "active_since": active_since
     })
 
 
@@ -2269,37 +5696,35 @@ def live_creators():
     if "user_id" not in session:
         return jsonify({"error": "Unauthorized"}), 401
 
+    hidden = blocklist.hidden_ids(session["user_id"])
+    live_now = {
+        user_id: started_at
+        for user_id, started_at in live_presence.snapshot().items()
+        if user_id != session["user_id"] and user_id not in hidden
+    }
+    if not live_now:
+        return jsonify([])
+
+    placeholders = ", ".join("?" for _ in live_now)
     conn = get_db()
     cursor = conn.cursor()
     cursor.execute(
-        """
-        SELECT u.id, u.username, ls.started_at
-        FROM live_sessions ls
-        JOIN users u ON u.id = ls.user_id
-        WHERE ls.ended_at IS NULL
-          AND u.id != ?
-          AND u.is_active = 1
-          AND u.id NOT IN (
-              SELECT blocked_user_id FROM blocked_users WHERE user_id = ?
-          )
-          AND u.id NOT IN (
-              SELECT user_id FROM blocked_users WHERE blocked_user_id = ?
-          )
-        ORDER BY ls.started_at DESC
-        """,
-        (session["user_id"], session["user_id"], session["user_id"])
+        f"SELECT id, username FROM users WHERE is_active = 1 AND id IN ({placeholders})",
+        tuple(live_now)
     )
     rows = cursor.fetchall()
     conn.close()
 
-    return jsonify([
+    creators = [
         {
             "id": row[0],
             "username": row[1],
-            "started_at": row[2]
+            "started_at": live_now[row[0]]
         }
         for row in rows
-    ])
+    ]
+    creators.sort(key=lambda creator: creator["started_at"], reverse=True)
+    return jsonify(creators)
 
 
 @app.route("/api/live/toggle", methods=["POST"])
@@ -2307,6 +5732,7 @@ def toggle_live():
     if "user_id" not in session:
         return jsonify({"error": "Unauthorized"}), 401
 
+    user_id = session["user_id"]
     conn = get_db()
     cursor = conn.cursor()
     cursor.execute(
@@ -2314,28 +5740,51 @@ def toggle_live():
         SELECT id
         FROM live_sessions
         WHERE user_id=? AND ended_at IS NULL
-        ORDER BY started_at DESC
-        LIMIT 1
         """,
-        (session["user_id"],)
+        (user_id,)
     )
-    active = cursor.fetchone()
+    active_ids = [row[0] for row in cursor.fetchall()]
 
-    if active:
+    if active_ids:
+        placeholders = ", ".join("?" for _ in active_ids)
+        cursor.execute(
+            f"UPDATE live_sessions SET ended_at=CURRENT_TIMESTAMP WHERE id IN ({placeholders})",
+            tuple(active_ids)
+        )
+        # Fold the finished session into the running total so summaries
+        # never have to re-read historical sessions.
         cursor.execute(
-            "UPDATE live_sessions SET ended_at=CURRENT_TIMESTAMP WHERE id=?",
-            (active[0],)
+            f"""
+            INSERT INTO live_totals (user_id, streamed_seconds)
+            SELECT ?, SUM((julianday(ended_at) - julianday(started_at)) * 86400)
+            FROM live_sessions
+            WHERE id IN ({placeholders})
+            ON CONFLICT(user_id) DO UPDATE SET
+                streamed_seconds=live_totals.streamed_seconds + excluded.streamed_seconds
+            """,
+            (user_id,) + tuple(active_ids)
         )
         status = "stopped"
+        started_at = None
     else:
         cursor.execute(
             "INSERT INTO live_sessions (user_id) VALUES (?)",
-            (session["user_id"],)
+            (user_id,)
         )
+        cursor.execute(
+            "SELECT started_at FROM live_sessions WHERE id=?",
+            (cursor.lastrowid,)
+        )
+        started_at = cursor.fetchone()[0]
         status = "started"
 
     conn.commit()
     conn.close()
+
+    if started_at:
+        live_presence.start(user_id, started_at)
+    else:
+        live_presence.stop(user_id)
     return jsonify({"message": status})
 
 
@@ -0,0 +1,15 @@
+"""gunicorn settings, read automatically by ``gunicorn app:app`` run from this directory.
+
+Each open inbox stream (/api/inbox/stream) holds a thread until it is
+recycled, so workers are threaded: a sync worker would be pinned by a
+single browser tab.  Inbox events only reach streams in the process that
+published them (app.EventHub), so a host runs one worker unless
+WEB_CONCURRENCY says otherwise, and app.INBOX_STREAM_MAX_SUBSCRIBERS keeps
+streams to a fraction of ``threads``.
+"""
+import os
+
+
+worker_class = "gthread"
+workers = int((os.environ.get("WEB_CONCURRENCY") or "1").strip())
+threads = int((os.environ.get("GUNICORN_THREADS") or "64").strip())
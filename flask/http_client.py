@@ -0,0 +1,548 @@
+"""Pooled outbound HTTP client shared by every call the app makes upstream.
+
+Idle keep-alive connections are kept per (scheme, host, port), DNS answers
+are cached, connect and read timeouts are separate, gzip bodies are
+decoded and each host's latency is recorded.  Blocking calls are built on
+http.client; ``arequest`` is httpx.AsyncClient under the same interface.
+
+    resp = http_client.request("GET", url, timeout=8)
+    resp.json()
+
+    with http_client.stream("POST", url, body=payload) as resp:
+        for data in resp.iter_sse_data():
+            ...
+
+    resp = await http_client.arequest("GET", url, timeout=8)
+
+Statuses >= 400 raise HTTPError; network failures raise TransportError.
+"""
+import asyncio
+import gzip
+import http.client
+import json
+import os
+import select
+import socket
+import ssl
+import threading
+import time
+import urllib.parse
+import zlib
+from collections import deque
+
+import httpx
+
+
+CONNECT_TIMEOUT_SECONDS = float((os.environ.get("HTTP_CONNECT_TIMEOUT_SECONDS") or "5").strip())
+READ_TIMEOUT_SECONDS = float((os.environ.get("HTTP_READ_TIMEOUT_SECONDS") or "25").strip())
+MAX_IDLE_PER_HOST = 8
+# Most servers drop idle keep-alive connections after about a minute.
+IDLE_SECONDS = 50
+DNS_TTL_SECONDS = 300
+MAX_REDIRECTS = 5
+LATENCY_SAMPLES = 256
+USER_AGENT = "SocialSync-App"
+
+# A reused connection that the server already closed fails with one of
+# these before any response arrives; the request is retried once on a new one.
+_STALE_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+
+
+class HTTPError(Exception):
+    def __init__(self, url, code, headers, body):
+        super().__init__(f"HTTP {code} from {url}")
+        self.url = url
+        self.code = code
+        self.headers = headers
+        self.body = body
+
+
+class TransportError(Exception):
+    """DNS, connect, TLS or read failure (including timeouts)."""
+
+
+class Response:
+    def __init__(self, url, status, headers, body):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    @property
+    def text(self):
+        return self.body.decode("utf-8")
+
+    def json(self):
+        return json.loads(self.body.decode("utf-8"))
+
+
+class StreamResponse:
+    """An open response whose body is read incrementally.
+
+    ``close()`` hands the connection back to the pool once the body has been
+    read to the end; closing early drops the socket, which is how a caller
+    cancels the upstream request.
+    """
+
+    def __init__(self, client, key, conn, resp, url):
+        self.url = url
+        self.status = resp.status
+        self.headers = resp.headers
+        self._client = client
+        self._key = key
+        self._conn = conn
+        self._resp = resp
+
+    def iter_lines(self):
+        try:
+            while True:
+                line = self._resp.readline()
+                if not line:
+                    return
+                yield line.decode("utf-8").rstrip("\r\n")
+        except (OSError, http.client.HTTPException) as err:
+            raise TransportError(str(err) or err.__class__.__name__) from err
+
+    def iter_sse_data(self):
+        """Yield the ``data`` payload of each server-sent event."""
+        data = []
+        for line in self.iter_lines():
+            if not line:
+                if data:
+                    yield "\n".join(data)
+                    data = []
+            elif line.startswith("data:"):
+                data.append(line[5:].lstrip(" "))
+        if data:
+            yield "\n".join(data)
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        if self._resp.isclosed() and not self._resp.will_close:
+            self._client._release(self._key, conn)
+        else:
+            conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _Connection(http.client.HTTPConnection):
+    """HTTPConnection whose socket is opened through the client's DNS cache."""
+
+    def __init__(self, host, port, timeout, open_socket):
+        super().__init__(host, port, timeout=timeout)
+        self.open_socket = open_socket
+
+    def connect(self):
+        self.sock = self.open_socket((self.host, self.port), self.timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+class _TLSConnection(_Connection):
+    default_port = http.client.HTTPS_PORT
+
+    def __init__(self, host, port, timeout, open_socket, ssl_context):
+        super().__init__(host, port, timeout, open_socket)
+        self.ssl_context = ssl_context
+
+    def connect(self):
+        super().connect()
+        self.sock = self.ssl_context.wrap_socket(self.sock, server_hostname=self.host)
+
+
+def _is_dropped(sock):
+    # An idle keep-alive socket should have nothing to read; readable means
+    # the server sent EOF (or garbage) and the connection is unusable.
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+    except (OSError, ValueError):
+        return True
+    return bool(readable)
+
+
+def _decode_body(headers, body):
+    encoding = (headers.get("Content-Encoding") or "").strip().lower()
+    if encoding == "gzip":
+        return gzip.decompress(body)
+    if encoding == "deflate":
+        try:
+            return zlib.decompress(body)
+        except zlib.error:
+            return zlib.decompress(body, -zlib.MAX_WBITS)
+    return body
+
+
+class HostStats:
+    """Per-host counters; updated from every thread making requests."""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.connections_opened = 0
+        self.connections_reused = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.recent_ms = deque(maxlen=LATENCY_SAMPLES)
+        self._lock = threading.Lock()
+
+    def connection(self, reused):
+        with self._lock:
+            if reused:
+                self.connections_reused += 1
+            else:
+                self.connections_opened += 1
+
+    def finished(self, elapsed_ms=None):
+        """Count one request; ``elapsed_ms`` None means it failed."""
+        with self._lock:
+            self.requests += 1
+            if elapsed_ms is None:
+                self.errors += 1
+                return
+            self.total_ms += elapsed_ms
+            self.max_ms = max(self.max_ms, elapsed_ms)
+            self.recent_ms.append(elapsed_ms)
+
+    def error(self):
+        with self._lock:
+            self.errors += 1
+
+    def snapshot(self):
+        with self._lock:
+            recent = sorted(self.recent_ms)
+            requests, errors = self.requests, self.errors
+            opened, reused = self.connections_opened, self.connections_reused
+            total_ms, max_ms = self.total_ms, self.max_ms
+
+        def percentile(p):
+            if not recent:
+                return 0.0
+            return round(recent[min(len(recent) - 1, int(p * len(recent)))], 1)
+
+        return {
+            "requests": requests,
+            "errors": errors,
+            "connections_opened": opened,
+            "connections_reused": reused,
+            "avg_ms": round(total_ms / requests, 1) if requests else 0.0,
+            "p50_ms": percentile(0.50),
+            "p95_ms": percentile(0.95),
+            "max_ms": round(max_ms, 1)
+        }
+
+
+class HTTPClient:
+    def __init__(self, connect_timeout=CONNECT_TIMEOUT_SECONDS, read_timeout=READ_TIMEOUT_SECONDS,
+                 max_idle_per_host=MAX_IDLE_PER_HOST, idle_seconds=IDLE_SECONDS,
+                 dns_ttl=DNS_TTL_SECONDS):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_idle_per_host = max_idle_per_host
+        self.idle_seconds = idle_seconds
+        self.dns_ttl = dns_ttl
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._idle = {}   # (scheme, host, port) -> [(last_used, connection)]
+        self._async = {}  # event loop -> httpx.AsyncClient
+        self._ssl_context = None
+        self._dns = {}    # (host, port) -> (expires, addrinfo list)
+        self._stats = {}  # host -> HostStats
+
+    # --- DNS ---
+
+    def _resolve(self, host, port):
+        now = time.monotonic()
+        with self._lock:
+            cached = self._dns.get((host, port))
+        if cached and cached[0] > now:
+            return cached[1]
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        with self._lock:
+            self._dns[(host, port)] = (now + self.dns_ttl, infos)
+        return infos
+
+    def _open_socket(self, address, timeout, source_address=None):
+        host, port = address
+        last_error = None
+        for family, socktype, proto, _, sockaddr in self._resolve(host, port):
+            sock = socket.socket(family, socktype, proto)
+            try:
+                sock.settimeout(timeout)
+                if source_address:
+                    sock.bind(source_address)
+                sock.connect(sockaddr)
+                return sock
+            except OSError as err:
+                sock.close()
+                last_error = err
+        # The cached answer may be what's stale; resolve again next time.
+        with self._lock:
+            self._dns.pop((host, port), None)
+        raise last_error or OSError(f"could not connect to {host}:{port}")
+
+    # --- connection pool ---
+
+    def _check_pid(self):
+        # After a fork the idle sockets belong to the parent; forget them.
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._idle = {}
+            self._async = {}
+            self._stats = {}
+
+    def _acquire(self, key):
+        now = time.monotonic()
+        with self._lock:
+            self._check_pid()
+            idle = self._idle.get(key) or []
+            while idle:
+                last_used, conn = idle.pop()
+                if (now - last_used < self.idle_seconds and conn.sock is not None
+                        and not _is_dropped(conn.sock)):
+                    return conn, True
+                conn.close()
+        scheme, host, port = key
+        if scheme == "https":
+            return _TLSConnection(host, port, self.connect_timeout, self._open_socket, self._tls()), False
+        return _Connection(host, port, self.connect_timeout, self._open_socket), False
+
+    def _tls(self):
+        with self._lock:
+            if self._ssl_context is None:
+                self._ssl_context = ssl.create_default_context()
+            return self._ssl_context
+
+    def _release(self, key, conn):
+        with self._lock:
+            self._check_pid()
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append((time.monotonic(), conn))
+                return
+        conn.close()
+
+    def _host_stats(self, host):
+        with self._lock:
+            self._check_pid()
+            stats = self._stats.get(host)
+            if stats is None:
+                stats = self._stats[host] = HostStats()
+            return stats
+
+    def stats(self):
+        with self._lock:
+            self._check_pid()
+            idle = {}
+            for (_, host, _), conns in self._idle.items():
+                idle[host] = idle.get(host, 0) + len(conns)
+            return {
+                host: dict(stats.snapshot(), idle_connections=idle.get(host, 0))
+                for host, stats in self._stats.items()
+            }
+
+    # --- requests ---
+
+    def _open(self, key, method, target, body, headers, read_timeout, stats):
+        """Send the request and read the status line and headers."""
+        for attempt in (0, 1):
+            conn, reused = self._acquire(key)
+            try:
+                if conn.sock is None:
+                    conn.connect()
+                stats.connection(reused)
+                conn.sock.settimeout(read_timeout)
+                conn.request(method, target, body=body, headers=headers)
+                return conn, conn.getresponse()
+            except _STALE_ERRORS as err:
+                conn.close()
+                if reused and attempt == 0:
+                    continue
+                raise TransportError(str(err)) from err
+            except (OSError, http.client.HTTPException) as err:
+                conn.close()
+                raise TransportError(str(err) or err.__class__.__name__) from err
+
+    def _send(self, key, method, target, body, headers, read_timeout, stats):
+        conn, resp = self._open(key, method, target, body, headers, read_timeout, stats)
+        try:
+            data = resp.read()
+        except (OSError, http.client.HTTPException) as err:
+            conn.close()
+            raise TransportError(str(err) or err.__class__.__name__) from err
+        if resp.will_close:
+            conn.close()
+        else:
+            self._release(key, conn)
+        return resp, data
+
+    def _target(self, url):
+        parts = urllib.parse.urlsplit(url)
+        scheme = parts.scheme.lower()
+        if scheme not in ("http", "https") or not parts.hostname:
+            raise TransportError(f"unsupported URL: {url}")
+        port = parts.port or (443 if scheme == "https" else 80)
+        target = parts.path or "/"
+        if parts.query:
+            target += "?" + parts.query
+        return (scheme, parts.hostname, port), target
+
+    @staticmethod
+    def _timed(stats, started, failed=False):
+        stats.finished(None if failed else (time.perf_counter() - started) * 1000)
+
+    @staticmethod
+    def _prepare(headers, body, accept_encoding):
+        request_headers = {"User-Agent": USER_AGENT, "Accept-Encoding": accept_encoding}
+        request_headers.update(headers or {})
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        return request_headers, body
+
+    def request(self, method, url, headers=None, body=None, timeout=None):
+        """Send a request and return a Response with the decoded body.
+
+        ``timeout`` is the read timeout for this call; connecting uses the
+        client's connect timeout.  GET/HEAD redirects are followed.
+        """
+        read_timeout = self.read_timeout if timeout is None else timeout
+        request_headers, body = self._prepare(headers, body, "gzip")
+
+        for _ in range(MAX_REDIRECTS + 1):
+            key, target = self._target(url)
+            stats = self._host_stats(key[1])
+            started = time.perf_counter()
+            try:
+                resp, data = self._send(key, method, target, body, request_headers, read_timeout, stats)
+            except TransportError:
+                self._timed(stats, started, failed=True)
+                raise
+            self._timed(stats, started)
+
+            location = resp.getheader("Location")
+            if resp.status in (301, 302, 303, 307, 308) and location and method in ("GET", "HEAD"):
+                url = urllib.parse.urljoin(url, location)
+                continue
+
+            try:
+                data = _decode_body(resp.headers, data)
+            except (OSError, EOFError, zlib.error) as err:
+                raise TransportError(f"could not decode response body: {err}") from err
+            if resp.status >= 400:
+                stats.error()
+                raise HTTPError(url, resp.status, resp.headers, data)
+            return Response(url, resp.status, resp.headers, data)
+        raise TransportError(f"too many redirects for {url}")
+
+    def stream(self, method, url, headers=None, body=None, timeout=None):
+        """Send a request and return a StreamResponse once headers arrive.
+
+        The body is requested uncompressed so it can be read line by line;
+        ``timeout`` bounds each read, not the whole body.  Latency is
+        recorded as time to headers.  No redirects are followed.
+        """
+        read_timeout = self.read_timeout if timeout is None else timeout
+        request_headers, body = self._prepare(headers, body, "identity")
+        key, target = self._target(url)
+        stats = self._host_stats(key[1])
+        started = time.perf_counter()
+        try:
+            conn, resp = self._open(key, method, target, body, request_headers, read_timeout, stats)
+        except TransportError:
+            self._timed(stats, started, failed=True)
+            raise
+        self._timed(stats, started)
+
+        if resp.status >= 400:
+            stats.error()
+            try:
+                data = _decode_body(resp.headers, resp.read())
+            except (OSError, EOFError, zlib.error, http.client.HTTPException):
+                data = b""
+            finally:
+                conn.close()
+            raise HTTPError(url, resp.status, resp.headers, data)
+        return StreamResponse(self, key, conn, resp, url)
+
+    # --- asyncio ---
+    #
+    # Coroutines go through httpx.AsyncClient rather than the blocking pool:
+    # one client per event loop (its connections belong to that loop), with
+    # the same limits, timeouts, errors and per-host latency stats.
+
+    def _async_client(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._check_pid()
+            for owner in [owner for owner in self._async if owner.is_closed()]:
+                del self._async[owner]
+            async_client = self._async.get(loop)
+            if async_client is None:
+                async_client = self._async[loop] = httpx.AsyncClient(
+                    headers={"User-Agent": USER_AGENT},
+                    timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+                    limits=httpx.Limits(
+                        max_keepalive_connections=self.max_idle_per_host,
+                        keepalive_expiry=self.idle_seconds
+                    ),
+                    max_redirects=MAX_REDIRECTS
+                )
+            return async_client
+
+    async def arequest(self, method, url, headers=None, body=None, timeout=None):
+        """``request()`` for coroutines: same Response, errors and stats."""
+        read_timeout = self.read_timeout if timeout is None else timeout
+        request_headers, body = self._prepare(headers, body, "gzip")
+        stats = self._host_stats(urllib.parse.urlsplit(url).hostname or "")
+        started = time.perf_counter()
+        try:
+            resp = await self._async_client().request(
+                method,
+                url,
+                headers=request_headers,
+                content=body,
+                timeout=httpx.Timeout(read_timeout, connect=self.connect_timeout),
+                follow_redirects=method in ("GET", "HEAD")
+            )
+        except (httpx.TransportError, httpx.TooManyRedirects, httpx.DecodingError,
+                httpx.InvalidURL) as err:
+            self._timed(stats, started, failed=True)
+            raise TransportError(str(err) or err.__class__.__name__) from err
+        self._timed(stats, started)
+
+        url = str(resp.url)
+        if resp.status_code >= 400:
+            stats.error()
+            raise HTTPError(url, resp.status_code, resp.headers, resp.content)
+        return Response(url, resp.status_code, resp.headers, resp.content)
+
+    async def aclose(self):
+        """Close this event loop's connections (for loops that are about to end)."""
+        with self._lock:
+            async_client = self._async.pop(asyncio.get_running_loop(), None)
+        if async_client is not None:
+            await async_client.aclose()
+
+
+client = HTTPClient()
+
+
+def request(method, url, headers=None, body=None, timeout=None):
+    return client.request(method, url, headers=headers, body=body, timeout=timeout)
+
+
+def stream(method, url, headers=None, body=None, timeout=None):
+    return client.stream(method, url, headers=headers, body=body, timeout=timeout)
+
+
+async def arequest(method, url, headers=None, body=None, timeout=None):
+    return await client.arequest(method, url, headers=headers, body=body, timeout=timeout)
+
+
+def stats():
+    return client.stats()
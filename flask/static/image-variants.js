@@ -0,0 +1,47 @@
+// Markup for uploads rendered by the background image pipeline.  An
+// upload's ``variants`` map is {width: {format: path}} and stays empty
+// until the upload has been processed, so every helper falls back to the
+// original image.
+(function () {
+  function variantSrcset(variants, format) {
+    return Object.keys(variants || {})
+      .filter(function (width) { return variants[width][format]; })
+      .map(function (width) { return "/" + variants[width][format] + " " + width + "w"; })
+      .join(", ");
+  }
+
+  function pictureHtml(image, variants, alt, sizes) {
+    var sources = ["avif", "webp"]
+      .map(function (format) {
+        var srcset = variantSrcset(variants, format);
+        if (!srcset) return "";
+        return '<source type="image/' + format + '" srcset="' + srcset + '" sizes="' + sizes + '">';
+      })
+      .join("");
+    var fallback = variantSrcset(variants, "jpeg") || variantSrcset(variants, "png");
+    var srcset = fallback ? ' srcset="' + fallback + '" sizes="' + sizes + '"' : "";
+    return "<picture>" + sources + '<img src="/' + image + '"' + srcset + ' alt="' + alt + '" loading="lazy"></picture>';
+  }
+
+  // Smallest rendered variant that still covers cssWidth device pixels.
+  function pickVariant(variants, cssWidth) {
+    var needed = cssWidth * (window.devicePixelRatio || 1);
+    var widths = Object.keys(variants || {}).map(Number).sort(function (a, b) { return a - b; });
+    if (!widths.length) return "";
+    var chosen = widths[widths.length - 1];
+    for (var i = 0; i < widths.length; i++) {
+      if (widths[i] >= needed) {
+        chosen = widths[i];
+        break;
+      }
+    }
+    var formats = variants[chosen];
+    return formats.webp || formats.jpeg || formats.png || "";
+  }
+
+  window.ImageVariants = {
+    srcset: variantSrcset,
+    pictureHtml: pictureHtml,
+    pick: pickVariant
+  };
+})();
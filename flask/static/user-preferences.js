@@ -1,6 +1,7 @@
 (function () {
   var notificationTriggerEl = null;
   var aiMessages = [];
+  var AI_CONVERSATION_KEY = "socialsync_ai_conversation";
 
   function escapeHtml(value) {
     return String(value || "")
@@ -138,8 +139,8 @@
 
     fetchNotifications()
       .then(function (data) {
-        var count = data && !data.disabled && Array.isArray(data.items) ? data.items.length : 0;
-        setNotificationBadgeCount(count);
+        // Opening the drawer marks everything listed as seen.
+        setNotificationBadgeCount(0);
         renderNotifications(data);
       })
       .catch(function () {
@@ -149,9 +150,14 @@
   }
 
   function refreshNotificationBadge() {
-    fetchNotifications()
+    // Count-only endpoint; unchanged counts revalidate as 304 via ETag.
+    fetch("/api/notifications/count")
+      .then(function (res) {
+        if (!res.ok) throw new Error("Notifications unavailable");
+        return res.json();
+      })
       .then(function (data) {
-        var count = data && !data.disabled && Array.isArray(data.items) ? data.items.length : 0;
+        var count = data && !data.disabled ? data.unseen_notifications : 0;
         setNotificationBadgeCount(count);
       })
       .catch(function () {
@@ -274,6 +280,7 @@
     backdrop.classList.add("open");
     document.body.classList.add("ai-assistant-open");
     renderAiAssistantMessages();
+    restoreAiConversation();
 
     var input = document.getElementById("aiAssistantInput");
     if (input) input.focus();
@@ -313,6 +320,40 @@
     body.scrollTop = body.scrollHeight;
   }
 
+  function getAiConversationId() {
+    try {
+      return sessionStorage.getItem(AI_CONVERSATION_KEY) || "";
+    } catch (err) {
+      return "";
+    }
+  }
+
+  function setAiConversationId(id) {
+    try {
+      if (id) sessionStorage.setItem(AI_CONVERSATION_KEY, String(id));
+      else sessionStorage.removeItem(AI_CONVERSATION_KEY);
+    } catch (err) {
+      // Private mode: the conversation just won't survive a page load.
+    }
+  }
+
+  // The server keeps the conversation; after a page load, show its recent turns.
+  function restoreAiConversation() {
+    var conversationId = getAiConversationId();
+    if (aiMessages.length || !conversationId) return;
+    fetch("/api/ai/conversations/" + encodeURIComponent(conversationId))
+      .then(function (res) {
+        if (res.status === 404) setAiConversationId("");
+        return res.ok ? res.json() : null;
+      })
+      .then(function (payload) {
+        if (!payload || aiMessages.length) return;
+        aiMessages = payload.messages || [];
+        renderAiAssistantMessages();
+      })
+      .catch(function () {});
+  }
+
   function sendAiAssistantMessage() {
     var input = document.getElementById("aiAssistantInput");
     var sendBtn = document.getElementById("aiAssistantSendBtn");
@@ -321,44 +362,42 @@
     var text = String(input.value || "").trim();
     if (!text) return;
 
-    var history = aiMessages.slice(-10);
     aiMessages.push({ role: "user", content: text });
     input.value = "";
     renderAiAssistantMessages();
 
     sendBtn.disabled = true;
-    fetch("/api/ai/chat", {
+    var reply = null;
+    fetch("/api/ai/chat/stream", {
       method: "POST",
       headers: { "Content-Type": "application/json" },
       body: JSON.stringify({
         message: text,
-        history: history
+        conversation_id: getAiConversationId() || null
       })
     })
       .then(function (res) {
-        return res.json().then(function (payload) {
-          return { ok: res.ok, payload: payload };
-        });
-      })
-      .then(function (result) {
-        if (!result.ok) {
-          var msg = result.payload && result.payload.error ? result.payload.error : "AI request failed";
-          if (result.payload && result.payload.details) {
-            msg += " - " + result.payload.details;
-          }
-          throw new Error(msg);
+        if (res.status === 404) setAiConversationId("");
+        if (!res.ok || !res.body) {
+          return res.json().then(function (payload) {
+            var msg = payload && payload.error ? payload.error : "AI request failed";
+            if (payload && payload.details) {
+              msg += " - " + payload.details;
+            }
+            throw new Error(msg);
+          });
         }
-        aiMessages.push({
-          role: "assistant",
-          content: (result.payload && result.payload.reply) || "No response"
-        });
-        renderAiAssistantMessages();
+        reply = { role: "assistant", content: "" };
+        aiMessages.push(reply);
+        return readAiStream(res.body.getReader(), reply);
       })
       .catch(function (err) {
-        aiMessages.push({
-          role: "assistant",
-          content: "Error: " + (err.message || "Could not reach AI")
-        });
+        var content = "Error: " + (err.message || "Could not reach AI");
+        if (reply) {
+          reply.content = reply.content ? reply.content + "\n\n" + content : content;
+        } else {
+          aiMessages.push({ role: "assistant", content: content });
+        }
         renderAiAssistantMessages();
       })
       .finally(function () {
@@ -366,6 +405,54 @@
       });
   }
 
+  // Reads the server-sent events from /api/ai/chat/stream, growing the
+  // assistant bubble as each delta arrives.
+  function readAiStream(reader, reply) {
+    var decoder = new TextDecoder();
+    var buffer = "";
+
+    function handleEvent(block) {
+      var event = "message";
+      var data = "";
+      block.split("\n").forEach(function (line) {
+        if (line.indexOf("event:") === 0) event = line.slice(6).trim();
+        else if (line.indexOf("data:") === 0) data += line.slice(5).trim();
+      });
+      if (!data) return;
+      var payload = JSON.parse(data);
+      if (payload.conversation_id) setAiConversationId(payload.conversation_id);
+      if (event === "delta") {
+        reply.content += payload.text || "";
+      } else if (event === "done") {
+        reply.content = payload.reply || reply.content || "No response";
+      } else if (event === "error") {
+        throw new Error(payload.error + (payload.details ? " - " + payload.details : ""));
+      } else {
+        return;
+      }
+      renderAiAssistantMessages();
+    }
+
+    function pump() {
+      return reader.read().then(function (result) {
+        if (result.done) {
+          if (!reply.content) reply.content = "No response";
+          renderAiAssistantMessages();
+          return;
+        }
+        buffer += decoder.decode(result.value, { stream: true });
+        var boundary;
+        while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+          handleEvent(buffer.slice(0, boundary));
+          buffer = buffer.slice(boundary + 2);
+        }
+        return pump();
+      });
+    }
+
+    return pump();
+  }
+
   function initAiAssistant() {
     if (document.querySelector('[data-ai-assistant-trigger="true"]')) return;
 
@@ -459,8 +546,8 @@
     return "/" + value;
   }
 
-  function applyAvatarToNav(profileImage) {
-    var avatarUrl = normalizeAvatarUrl(profileImage);
+  function applyAvatarToNav(profileImage, variants) {
+    var avatarUrl = normalizeAvatarUrl(window.ImageVariants.pick(variants, 32) || profileImage);
     var avatars = document.querySelectorAll(".top-nav .avatar");
 
     Array.prototype.forEach.call(avatars, function (avatar) {
@@ -495,7 +582,7 @@
         return res.json();
       })
       .then(function (data) {
-        applyAvatarToNav(data.profile_image || "");
+        applyAvatarToNav(data.profile_image || "", data.profile_image_variants);
       })
       .catch(function () {
         applyAvatarToNav("");
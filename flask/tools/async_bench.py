@@ -0,0 +1,159 @@
+"""Compare /api/ai/chat throughput under the sync and async entry points.
+
+Starts the Gemini stand-in with a fixed answer delay, then for each
+server (gunicorn sync workers on app:app, uvicorn on asgi:application)
+signs up one account per client, fires ``--requests`` chats from
+``--clients`` concurrent clients and reports requests per second and
+latency.  Caching and admission limits are turned off so every request
+really waits on the stand-in.
+
+    python tools/async_bench.py --delay 0.5 --clients 64 --requests 256 --workers 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(TOOLS_DIR)
+sys.path.insert(0, APP_DIR)
+sys.path.insert(0, TOOLS_DIR)
+
+import gemini_standin  # noqa: E402
+import http_client  # noqa: E402
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _server_command(kind, port, workers):
+    if kind == "sync":
+        # Plain sync workers, overriding gunicorn.conf.py's threaded ones.
+        return [sys.executable, "-m", "gunicorn", "--chdir", APP_DIR, "-k", "sync", "--threads", "1",
+                "-w", str(workers), "-b", f"127.0.0.1:{port}", "--log-level", "warning", "app:app"]
+    return [sys.executable, "-m", "uvicorn", "--app-dir", APP_DIR, "--workers", str(workers),
+            "--port", str(port), "--log-level", "warning", "asgi:application"]
+
+
+async def _wait_ready(client, base, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            await client.arequest("GET", base + "/login", timeout=2)
+            return
+        except (http_client.TransportError, http_client.HTTPError):
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"server at {base} did not come up")
+
+
+async def _session_cookie(client, base, index):
+    account = {"username": f"bench{index}", "email": f"bench{index}@example.com", "password": "bench123"}
+    form = {"Content-Type": "application/x-www-form-urlencoded"}
+    body = urllib.parse.urlencode(account)
+    await client.arequest("POST", base + "/signup", headers=form, body=body)
+    resp = await client.arequest("POST", base + "/login", headers=form, body=body)
+    cookie = resp.headers.get("Set-Cookie") or ""
+    if "session=" not in cookie:
+        raise RuntimeError("login did not set a session cookie")
+    return cookie.split(";", 1)[0]
+
+
+async def _run_load(base, clients, total):
+    client = http_client.HTTPClient(max_idle_per_host=clients, read_timeout=60)
+    await _wait_ready(client, base)
+    cookies = [await _session_cookie(client, base, i) for i in range(clients)]
+
+    latencies = []
+    statuses = {}
+    remaining = iter(range(total))
+
+    async def worker(cookie):
+        for n in remaining:
+            started = time.perf_counter()
+            try:
+                resp = await client.arequest(
+                    "POST", base + "/api/ai/chat",
+                    headers={"Content-Type": "application/json", "Cookie": cookie},
+                    body=json.dumps({"message": f"benchmark message {n}"})
+                )
+                status = resp.status
+            except http_client.HTTPError as err:
+                status = err.code
+            except http_client.TransportError:
+                status = "transport"
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(cookie) for cookie in cookies))
+    elapsed = time.perf_counter() - started
+    await client.aclose()
+    return elapsed, sorted(latencies), statuses
+
+
+def _bench(kind, args, standin_url):
+    workdir = tempfile.mkdtemp(prefix=f"async-bench-{kind}-")
+    env = dict(
+        os.environ,
+        DATABASE_PATH=os.path.join(workdir, "users.db"),
+        GOOGLE_API_KEY="bench",
+        GOOGLE_AI_BASE_URL=standin_url,
+        AI_MAX_CONCURRENT="100000",
+        AI_USER_RATE_PER_MINUTE="1000000",
+        AI_CACHE_MAX_TEMPERATURE="-1",
+        METRICS_DEMO_SEED="0",
+    )
+    # Migrate once up front rather than racing in every worker.
+    subprocess.run([sys.executable, "-c", "import app"], cwd=APP_DIR, env=env, check=True,
+                   stdout=subprocess.DEVNULL)
+    port = _free_port()
+    server = subprocess.Popen(_server_command(kind, port, args.workers), cwd=workdir, env=env,
+                              stdout=subprocess.DEVNULL)
+    try:
+        elapsed, latencies, statuses = asyncio.run(
+            _run_load(f"http://127.0.0.1:{port}", args.clients, args.requests)
+        )
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000 if latencies else 0.0
+
+    codes = " ".join(f"{code}:{count}" for code, count in sorted(statuses.items(), key=str))
+    print(f"{kind:5}  {args.requests / elapsed:8.1f} req/s  p50 {pct(0.5):7.1f} ms  "
+          f"p95 {pct(0.95):7.1f} ms  wall {elapsed:6.2f}s  statuses {codes}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--delay", type=float, default=0.5, help="stand-in seconds per answer")
+    parser.add_argument("--clients", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=256)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--servers", default="sync,async", help="comma separated: sync, async")
+    args = parser.parse_args()
+
+    state = gemini_standin.StandinState(delay=args.delay)
+    standin = gemini_standin.make_server(state)
+    threading.Thread(target=standin.serve_forever, daemon=True).start()
+    standin_url = f"http://127.0.0.1:{standin.server_port}/v1beta"
+
+    print(f"stand-in delay {args.delay:.2f}s  clients {args.clients}  requests {args.requests}  "
+          f"workers {args.workers}")
+    for kind in args.servers.split(","):
+        _bench(kind.strip(), args, standin_url)
+
+
+if __name__ == "__main__":
+    main()
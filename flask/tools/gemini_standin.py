@@ -0,0 +1,161 @@
+"""Local stand-in for the Gemini REST API, for exercising /api/ai/chat offline.
+
+Serves GET /v1beta/models and POST /v1beta/models/<model>:generateContent
+(and :streamGenerateContent?alt=sse, one word per chunk) with per-model
+failure modes and optional delays.  Point the app at it with
+GOOGLE_AI_BASE_URL:
+
+    python tools/gemini_standin.py --port 8765 --not-found gemini-2.0-flash \\
+        --quota gemini-2.0-flash-lite:30 --delay 0.2
+    GOOGLE_API_KEY=test GOOGLE_AI_BASE_URL=http://127.0.0.1:8765/v1beta flask --app app run
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+DEFAULT_MODELS = ["gemini-2.0-flash", "gemini-2.0-flash-lite", "gemini-1.5-flash", "gemini-1.5-pro"]
+
+
+class StandinState:
+    def __init__(self, models=None, not_found=(), quota=None, delay=0.0, chunk_delay=0.05):
+        self.models = list(models or DEFAULT_MODELS)
+        self.not_found = set(not_found)
+        self.quota = dict(quota or {})  # model -> retryDelay seconds
+        self.delay = delay
+        self.chunk_delay = chunk_delay
+        self.calls = []                 # (method, model) in arrival order
+        self.streams_cancelled = 0
+        self.lock = threading.Lock()
+
+    def record(self, method, model):
+        with self.lock:
+            self.calls.append((method, model))
+
+
+def _reply_text(body):
+    contents = body.get("contents") or []
+    last = (contents[-1].get("parts") or [{}])[0].get("text", "") if contents else ""
+    return f"Stand-in reply to: {last}"
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def _send_json(self, status, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            path = self.path.split("?", 1)[0]
+            if path.rstrip("/").endswith("/models"):
+                state.record("list", None)
+                self._send_json(200, {"models": [
+                    {"name": f"models/{name}", "supportedGenerationMethods": ["generateContent"]}
+                    for name in state.models
+                ]})
+                return
+            self._send_json(404, {"error": {"code": 404, "message": "Not found", "status": "NOT_FOUND"}})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+            path = self.path.split("?", 1)[0]
+            name, _, method = path.rsplit("/", 1)[-1].partition(":")
+            state.record(method, name)
+            if state.delay:
+                time.sleep(state.delay)
+
+            if name in state.not_found or name not in state.models:
+                self._send_json(404, {"error": {
+                    "code": 404, "message": f"models/{name} is not found", "status": "NOT_FOUND"
+                }})
+                return
+            if name in state.quota:
+                self._send_json(429, {"error": {
+                    "code": 429,
+                    "message": "Resource has been exhausted (e.g. check quota).",
+                    "status": "RESOURCE_EXHAUSTED",
+                    "details": [{
+                        "@type": "type.googleapis.com/google.rpc.RetryInfo",
+                        "retryDelay": f"{state.quota[name]}s"
+                    }]
+                }})
+                return
+            if method == "streamGenerateContent":
+                self._stream(_reply_text(body))
+                return
+            self._send_json(200, {"candidates": [{
+                "content": {"role": "model", "parts": [{"text": _reply_text(body)}]}
+            }]})
+
+        def _stream(self, text):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            words = text.split(" ")
+            try:
+                for index, word in enumerate(words):
+                    piece = word if index == 0 else " " + word
+                    event = "data: " + json.dumps({"candidates": [{
+                        "content": {"role": "model", "parts": [{"text": piece}]}
+                    }]}) + "\r\n\r\n"
+                    data = event.encode("utf-8")
+                    self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                    self.wfile.flush()
+                    time.sleep(state.chunk_delay)
+                self.wfile.write(b"0\r\n\r\n")
+            except OSError:
+                with state.lock:
+                    state.streams_cancelled += 1
+                self.close_connection = True
+
+    return Handler
+
+
+class StandinServer(ThreadingHTTPServer):
+    # The default listen backlog of 5 stalls concurrent benchmark clients.
+    request_queue_size = 256
+
+
+def make_server(state, host="127.0.0.1", port=0):
+    server = StandinServer((host, port), make_handler(state))
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--not-found", action="append", default=[], metavar="MODEL")
+    parser.add_argument("--quota", action="append", default=[], metavar="MODEL:SECONDS")
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds before each answer")
+    parser.add_argument("--chunk-delay", type=float, default=0.05, help="seconds between streamed chunks")
+    args = parser.parse_args()
+
+    quota = {}
+    for item in args.quota:
+        name, _, seconds = item.partition(":")
+        quota[name] = int(seconds or 30)
+    state = StandinState(
+        not_found=args.not_found, quota=quota, delay=args.delay, chunk_delay=args.chunk_delay
+    )
+    server = make_server(state, port=args.port)
+    print(f"Gemini stand-in on http://127.0.0.1:{server.server_port}/v1beta")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Exercise /api/analytics/overview against stub sources with injected latency.
+
+Replaces the registered analytics sources with stubs that sleep for a given
+delay (or raise) before answering, then calls the endpoint through the test
+client and reports wall time and which sources came back partial.
+
+    python tools/overview_bench.py --delays 0.1,0.4,0.8,5 --fail 1
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--delays", default="0.1,0.4,0.8,5", help="comma separated seconds per stub")
+    parser.add_argument("--fail", type=int, default=0, help="number of extra stubs that raise")
+    parser.add_argument("--timeout", type=float, default=1.0, help="per-source timeout")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix="overview-bench-"))
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import app as app_module
+
+    class StubSource(app_module.AnalyticsSource):
+        def __init__(self, name, delay, fail=False):
+            self.name = name
+            self.delay = delay
+            self.fail = fail
+            self.timeout = args.timeout
+
+        def fetch(self, user_id):
+            time.sleep(self.delay)
+            if self.fail:
+                raise RuntimeError("stub failure")
+            labels = ["Mon", "Tue"]
+            return {
+                "kpis": {"followers": 100, "followers_change": 5, "likes": 10, "likes_change": 1,
+                         "impressions": 1000, "impressions_change": 50,
+                         "engagement_rate": 1.0, "engagement_rate_change": 0.1},
+                "labels": labels,
+                "series": {"followers": [95, 100]},
+            }
+
+    delays = [float(d) for d in args.delays.split(",") if d]
+    stubs = [StubSource(f"stub{i}", delay) for i, delay in enumerate(delays)]
+    stubs += [StubSource(f"failing{i}", 0.05, fail=True) for i in range(args.fail)]
+    app_module.analytics_sources[:] = stubs
+
+    client = app_module.app.test_client()
+    account = {"username": "bench", "email": "bench@example.com", "password": "bench123"}
+    client.post("/signup", data=account)
+    client.post("/login", data=account)
+
+    print(f"sources: {len(stubs)}  sequential worst case: {sum(delays) + 0.05 * args.fail:.2f}s  "
+          f"timeout: {args.timeout:.2f}s")
+    for round_no in range(args.rounds):
+        started = time.perf_counter()
+        data = client.get("/api/analytics/overview").get_json()
+        elapsed = time.perf_counter() - started
+        missing = ", ".join(f"{m['source']}({m['reason']})" for m in data["missing"]) or "-"
+        print(f"round {round_no + 1}: {elapsed:.2f}s  returned={sorted(data['sources'])}  "
+              f"missing={missing}  followers={data['kpis']['followers']}")
+
+
+if __name__ == "__main__":
+    main()
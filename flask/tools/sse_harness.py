@@ -0,0 +1,128 @@
+"""Hold many idle /api/inbox/stream connections and report memory per subscriber.
+
+Runs the app in-process on a threaded werkzeug server against a throwaway
+database, logs one user in, opens N raw SSE connections with that session
+and compares process RSS and Python heap before and after.
+
+    python tools/sse_harness.py --connections 2000
+"""
+import argparse
+import http.cookiejar
+import os
+import resource
+import socket
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.parse
+import urllib.request
+
+
+def rss_bytes():
+    with open("/proc/self/status", "r", encoding="utf-8") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def login(base_url):
+    jar = http.cookiejar.CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
+    account = {"username": "harness", "email": "harness@example.com", "password": "harness1"}
+    opener.open(base_url + "/signup", urllib.parse.urlencode(account).encode("utf-8"))
+    opener.open(base_url + "/login", urllib.parse.urlencode(account).encode("utf-8"))
+    cookie = "; ".join(f"{c.name}={c.value}" for c in jar)
+    if "session=" not in cookie:
+        raise SystemExit("login failed")
+    return cookie
+
+
+def open_stream(port, cookie):
+    sock = socket.create_connection(("127.0.0.1", port))
+    sock.sendall(
+        (
+            "GET /api/inbox/stream HTTP/1.1\r\n"
+            "Host: 127.0.0.1\r\n"
+            f"Cookie: {cookie}\r\n"
+            "Accept: text/event-stream\r\n\r\n"
+        ).encode("ascii")
+    )
+    head = b""
+    while b"retry:" not in head:
+        chunk = sock.recv(4096)
+        if not chunk:
+            raise RuntimeError("stream closed during handshake")
+        head += chunk
+    return sock
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--connections", type=int, default=2000)
+    parser.add_argument("--hold", type=float, default=2.0, help="seconds to hold before measuring")
+    args = parser.parse_args()
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = min(hard, args.connections * 2 + 256)
+    if soft < wanted:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (wanted, hard))
+
+    os.chdir(tempfile.mkdtemp(prefix="sse-harness-"))
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import app as app_module
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server(
+        "127.0.0.1", 0, app_module.app, threaded=True, request_handler=QuietHandler
+    )
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_port
+    cookie = login(f"http://127.0.0.1:{port}")
+
+    tracemalloc.start()
+    heap_before = tracemalloc.get_traced_memory()[0]
+    rss_before = rss_bytes()
+
+    sockets = []
+    started = time.perf_counter()
+    for _ in range(args.connections):
+        sockets.append(open_stream(port, cookie))
+    elapsed = time.perf_counter() - started
+    time.sleep(args.hold)
+
+    heap_after = tracemalloc.get_traced_memory()[0]
+    rss_after = rss_bytes()
+    subscribers = app_module.inbox_events.subscriber_count()
+
+    user_id = next(iter(app_module.inbox_events._subscribers))
+    app_module.inbox_events.publish(user_id, "new-message", {"probe": True})
+    delivered = 0
+    for sock in sockets[:50]:
+        sock.settimeout(5)
+        if b"new-message" in sock.recv(4096):
+            delivered += 1
+
+    count = max(1, len(sockets))
+    print(f"connections opened : {len(sockets)} in {elapsed:.2f}s")
+    print(f"hub subscribers    : {subscribers}")
+    print(f"RSS delta          : {(rss_after - rss_before) / 1024 / 1024:.1f} MiB "
+          f"({(rss_after - rss_before) / count / 1024:.1f} KiB per subscriber)")
+    print(f"Python heap delta  : {(heap_after - heap_before) / 1024 / 1024:.1f} MiB "
+          f"({(heap_after - heap_before) / count / 1024:.1f} KiB per subscriber)")
+    print(f"probe delivered    : {delivered}/{min(50, len(sockets))}")
+
+    for sock in sockets:
+        sock.close()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()